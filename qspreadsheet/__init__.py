@@ -13,8 +13,19 @@ if pandas.__version__ < '1.0.0':
 from . import resources_rc
 from .common import *
 from .custom_widgets import *
+from .predicates import *
+from .sketches import *
 from .sort_filter_proxy import *
 from .delegates import *
 from .header_view import *
+from .undo import *
 from .dataframe_model import *
-from .dataframe_view import *
\ No newline at end of file
+from .journal import *
+from .autosave import *
+from .dataframe_view import *
+from .mapped_model import *
+from .async_source import *
+from .shared_table import *
+from .arrow_stream import *
+from .sqlite_model import *
+from .sql_writeback import *
@@ -0,0 +1,131 @@
+import logging
+from typing import Any, List
+
+import numpy as np
+import pandas as pd
+
+from qspreadsheet.common import DF
+
+logger = logging.getLogger(__name__)
+
+_MASKED_ARRAYS = tuple(getattr(pd.arrays, name)
+                       for name in ('IntegerArray', 'FloatingArray', 'BooleanArray')
+                       if hasattr(pd.arrays, name))
+
+
+class _ColumnBuffer():
+    """Growable columnar storage with amortized O(1) row appends.
+
+        Each column is kept in a preallocated array with spare capacity,
+        which is doubled when full. `frame` returns a `DataFrame` over the
+        live rows without copying the data (requires pandas >= 2.0).
+        Dropping rows from the front only moves the start offset.
+
+        NumPy dtypes and pandas masked dtypes (`Int64`, `Float64`, `boolean`)
+        are stored natively. Other extension dtypes are stored as `object`
+        and converted back to their dtype in `frame`, which costs a copy.
+    """
+    GROWTH_FACTOR = 2
+    MIN_CAPACITY = 1024
+
+    def __init__(self, df: DF) -> None:
+        self.columns = df.columns
+        self.dtypes = list(df.dtypes)
+        self._start = 0
+        self._size = 0
+        self._capacity = max(self.MIN_CAPACITY, df.index.size * self.GROWTH_FACTOR)
+        self._values: List[np.ndarray] = []
+        self._masks: List[Any] = []
+        for dtype in self.dtypes:
+            values, mask = self._allocate(dtype, self._capacity)
+            self._values.append(values)
+            self._masks.append(mask)
+        self.append(df)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def append(self, df: DF):
+        """Copies `df` rows at the end of the buffer"""
+        count = df.index.size
+        if self._start + self._size + count > self._capacity:
+            needed = self._size + count
+            capacity = self._capacity
+            while capacity < needed:
+                capacity *= self.GROWTH_FACTOR
+            self._reallocate(capacity)
+
+        stop = self._start + self._size
+        positions = slice(stop, stop + count)
+        for ndx in range(len(self.dtypes)):
+            self._put(ndx, positions, df.iloc[:, ndx])
+        self._size += count
+
+    def put(self, ndx: int, rows: np.ndarray, values: Any):
+        """Writes `values` in column `ndx`, at given row positions"""
+        self._put(ndx, rows + self._start, pd.Series(values).astype(self.dtypes[ndx]))
+
+    def is_view(self, ndx: int) -> bool:
+        """'True' if column `ndx` of `frame` is a view of the buffer,
+            'False' if it's a converted copy, which `put` doesn't reach
+        """
+        return self._masks[ndx] is not None or isinstance(self.dtypes[ndx], np.dtype)
+
+    def _put(self, ndx: int, positions: Any, column: Any):
+        mask = self._masks[ndx]
+        if mask is not None:
+            mask[positions] = column.isna().values
+            column = column.to_numpy(dtype=self._values[ndx].dtype,
+                                     na_value=self._values[ndx].dtype.type(0))
+        self._values[ndx][positions] = np.asarray(column)
+
+    def drop_front(self, count: int):
+        """Drops the first `count` rows"""
+        count = min(count, self._size)
+        self._start += count
+        self._size -= count
+
+    def frame(self) -> DF:
+        """`DataFrame` over the live rows of the buffer"""
+        data = {ndx: self._column(ndx) for ndx in range(len(self.dtypes))}
+        df = pd.DataFrame(data, index=pd.RangeIndex(self._size), copy=False)
+        df.columns = self.columns
+        return df
+
+    def _column(self, ndx: int) -> Any:
+        live = slice(self._start, self._start + self._size)
+        dtype = self.dtypes[ndx]
+        values = self._values[ndx][live]
+        mask = self._masks[ndx]
+        if mask is not None:
+            return dtype.construct_array_type()(values, mask[live])
+        if isinstance(dtype, np.dtype):
+            return values
+        return pd.array(values, dtype=dtype)
+
+    def _reallocate(self, capacity: int):
+        """Moves live rows to new arrays.
+
+            NOTE: Never compact in place, frames returned by `frame`
+            may still be referencing the current arrays.
+        """
+        live = slice(self._start, self._start + self._size)
+        for ndx, dtype in enumerate(self.dtypes):
+            values, mask = self._allocate(dtype, capacity)
+            values[: self._size] = self._values[ndx][live]
+            if mask is not None:
+                mask[: self._size] = self._masks[ndx][live]
+            self._values[ndx] = values
+            self._masks[ndx] = mask
+        self._start = 0
+        self._capacity = capacity
+
+    @staticmethod
+    def _allocate(dtype: Any, capacity: int):
+        if isinstance(dtype, np.dtype):
+            return np.empty(capacity, dtype=dtype), None
+        if issubclass(dtype.construct_array_type(), _MASKED_ARRAYS):
+            return (np.zeros(capacity, dtype=dtype.numpy_dtype),
+                    np.ones(capacity, dtype=bool))
+        return np.empty(capacity, dtype=object), None
@@ -0,0 +1,264 @@
+import logging
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from qspreadsheet.common import DF, changed_mask
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeSet(NamedTuple):
+    '''User changes of `DataFrameModel` data, since the last `mark_clean`.
+
+        All frames are indexed by row id, see `DataFrameModel.row_ids`.
+
+        inserted : DataFrame. Current values of the inserted rows
+
+        updated : DataFrame. Current values of the rows with edited cells
+
+        original : DataFrame. Original values of the `updated` rows
+
+        deleted : DataFrame. Original values of the deleted rows
+
+        cells : Dict[column, np.ndarray]. Row ids of the edited cells, per column
+    '''
+    inserted: DF
+    updated: DF
+    original: DF
+    deleted: DF
+    cells: Dict[Any, np.ndarray]
+
+    @property
+    def is_empty(self) -> bool:
+        return self.inserted.empty and self.updated.empty and self.deleted.empty
+
+    @property
+    def row_ids(self) -> np.ndarray:
+        '''Row ids of all changed rows'''
+        return np.concatenate([self.inserted.index.values,
+                               self.updated.index.values,
+                               self.deleted.index.values]).astype(np.int64)
+
+
+class _ChangeTracker():
+    '''Tracks the user changes of the model data, by row id.
+
+        Every row gets an id, which is kept while rows are inserted,
+        removed or sorted. Edited cells are flagged in a dirty bitmap
+        per column (indexed by row id), and their original values are
+        kept, so that a cell edited back to its original value is clean
+        again. Inserted and deleted rows are kept as sets of row ids.
+    '''
+
+    def __init__(self, size: int) -> None:
+        self.row_ids = np.arange(size, dtype=np.int64)
+        self.next_id = size
+        self.inserted: Set[int] = set()
+        self._deleted: List[DF] = []
+        self._dirty: Dict[int, np.ndarray] = {}
+        self._original: Dict[int, Dict[int, Any]] = {}
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self.inserted or self._deleted or self._original)
+
+    def insert(self, at_index: int, count: int, committed: bool):
+        '''Gives new ids to the inserted rows. Rows from the data
+            source are `committed` and are not tracked as inserted.
+        '''
+        new_ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        self.row_ids = np.insert(self.row_ids, at_index, new_ids)
+        if not committed:
+            self.inserted.update(new_ids.tolist())
+
+    def delete(self, rows: DF, at_index: int):
+        '''Keeps the original values of `rows`, before the user deletes them'''
+        row_ids = self.row_ids[at_index: at_index + rows.index.size]
+        baseline = np.fromiter((row_id not in self.inserted for row_id in row_ids.tolist()),
+                               dtype=bool, count=row_ids.size)
+        if not baseline.any():
+            return
+        rows = rows.iloc[np.flatnonzero(baseline)].copy()
+        rows.index = row_ids[baseline]
+        for column, original in self._original.items():
+            for row_id in rows.index.intersection(list(original.keys())):
+                rows.at[row_id, rows.columns[column]] = original[row_id]
+        self._deleted.append(rows)
+
+    def remove(self, at_index: int, count: int):
+        '''Drops the ids of the removed rows'''
+        removed = self.row_ids[at_index: at_index + count]
+        self.row_ids = np.delete(self.row_ids, np.s_[at_index: at_index + count])
+        self._forget_rows(removed)
+
+    def remove_many(self, positions: np.ndarray):
+        '''Drops the ids of the removed rows at `positions`, at once'''
+        removed = self.row_ids[positions]
+        self.row_ids = np.delete(self.row_ids, positions)
+        self._forget_rows(removed)
+
+    def take(self, positions: np.ndarray):
+        '''Reorders the row ids, e.g. after sorting'''
+        self.row_ids = self.row_ids[positions]
+
+    def edit(self, row: int, column: int, old_value: Any, new_value: Any):
+        '''Records the user edit of a cell'''
+        old_values = np.empty(1, dtype=object)
+        old_values[0] = old_value
+        new_values = np.empty(1, dtype=object)
+        new_values[0] = new_value
+        self.edit_many(column, np.array([row]), old_values, new_values)
+
+    def edit_many(self, column: int, rows: np.ndarray, old_values: np.ndarray, new_values: np.ndarray):
+        '''Records the user edits of cells in `column`, vectorized'''
+        row_ids = self.row_ids[rows]
+        if self.inserted:
+            baseline = ~np.isin(row_ids, np.fromiter(self.inserted, dtype=np.int64))
+            row_ids, old_values, new_values = \
+                row_ids[baseline], old_values[baseline], new_values[baseline]
+        if row_ids.size == 0:
+            return
+        dirty = self._bitmap(column)
+        was_dirty = dirty[row_ids]
+
+        fresh = ~was_dirty
+        changed = changed_mask(pd.Series(old_values[fresh], dtype=object),
+                               pd.Series(new_values[fresh], dtype=object))
+        if changed.any():
+            changed_ids = row_ids[fresh][changed]
+            dirty[changed_ids] = True
+            self._original.setdefault(column, {}).update(
+                zip(changed_ids.tolist(), old_values[fresh][changed].tolist()))
+
+        edited_ids = row_ids[was_dirty]
+        if edited_ids.size:
+            original = self._original[column]
+            originals = np.empty(edited_ids.size, dtype=object)
+            originals[:] = [original[row_id] for row_id in edited_ids.tolist()]
+            # edited back to the original values
+            reverted = ~changed_mask(pd.Series(originals, dtype=object),
+                                     pd.Series(new_values[was_dirty], dtype=object))
+            if reverted.any():
+                self._forget_cells(column, edited_ids[reverted])
+
+    def inserted_mask(self, row_ids: np.ndarray) -> np.ndarray:
+        '''Which of `row_ids` are rows inserted by the user'''
+        if not self.inserted:
+            return np.zeros(row_ids.size, dtype=bool)
+        return np.isin(row_ids, np.fromiter(self.inserted, dtype=np.int64))
+
+    def restore(self, at_index: int, row_ids: np.ndarray, inserted: np.ndarray, rows: DF):
+        '''Restores the ids and the changes of removed rows, inserted again
+            at `at_index` (e.g. on undo). Rows deleted by the user are taken
+            back from the deleted rows, and their edited cells are dirty again.
+        '''
+        count = row_ids.size
+        self.row_ids[at_index: at_index + count] = row_ids
+        self.inserted.update(row_ids[inserted].tolist())
+
+        baseline = np.flatnonzero(~inserted)
+        if baseline.size == 0:
+            return
+        deleted = pd.concat(self._deleted) if self._deleted else rows.iloc[:0]
+        deleted = deleted[deleted.index.isin(row_ids[baseline])]
+        # rows whose deletion was already accepted don't exist anymore
+        accepted = baseline[~np.isin(row_ids[baseline], deleted.index)]
+        self.inserted.update(row_ids[accepted].tolist())
+        if deleted.empty:
+            return
+
+        self._deleted = [frame[~frame.index.isin(deleted.index)] for frame in self._deleted]
+        self._deleted = [frame for frame in self._deleted if not frame.empty]
+        positions = at_index + pd.Index(row_ids).get_indexer(deleted.index)
+        current = rows.iloc[positions - at_index]
+        for column in range(rows.columns.size):
+            self.edit_many(column, positions,
+                           _as_objects(deleted.iloc[:, column]), _as_objects(current.iloc[:, column]))
+
+    def commit_cells(self, column: int, rows: np.ndarray):
+        '''Cells written by the data source are not dirty anymore'''
+        if column in self._original:
+            self._forget_cells(column, self.row_ids[rows])
+
+    def is_cell_dirty(self, row: int, column: int) -> bool:
+        dirty = self._dirty.get(column)
+        if dirty is None:
+            return False
+        row_id = self.row_ids[row]
+        return row_id < dirty.size and bool(dirty[row_id])
+
+    def changes(self, df: DF, in_progress: np.ndarray) -> ChangeSet:
+        '''Extracts the changes, touching only the changed rows of `df`'''
+        cells = {df.columns[column]: np.flatnonzero(self._dirty[column])
+                 for column in self._original}
+        updated_ids = np.unique(np.concatenate(list(cells.values()))) \
+            if cells else np.empty(0, dtype=np.int64)
+        inserted_ids = np.array(sorted(self.inserted), dtype=np.int64)
+
+        positions = np.flatnonzero(np.isin(self.row_ids, np.r_[inserted_ids, updated_ids]))
+        positions = positions[~in_progress[positions]]
+        changed = df.iloc[positions].copy()
+        changed.index = self.row_ids[positions]
+
+        inserted = changed[changed.index.isin(inserted_ids)]
+        updated = changed[changed.index.isin(updated_ids)]
+        original = updated.copy()
+        for column, values in self._original.items():
+            column_values = pd.Series(values)
+            column_values = column_values[column_values.index.isin(original.index)]
+            if column_values.size:
+                original.iloc[original.index.get_indexer(column_values.index), column] = \
+                    column_values.values
+
+        deleted = pd.concat(self._deleted) if self._deleted else df.iloc[:0].copy()
+        return ChangeSet(inserted=inserted, updated=updated, original=original,
+                         deleted=deleted, cells=cells)
+
+    def discard(self, row_ids: Optional[Iterable[int]] = None):
+        '''Forgets the changes of `row_ids`, or all changes if 'None'.'''
+        if row_ids is None:
+            self.inserted.clear()
+            self._deleted = []
+            self._dirty.clear()
+            self._original.clear()
+            return
+
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        self._forget_rows(row_ids)
+        if self._deleted:
+            self._deleted = [rows[~rows.index.isin(row_ids)] for rows in self._deleted]
+            self._deleted = [rows for rows in self._deleted if not rows.empty]
+
+    def _forget_rows(self, row_ids: np.ndarray):
+        if row_ids.size == 0:
+            return
+        self.inserted.difference_update(row_ids.tolist())
+        for column in list(self._original):
+            self._forget_cells(column, row_ids)
+
+    def _forget_cells(self, column: int, row_ids: np.ndarray):
+        dirty = self._dirty[column]
+        dirty[row_ids[row_ids < dirty.size]] = False
+        original = self._original[column]
+        for row_id in row_ids.tolist():
+            original.pop(row_id, None)
+        if not original:
+            self._original.pop(column)
+
+    def _bitmap(self, column: int) -> np.ndarray:
+        dirty = self._dirty.get(column)
+        if dirty is None or dirty.size < self.next_id:
+            grown = np.zeros(max(self.next_id, 1) * 2, dtype=bool)
+            if dirty is not None:
+                grown[:dirty.size] = dirty
+            self._dirty[column] = dirty = grown
+        return dirty
+
+
+def _as_objects(values: pd.Series) -> np.ndarray:
+    array = np.empty(values.size, dtype=object)
+    array[:] = values.tolist()
+    return array
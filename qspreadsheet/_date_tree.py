@@ -0,0 +1,135 @@
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from qspreadsheet.common import SER, consecutive_runs
+from qspreadsheet.predicates import day_numbers
+
+logger = logging.getLogger(__name__)
+
+YEAR, MONTH, DAY = 0, 1, 2
+# wider date spans are counted with `np.unique`, instead of `np.bincount`
+MAX_BINCOUNT_DAYS = 10_000_000
+
+
+class DateNode(NamedTuple):
+    '''Year, month or day of the date filter tree'''
+    level: int
+    label: str
+    # [start, stop) day numbers
+    start: int
+    stop: int
+    count: int
+    # number of distinct days in the node, and how many of them are checked
+    num_days: int
+    num_checked: int
+
+
+class DateHierarchy():
+    '''Year -> month -> day tree of the dates in a datetime column.
+
+        The distinct days and their counts are computed once, vectorized
+        (`np.bincount` over the day numbers), and the nodes of a level
+        are made from them on request, so months and days are only made
+        for the expanded nodes.
+
+        Parameters
+        ----------
+
+        column : `pandas.Series`. Datetime column
+
+        accepted : [ np.ndarray ].  Default is 'None'. Mask of the rows
+        accepted by the column filter, which are checked in the tree
+    '''
+
+    def __init__(self, column: SER, accepted: Optional[np.ndarray] = None) -> None:
+        days, valid = day_numbers(column)
+        self.days, self.counts = _count_days(days[valid])
+        self.null_count = int(valid.size - np.count_nonzero(valid))
+        if accepted is None:
+            self.checked = np.ones(self.days.size, dtype=bool)
+            self.null_checked = True
+        else:
+            accepted_days, _ = _count_days(days[valid & accepted])
+            self.checked = np.isin(self.days, accepted_days, assume_unique=True)
+            self.null_checked = bool((accepted & ~valid).any())
+
+    def years(self) -> List[DateNode]:
+        return self._nodes(YEAR, 0, self.days.size)
+
+    def children(self, node: DateNode) -> List[DateNode]:
+        '''Months of a year, or days of a month'''
+        lo, hi = np.searchsorted(self.days, [node.start, node.stop])
+        return self._nodes(node.level + 1, lo, hi)
+
+    def checked_ranges(self, node: DateNode) -> List[Tuple[int, int]]:
+        '''Day ranges of the checked days in `node`'''
+        lo, hi = np.searchsorted(self.days, [node.start, node.stop])
+        days = self.days[lo:hi][self.checked[lo:hi]]
+        return [(int(start), int(stop) + 1) for start, stop in consecutive_runs(days)]
+
+    def _nodes(self, level: int, lo: int, hi: int) -> List[DateNode]:
+        days = self.days[lo:hi].astype('datetime64[D]')
+        if level == YEAR:
+            units = days.astype('datetime64[Y]')
+        elif level == MONTH:
+            units = days.astype('datetime64[M]')
+        else:
+            units = days
+        unique_units, first = np.unique(units, return_index=True)
+        bounds = np.r_[first, days.size] + lo
+        stops = (unique_units + 1).astype('datetime64[D]').view(np.int64)
+        starts = unique_units.astype('datetime64[D]').view(np.int64)
+
+        total_counts = np.add.reduceat(self.counts[lo:hi], first) if first.size else first
+        checked_counts = np.add.reduceat(self.checked[lo:hi].astype(np.int64), first) \
+            if first.size else first
+        nodes = []
+        for i, unit in enumerate(unique_units):
+            nodes.append(DateNode(level=level, label=_label(level, unit),
+                                  start=int(starts[i]), stop=int(stops[i]),
+                                  count=int(total_counts[i]),
+                                  num_days=int(bounds[i + 1] - bounds[i]),
+                                  num_checked=int(checked_counts[i])))
+        return nodes
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> np.ndarray:
+    '''Sorts `[start, stop)` day ranges and merges the adjacent ones'''
+    if not ranges:
+        return np.empty((0, 2), dtype=np.int64)
+    ranges = sorted(ranges)
+    merged = [list(ranges[0])]
+    for start, stop in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return np.array(merged, dtype=np.int64)
+
+
+def _count_days(days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Distinct day numbers, sorted, and their counts'''
+    if days.size == 0:
+        return days, np.empty(0, dtype=np.int64)
+    first = days.min()
+    if days.max() - first < MAX_BINCOUNT_DAYS:
+        counts = np.bincount(days - first)
+        present = np.flatnonzero(counts)
+        return present + first, counts[present]
+    return np.unique(days, return_counts=True)
+
+
+def _label(level: int, unit: np.datetime64) -> str:
+    text = str(unit)
+    if level == YEAR:
+        return text
+    if level == MONTH:
+        # 'YYYY-MM' -> month name
+        return MONTH_NAMES[int(text[5:7]) - 1]
+    return text[8:10]
+
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
@@ -0,0 +1,167 @@
+import logging
+from functools import reduce
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# bytes per word, the bitsets are ANDed as uint64 words
+_WORD = 8
+
+
+class FilterEngine():
+    '''Filter masks of the filtered columns, as packed bitsets.
+
+        Each filtered column keeps its own mask, packed 8 rows per byte
+        (`np.packbits`), and the accepted rows are the AND of the column
+        masks, done on uint64 words. The column masks don't depend on the
+        order of the filters: `accepted_excluding` gives the rows accepted
+        by the other filters, e.g. for the values of a column's filter list.
+
+        `accepted` is kept unpacked as well, for `filterAcceptsRow`.
+
+        Parameters
+        ----------
+
+        size : int. Number of rows
+    '''
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._masks: Dict[int, np.ndarray] = {}
+        self.accepted = np.ones(size, dtype=bool)
+
+    @property
+    def columns(self) -> List[int]:
+        '''Filtered columns, in the order they were filtered'''
+        return list(self._masks)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(mask.nbytes for mask in self._masks.values()) + self.accepted.nbytes
+
+    def is_filtered(self, column: int) -> bool:
+        return column in self._masks
+
+    def set_mask(self, column: int, mask: np.ndarray, update: bool = True):
+        '''Sets the mask of `column`, 'True' for the accepted rows'''
+        self._masks.pop(column, None)
+        self._masks[column] = _pack(mask)
+        if update:
+            self.update()
+
+    def remove(self, column: int):
+        if self._masks.pop(column, None) is not None:
+            self.update()
+
+    def clear(self, size: Optional[int] = None):
+        if size is not None:
+            self.size = size
+        self._masks.clear()
+        self.accepted = np.ones(self.size, dtype=bool)
+
+    def update(self):
+        '''Computes the accepted rows, as the AND of the column masks'''
+        self.accepted = self._unpack(self._and(self._masks.values()))
+
+    def column_mask(self, column: int) -> np.ndarray:
+        mask = self._masks.get(column)
+        if mask is None:
+            return np.ones(self.size, dtype=bool)
+        return self._unpack(mask.view(np.uint64))
+
+    def accepted_excluding(self, column: int) -> np.ndarray:
+        '''Rows accepted by the filters of the other columns'''
+        return self._unpack(self._and(mask for key, mask in self._masks.items()
+                                      if key != column))
+
+    def count(self) -> int:
+        '''Number of accepted rows'''
+        return int(np.count_nonzero(self.accepted))
+
+    def count_excluding(self, column: int) -> int:
+        '''Number of rows accepted by the filters of the other columns'''
+        words = self._and(mask for key, mask in self._masks.items() if key != column)
+        if words is None:
+            return self.size
+        return _popcount(words)
+
+    def patch(self, column: int, rows: np.ndarray, values: np.ndarray):
+        '''Sets the mask of `column` at `rows`, without updating `accepted`'''
+        mask = self._masks[column]
+        rows = np.asarray(rows, dtype=np.int64)
+        bits = np.left_shift(1, rows & 7).astype(np.uint8)
+        np.bitwise_or.at(mask, rows[values] >> 3, bits[values])
+        np.bitwise_and.at(mask, rows[~values] >> 3, ~bits[~values])
+
+    def rows_accepted(self, rows: np.ndarray) -> np.ndarray:
+        '''AND of the column masks at `rows`'''
+        rows = np.asarray(rows, dtype=np.int64)
+        accepted = np.ones(rows.size, dtype=bool)
+        for mask in self._masks.values():
+            accepted &= ((mask[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1).astype(bool)
+        return accepted
+
+    def insert_rows(self, at_index: int, count: int):
+        '''Inserts `count` rows, accepted by all masks'''
+        old_size = self.size
+        self.size += count
+        self.accepted = np.insert(self.accepted, at_index, np.ones(count, dtype=bool))
+        if at_index == old_size:
+            # appended rows: grow the bitsets and set the new bits
+            new_rows = np.arange(old_size, self.size)
+            for column in self._masks:
+                self._masks[column] = _grow(self._masks[column], self.size)
+                self.patch(column, new_rows, np.ones(count, dtype=bool))
+            return
+        for column, mask in self._masks.items():
+            unpacked = np.unpackbits(mask, count=old_size, bitorder='little')
+            self._masks[column] = _pack(
+                np.insert(unpacked, at_index, np.ones(count, dtype=np.uint8)))
+
+    def remove_rows(self, at_index: int, count: int):
+        old_size = self.size
+        self.size -= count
+        self.accepted = np.delete(self.accepted, np.s_[at_index: at_index + count])
+        for column, mask in self._masks.items():
+            unpacked = np.unpackbits(mask, count=old_size, bitorder='little')
+            self._masks[column] = _pack(np.delete(unpacked, np.s_[at_index: at_index + count]))
+
+    def _and(self, masks) -> Optional[np.ndarray]:
+        # appended rows grow the bitsets ahead, only the words of `size` rows are used
+        num_words = max(1, -(-self.size // 64))
+        words = [mask.view(np.uint64)[:num_words] for mask in masks]
+        if not words:
+            return None
+        return reduce(np.bitwise_and, words[1:], words[0].copy())
+
+    def _unpack(self, words: Optional[np.ndarray]) -> np.ndarray:
+        if words is None:
+            return np.ones(self.size, dtype=bool)
+        return np.unpackbits(words.view(np.uint8), count=self.size, bitorder='little').view(bool)
+
+
+def _pack(mask: np.ndarray) -> np.ndarray:
+    '''Packs bool `mask` to bytes, padded with zeros to whole uint64 words'''
+    packed = np.packbits(mask, bitorder='little')
+    padding = -packed.size % _WORD
+    if padding or packed.size == 0:
+        packed = np.concatenate([packed, np.zeros(padding or _WORD, dtype=np.uint8)])
+    return packed
+
+
+def _grow(packed: np.ndarray, size: int) -> np.ndarray:
+    nbytes = -(-size // 8)
+    nbytes += -nbytes % _WORD
+    if nbytes <= packed.size:
+        return packed
+    grown = np.zeros(max(nbytes, packed.size * 2), dtype=np.uint8)
+    grown[:packed.size] = packed
+    return grown
+
+
+def _popcount(words: np.ndarray) -> int:
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
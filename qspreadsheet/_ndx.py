@@ -1,8 +1,8 @@
 import logging
 import sys
 import os
-from typing import Dict
-from numpy.core.fromnumeric import alltrue
+from typing import Dict, List, Tuple
+import numpy as np
 import pandas as pd
 from PySide2.QtCore import *
 from PySide2.QtGui import *
@@ -98,6 +98,10 @@ class _Ndx():
         self._data = pandas_obj_remove_rows(
             self._data, at_index, count)
     
+    def take(self, positions):
+        """Reorders the index data, e.g. after sorting"""
+        self._data = self._data.take(positions).reset_index(drop=True)
+
     def is_virtual(self, index: int) -> bool:
         return self.count_virtual \
             and index >= self._data.index.size
@@ -112,4 +116,52 @@ class _Ndx():
         return pd.DataFrame(
             data={'in_progress': False, 'disabled': False, 'non_nullable': False,
                   'non_nullable_in_progress_count': 0, 'disabled_in_progress_count': 0},
-            index=index)
\ No newline at end of file
+            index=index)
+
+class _KeyIndex():
+    """Maps the values of a key column to row positions, with
+        `pandas.Index.get_indexer`, so lookups are vectorized.
+
+        Keys of appended rows are kept in segments, which are merged when
+        a segment is not larger than the next one, so there are O(log n)
+        segments and appends don't rebuild the index of all keys.
+        Duplicate keys map to their last row.
+    """
+
+    def __init__(self, key, values: SER) -> None:
+        self.key = key
+        self.size = 0
+        # (keys, row positions) of each segment
+        self._segments: List[Tuple[pd.Index, np.ndarray]] = []
+        self.extend(values)
+
+    def extend(self, values: SER):
+        """Adds the keys of rows appended at the bottom"""
+        if values.size == 0:
+            return
+        positions = np.arange(self.size, self.size + values.size, dtype=np.int64)
+        self.size += values.size
+        self._segments.append(_unique_keys(pd.Index(values), positions))
+        while len(self._segments) > 1 \
+                and self._segments[-2][0].size <= 2 * self._segments[-1][0].size:
+            (keys, positions), (new_keys, new_positions) = self._segments[-2:]
+            self._segments[-2:] = [_unique_keys(keys.append(new_keys),
+                                                np.concatenate([positions, new_positions]))]
+
+    def get_positions(self, keys: SER) -> np.ndarray:
+        """Row positions of `keys`, -1 for missing keys"""
+        result = np.full(keys.size, -1, dtype=np.int64)
+        # later segments hold later rows
+        for segment_keys, positions in self._segments:
+            found = segment_keys.get_indexer(keys)
+            matched = found >= 0
+            result[matched] = positions[found[matched]]
+        return result
+
+
+def _unique_keys(keys: pd.Index, positions: np.ndarray) -> Tuple[pd.Index, np.ndarray]:
+    """Drops all but the last row of duplicate `keys`"""
+    if keys.is_unique:
+        return keys, positions
+    last = ~keys.duplicated(keep='last')
+    return keys[last], positions[last]
@@ -0,0 +1,82 @@
+import logging
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from qspreadsheet.common import SER
+from qspreadsheet.predicates import _operands, _sortable
+
+logger = logging.getLogger(__name__)
+
+
+class SortedColumnIndex():
+    '''Sorted permutation of a numeric or datetime column, for range filters.
+
+        Keeps the positions of the non-null values, ordered by value,
+        and the sorted values. A range of values is found with two
+        `searchsorted` calls, and the mask is made by setting the
+        positions in between: O(log n + k) instead of a column scan.
+
+        The index is patched on edits, row inserts and removals,
+        which costs O(n) array moves, but no new sort.
+    '''
+
+    def __init__(self, column: SER) -> None:
+        self.dtype = column.dtype
+        values, valid = _sortable(column)
+        if values is None:
+            raise TypeError('Cannot index {} values.'.format(column.dtype))
+        positions = np.flatnonzero(valid)
+        order = np.argsort(values[positions], kind='stable')
+        self.positions = positions[order]
+        self.values = values[self.positions]
+        self.size = column.size
+
+    def key(self, value: Any) -> Any:
+        '''Converts `value` to the type of the sorted values'''
+        _, value = _operands(pd.Series([], dtype=self.dtype), value)
+        if isinstance(value, np.datetime64):
+            return value.astype(np.int64)
+        return value
+
+    def range_mask(self, low: Optional[Any] = None, high: Optional[Any] = None,
+                   low_inclusive: bool = True, high_inclusive: bool = True) -> np.ndarray:
+        '''Mask of the values in the range, 'None' is unbounded'''
+        start = 0 if low is None else np.searchsorted(
+            self.values, self.key(low), side='left' if low_inclusive else 'right')
+        stop = self.values.size if high is None else np.searchsorted(
+            self.values, self.key(high), side='right' if high_inclusive else 'left')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.positions[start: stop]] = True
+        return mask
+
+    def update(self, rows: np.ndarray, column: SER):
+        '''Re-indexes `rows` of `column`, after their values changed'''
+        rows = np.asarray(rows, dtype=np.int64)
+        keep = ~np.isin(self.positions, rows)
+        self.positions, self.values = self.positions[keep], self.values[keep]
+        self._add(rows, column.iloc[rows])
+
+    def insert(self, at_index: int, column: SER, count: int):
+        '''Indexes `count` rows of `column` inserted at `at_index`'''
+        self.positions[self.positions >= at_index] += count
+        self.size += count
+        rows = np.arange(at_index, at_index + count, dtype=np.int64)
+        self._add(rows, column.iloc[rows])
+
+    def remove(self, at_index: int, count: int):
+        '''Drops `count` rows removed at `at_index`'''
+        keep = (self.positions < at_index) | (self.positions >= at_index + count)
+        self.positions, self.values = self.positions[keep], self.values[keep]
+        self.positions[self.positions >= at_index + count] -= count
+        self.size -= count
+
+    def _add(self, rows: np.ndarray, values: SER):
+        new_values, valid = _sortable(values)
+        rows, new_values = rows[valid], new_values[valid].astype(self.values.dtype)
+        order = np.argsort(new_values, kind='stable')
+        rows, new_values = rows[order], new_values[order]
+        at = np.searchsorted(self.values, new_values, side='right')
+        self.positions = np.insert(self.positions, at, rows)
+        self.values = np.insert(self.values, at, new_values)
@@ -0,0 +1,155 @@
+import logging
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from qspreadsheet.common import SER
+
+try:
+    from rapidfuzz.distance import Levenshtein
+except ImportError:
+    Levenshtein = None
+
+logger = logging.getLogger(__name__)
+
+# longer texts are not indexed, they are always candidates
+MAX_INDEXED_LENGTH = 64
+# texts are split to trigrams in blocks, to bound the memory used
+_BLOCK_SIZE = 65_536
+_PAD_START, _PAD_END = '\x02\x02', '\x03\x03'
+
+
+class TrigramIndex():
+    '''Trigram index of texts, for fuzzy matching.
+
+        Texts are padded with two characters at each end, so a text of
+        length n has n + 2 trigrams. An edit changes at most 3 of them, so
+        a text within k edits of the query shares at least
+        len(query) + 2 - 3 * k trigrams with it. The shared trigrams are
+        counted with `np.bincount` over the posting lists of the query
+        trigrams, and only the candidates over the threshold, and within
+        k characters of length, are checked with the edit distance.
+
+        Trigrams are made vectorized, from blocks of texts as fixed
+        width unicode arrays, viewed as code points.
+
+        Parameters
+        ----------
+
+        texts : Sequence[str]. Lower case texts
+
+        values : [ `pandas.Index` ].  Default is 'None'. Distinct raw
+        values, whose display texts are `texts`, used by `mask`
+    '''
+
+    def __init__(self, texts: Sequence[str], values: Optional[pd.Index] = None) -> None:
+        self.texts = np.empty(len(texts), dtype=object)
+        self.texts[:] = list(texts)
+        self.values = values
+        self.lengths = np.fromiter(map(len, self.texts), dtype=np.int64, count=self.texts.size)
+        self.unindexed = np.flatnonzero(self.lengths > MAX_INDEXED_LENGTH)
+        self._build()
+        # last search, reused when a filter evaluates some rows again
+        self._last_search = None
+
+    @classmethod
+    def from_column(cls, column: SER, display: Callable[[Any], str]) -> 'TrigramIndex':
+        '''Index of the display texts of `column`'s distinct values'''
+        _, uniques = pd.factorize(column)
+        texts = [display(value).lower() for value in uniques]
+        return cls(texts, pd.Index(uniques))
+
+    def _build(self):
+        indexed = np.flatnonzero(self.lengths <= MAX_INDEXED_LENGTH)
+        # similar lengths in a block, for less padding
+        indexed = indexed[np.argsort(self.lengths[indexed], kind='stable')]
+        grams, ids = [], []
+        for start in range(0, indexed.size, _BLOCK_SIZE):
+            block = indexed[start: start + _BLOCK_SIZE]
+            block_grams, valid = _trigrams(self.texts[block], self.lengths[block])
+            grams.append(block_grams[valid])
+            ids.append(np.broadcast_to(block[:, None], valid.shape)[valid].astype(np.int32))
+        grams = np.concatenate(grams) if grams else np.empty(0, dtype=np.uint64)
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int32)
+        order = np.argsort(grams)
+        grams = grams[order]
+        first = np.flatnonzero(np.r_[True, grams[1:] != grams[:-1]]) if grams.size \
+            else np.empty(0, dtype=np.int64)
+        self.grams = grams[first]
+        self.offsets = np.r_[first, grams.size]
+        self.postings = ids[order]
+
+    def search(self, query: str, max_distance: int) -> np.ndarray:
+        '''Mask of the texts within `max_distance` edits of `query`'''
+        query = query.lower()
+        if self._last_search is not None and self._last_search[:2] == (query, max_distance):
+            return self._last_search[2]
+
+        length_ok = np.abs(self.lengths - len(query)) <= max_distance
+        threshold = len(query) + 2 - 3 * max_distance
+        if threshold > 0:
+            query_grams, _ = _trigrams(np.array([query], dtype=object), np.array([len(query)]))
+            query_grams = np.unique(query_grams)
+            at = np.searchsorted(self.grams, query_grams)
+            found = at < self.grams.size
+            found[found] = self.grams[at[found]] == query_grams[found]
+            postings = [self.postings[self.offsets[i]: self.offsets[i + 1]] for i in at[found]]
+            counts = np.bincount(np.concatenate(postings), minlength=self.texts.size) \
+                if postings else np.zeros(self.texts.size, dtype=np.int64)
+            candidates = length_ok & (counts >= threshold)
+            candidates[self.unindexed] = length_ok[self.unindexed]
+        else:
+            candidates = length_ok
+
+        matched = np.zeros(self.texts.size, dtype=bool)
+        for i in np.flatnonzero(candidates):
+            matched[i] = within_distance(self.texts[i], query, max_distance)
+        self._last_search = (query, max_distance, matched)
+        return matched
+
+    def mask(self, column: SER, query: str, max_distance: int,
+             test: Callable[[Any], bool]) -> np.ndarray:
+        '''Mask of `column` values, whose display text is within `max_distance`
+            edits of `query`. Values missing in the index, e.g. edited after
+            it was built, are checked with `test`.
+        '''
+        matched = self.search(query, max_distance)
+        positions = self.values.get_indexer(column)
+        known = positions >= 0
+        mask = np.zeros(column.size, dtype=bool)
+        mask[known] = matched[positions[known]]
+        if not known.all():
+            mask[~known] = [test(value) for value in column[~known]]
+        return mask
+
+
+def within_distance(a: str, b: str, max_distance: int) -> bool:
+    ''''True' if the Levenshtein distance of `a` and `b` is at most `max_distance`'''
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    if Levenshtein is not None:
+        return Levenshtein.distance(a, b, score_cutoff=max_distance) <= max_distance
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+def _trigrams(texts: np.ndarray, lengths: np.ndarray):
+    '''Trigram codes of the padded `texts`, as a (texts, positions) array,
+        and the mask of the positions within each text
+    '''
+    width = int(lengths.max(initial=0)) + len(_PAD_START) + len(_PAD_END)
+    padded = np.array([_PAD_START + text + _PAD_END for text in texts], dtype='U{}'.format(width))
+    # code points are below 2 ** 21
+    codes = padded.view(np.uint32).reshape(texts.size, width).astype(np.uint64)
+    grams = (codes[:, :-2] << np.uint64(42)) | (codes[:, 1:-1] << np.uint64(21)) | codes[:, 2:]
+    valid = np.arange(width - 2) < (lengths + 2)[:, None]
+    return grams, valid
@@ -0,0 +1,138 @@
+import logging
+import socket
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+from PySide2.QtCore import *
+
+from qspreadsheet.common import DF
+from qspreadsheet.dataframe_model import DataFrameModel
+from qspreadsheet.delegates import ColumnDelegate, automap_delegates
+from qspreadsheet.worker import Worker
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+Address = Union[str, Tuple[str, int]]
+APPEND, UPSERT = 'append', 'upsert'
+# seconds to wait while the update queue is full
+BACKPRESSURE_SLEEP = 0.01
+
+
+class ArrowStreamReader(QObject):
+    '''Ingests Arrow IPC record batches from a local socket into `DataFrameModel`.
+
+        The producer listens on a Unix socket path or a TCP `(host, port)`
+        address and writes an Arrow IPC stream (e.g. with
+        `pyarrow.ipc.new_stream`). The batches are read and converted to
+        pandas on a worker thread, and handed to the model's update queue,
+        so only the buffer swap and the row-insert notification happen on
+        the GUI thread.
+
+        Usage
+        -----
+            reader = ArrowStreamReader('/tmp/feed.sock')
+            reader.open()
+            view = DataFrameView(reader.empty_frame(), delegates=reader.delegates())
+            reader.start(view.dataframe_model)
+
+        Parameters
+        ----------
+
+        address : str or (host, port). Unix socket path or TCP address
+
+        mode : str.  Default is 'append'. One of 'append' or 'upsert'
+
+        key : [ Any ].  Default is 'None'. Key column, required in 'upsert' mode
+    '''
+
+    finished = Signal()
+    error = Signal(tuple)
+
+    def __init__(self, address: Address, mode: str = APPEND, key: Any = None,
+                 parent: Optional[QObject] = None) -> None:
+        super(ArrowStreamReader, self).__init__(parent)
+        if pa is None:
+            raise ImportError('Reading Arrow IPC streams requires `pyarrow`.')
+        if mode not in (APPEND, UPSERT):
+            raise ValueError('Unknown mode: {}'.format(str(mode)))
+        if mode == UPSERT and key is None:
+            raise ValueError('`key` column is required in upsert mode.')
+        self.address = address
+        self.mode = mode
+        self.key = key
+        self.schema: Optional['pa.Schema'] = None
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._stopped = False
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+    def open(self) -> 'pa.Schema':
+        '''Connects to the producer and reads the stream schema'''
+        family = socket.AF_UNIX if isinstance(self.address, str) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(self.address)
+        self._reader = pa.ipc.open_stream(self._socket.makefile('rb'))
+        self.schema = self._reader.schema
+        return self.schema
+
+    def empty_frame(self) -> DF:
+        '''Zero rows `DataFrame` with the columns of the stream schema'''
+        return self.schema.empty_table().to_pandas()
+
+    def delegates(self, nullable: bool = True) -> Dict[Any, ColumnDelegate]:
+        '''Column delegates, mapped from the stream schema'''
+        return automap_delegates(self.empty_frame(), nullable=nullable)
+
+    def start(self, model: DataFrameModel):
+        '''Starts ingesting the batches into `model`.
+
+            NOTE: Must be called on the GUI thread.
+        '''
+        if self._reader is None:
+            self.open()
+        queue = model.enable_update_queue()
+        model.destroyed.connect(lambda *args: self.stop())
+
+        worker = Worker(func=self._ingest, queue=queue)
+        worker.signals.error.connect(self.error)
+        worker.signals.finished.connect(self.finished)
+        self._pool.start(worker)
+
+    def stop(self):
+        '''Stops ingesting and closes the connection'''
+        self._stopped = True
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+
+    def _ingest(self, queue, *args, **kwargs):
+        '''Reads the batches. Runs on the worker thread.'''
+        while not self._stopped:
+            try:
+                batch = self._reader.read_next_batch()
+            except StopIteration:
+                break
+            except (OSError, pa.ArrowInvalid):
+                if self._stopped:
+                    break
+                raise
+
+            frame = batch.to_pandas()
+            while not self._stopped and not self._push(queue, frame):
+                # backpressure, the GUI thread is behind
+                time.sleep(BACKPRESSURE_SLEEP)
+
+    def _push(self, queue, frame: DF) -> bool:
+        if self.mode == UPSERT:
+            return queue.push_upsert(frame, self.key)
+        return queue.push_rows(frame)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import sys
+from typing import Any, AsyncIterator, Optional
+
+import pandas as pd
+from PySide2.QtCore import *
+
+from qspreadsheet.common import DF
+from qspreadsheet.dataframe_model import DataFrameModel
+from qspreadsheet.dataframe_view import DataFrameView
+
+logger = logging.getLogger(__name__)
+
+APPEND, UPDATE = 'append', 'update'
+
+
+class QtAsyncioBridge(QObject):
+    '''Runs an asyncio event loop inside the Qt event loop.
+
+        Every `interval` msec a timer runs the asyncio callbacks which are
+        ready, so the coroutines run on the GUI thread and can update the
+        models directly, without locking.
+
+        NOTE: The asyncio loop must not be running elsewhere.
+    '''
+
+    _instance: Optional['QtAsyncioBridge'] = None
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None,
+                 interval: int = 5, parent: Optional[QObject] = None) -> None:
+        super(QtAsyncioBridge, self).__init__(parent)
+        self.loop = loop or asyncio.new_event_loop()
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self._step)
+        self._timer.start()
+
+    @classmethod
+    def instance(cls) -> 'QtAsyncioBridge':
+        '''Shared bridge, created on first use'''
+        if cls._instance is None:
+            cls._instance = cls(parent=QCoreApplication.instance())
+        return cls._instance
+
+    def _step(self):
+        # `stop` is called after the callbacks that are ready now
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self._timer.stop()
+
+
+class AsyncFrameSource(QObject):
+    '''Feeds `DataFrameModel` from an async iterator of data batches.
+
+        Batches can be `DataFrame`s, `pyarrow` record batches or tables, or
+        anything `pd.DataFrame` accepts (e.g. a list of records). They are
+        applied with the model's bulk paths: `append_rows` in 'append' mode,
+        or `update_frame` in 'update' mode.
+
+        While more than `max_pending` appended rows wait to be inserted in
+        the model, the source is not read. Reading stops when the model is
+        destroyed, when the `DataFrameView` of the model is closed or
+        destroyed, or when `cancel` is called, and the async generator is
+        closed.
+
+        Parameters
+        ----------
+
+        model : `DataFrameModel`. The model to feed
+
+        source : AsyncIterator. Async iterator (or generator) of batches
+
+        mode : str.  Default is 'append'. One of 'append' or 'update'
+
+        max_pending : int.  Default is 100_000. Backpressure limit, in rows
+
+        bridge : [ QtAsyncioBridge ].  Default is 'None'. Uses the shared bridge if 'None'.
+    '''
+
+    finished = Signal()
+    error = Signal(tuple)
+
+    def __init__(self, model: DataFrameModel, source: AsyncIterator[Any],
+                 mode: str = APPEND, max_pending: int = 100_000,
+                 bridge: Optional[QtAsyncioBridge] = None, parent: Optional[QObject] = None) -> None:
+        super(AsyncFrameSource, self).__init__(parent)
+        if mode not in (APPEND, UPDATE):
+            raise ValueError('Unknown mode: {}'.format(str(mode)))
+        self._model = model
+        self._source = source
+        self.mode = mode
+        self.max_pending = max_pending
+        self.bridge = bridge or QtAsyncioBridge.instance()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.is_running:
+            return
+        task = self.bridge.loop.create_task(self._run())
+        self._model.destroyed.connect(lambda *args: task.cancel())
+        view = self._model.parent()
+        if isinstance(view, DataFrameView):
+            view.closed.connect(task.cancel)
+            view.destroyed.connect(lambda *args: task.cancel())
+        self._task = task
+
+    def cancel(self):
+        if self.is_running:
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            async for batch in self._source:
+                frame = _to_frame(batch)
+                if self.mode == APPEND:
+                    while self._model.pending_append_count >= self.max_pending:
+                        await asyncio.sleep(self._model.append_interval / 1000)
+                    self._model.append_rows(frame)
+                else:
+                    self._model.update_frame(frame)
+                # let Qt process the events between the batches
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            logger.debug('Async source cancelled.')
+            aclose = getattr(self._source, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            raise
+        except Exception:
+            self.error.emit(sys.exc_info())
+        finally:
+            self.finished.emit()
+
+
+def _to_frame(batch: Any) -> DF:
+    if isinstance(batch, pd.DataFrame):
+        return batch
+    if hasattr(batch, 'to_pandas'):
+        return batch.to_pandas()
+    return pd.DataFrame(batch)
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+from PySide2.QtCore import *
+
+from qspreadsheet.common import DF, SER
+from qspreadsheet.dataframe_model import DataFrameModel
+from qspreadsheet.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+# file of the column at position n, saved at version v by the saver with token t.
+# Versions restart at 0 with each model, the token keeps a new session from
+# overwriting the files the manifest of a previous session references
+COLUMN_FILE = 'c{}_v{}_{}.parquet'
+_COLUMN_FILE_PATTERN = re.compile(r'c\d+_v\d+(_[0-9a-f]+)?\.parquet')
+
+
+class AutoSaver(QObject):
+    '''Periodically saves the data of `DataFrameModel` to Parquet files.
+
+        Each column is saved to its own Parquet file in `directory`, and a
+        manifest lists the files of the latest save. The model keeps the
+        version of each column's last change, so only changed columns are
+        copied (on the GUI thread) and rewritten (in a worker thread).
+        Inserted or removed rows change all columns.
+
+        Column files are never overwritten: their names hold the column
+        version and a token of the saver. The manifest is replaced atomically
+        after the column files are written, so a crash during saving leaves
+        the previous save intact.
+        Load a save with `AutoSaver.load`. Column files of previous saves
+        are deleted, other files in `directory` are left alone.
+
+        Parameters
+        ----------
+
+        model : `DataFrameModel`. The model to save
+
+        directory : str. Directory for the Parquet files, created if missing
+
+        interval : int.  Default is 60_000. Auto-save interval in msec
+    '''
+
+    saved = Signal(float, int)  # duration in sec, bytes written
+    error = Signal(tuple)
+
+    def __init__(self, model: DataFrameModel, directory: str, interval: int = 60_000,
+                 parent: Optional[QObject] = None) -> None:
+        super(AutoSaver, self).__init__(parent)
+        self._model = model
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._token = uuid.uuid4().hex[:12]
+        self._saving = False
+        self._saved_version = -1
+        # column name -> (column version, file name) of the latest save
+        self._saved_columns: Dict[str, Tuple[int, str]] = {}
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.save)
+        self._timer.start()
+        model.destroyed.connect(lambda *args: self._timer.stop())
+
+    def set_interval(self, msec: int):
+        self._timer.setInterval(msec)
+
+    def stop(self):
+        self._timer.stop()
+
+    def save(self):
+        '''Saves the changes since the last save, in the background'''
+        model = self._model
+        if self._saving or model.version == self._saved_version:
+            return
+        started = time.perf_counter()
+        df = model._df
+        versions = model.column_versions
+        num_rows = df.index.size
+
+        manifest_columns = []
+        snapshot: Dict[str, SER] = {}
+        for ndx, column in enumerate(df.columns):
+            name = str(column)
+            version = int(versions[ndx])
+            saved = self._saved_columns.get(name)
+            if saved is not None and saved[0] == version:
+                file_name = saved[1]
+            else:
+                file_name = COLUMN_FILE.format(ndx, version, self._token)
+                # the only copy made on the GUI thread
+                snapshot[file_name] = df.iloc[:, ndx].copy()
+            manifest_columns.append({'name': name, 'version': version,
+                                     'file': file_name, 'dtype': str(df.dtypes.iloc[ndx])})
+        manifest = {'version': model.version, 'num_rows': num_rows, 'columns': manifest_columns}
+
+        self._saving = True
+        worker = Worker(_write_save, self.directory, snapshot, manifest)
+        worker.signals.result.connect(
+            lambda nbytes: self._on_saved(manifest, nbytes, started))
+        worker.signals.error.connect(self._on_error)
+        self._pool.start(worker)
+
+    def wait(self):
+        '''Waits for the running save to finish'''
+        self._pool.waitForDone()
+
+    @staticmethod
+    def load(directory: str) -> DF:
+        '''Reads the latest save in `directory`'''
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            manifest = json.load(f)
+        columns = [pd.read_parquet(os.path.join(directory, column['file'])).iloc[:, 0]
+                   for column in manifest['columns']]
+        if not columns:
+            return pd.DataFrame(index=pd.RangeIndex(manifest['num_rows']))
+        df = pd.concat(columns, axis=1)
+        df.columns = [column['name'] for column in manifest['columns']]
+        return df
+
+    def _on_saved(self, manifest: Dict[str, Any], nbytes: int, started: float):
+        self._saving = False
+        self._saved_version = manifest['version']
+        self._saved_columns = {column['name']: (column['version'], column['file'])
+                               for column in manifest['columns']}
+        duration = time.perf_counter() - started
+        logger.debug('Auto-saved {} bytes in {:.3f} sec.'.format(nbytes, duration))
+        self.saved.emit(duration, nbytes)
+
+    def _on_error(self, exc_info: Tuple):
+        self._saving = False
+        logger.error('Auto-save failed.', exc_info=exc_info)
+        self.error.emit(exc_info)
+
+
+def _write_save(directory: str, snapshot: Dict[str, SER], manifest: Dict[str, Any],
+                *args, **kwargs) -> int:
+    nbytes = 0
+    for file_name, column in snapshot.items():
+        path = os.path.join(directory, file_name)
+        column.to_frame(name=str(column.name)).reset_index(drop=True).to_parquet(path, index=False)
+        nbytes += os.path.getsize(path)
+
+    data = json.dumps(manifest).encode()
+    temp_path = os.path.join(directory, MANIFEST + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(directory, MANIFEST))
+    nbytes += len(data)
+
+    # column files of previous saves
+    used = set(column['file'] for column in manifest['columns'])
+    for file_name in os.listdir(directory):
+        if _COLUMN_FILE_PATTERN.fullmatch(file_name) and file_name not in used:
+            os.remove(os.path.join(directory, file_name))
+    return nbytes
@@ -1,5 +1,6 @@
+import numpy as np
 import pandas as pd 
-from typing import TypeVar, Union
+from typing import Any, List, Optional, Tuple, TypeVar, Union
 import collections
 import six
 from PySide2.QtGui import QIcon
@@ -30,6 +31,63 @@ def standard_icon(icon_name: str) -> QIcon:
     return QApplication.style().standardIcon(icon)
 
 
+def nullable_dtype(dtype) -> Any:
+    '''Returns a dtype equivalent to `dtype`, which is able to hold null values.
+
+        NumPy integer and boolean dtypes are mapped to their pandas
+        nullable counterparts (`Int64`, `UInt8`, `boolean`, ...), so that
+        inserting null rows does not upcast the column to `object`.
+        All other dtypes (float, datetime, extension and Arrow-backed
+        dtypes) can already hold nulls and are returned unchanged.
+    '''
+    if isinstance(dtype, np.dtype):
+        bits = dtype.itemsize * 8
+        if dtype.kind == 'i':
+            return pd.api.types.pandas_dtype('Int{}'.format(bits))
+        if dtype.kind == 'u':
+            return pd.api.types.pandas_dtype('UInt{}'.format(bits))
+        if dtype.kind == 'b':
+            return pd.api.types.pandas_dtype('boolean')
+    return dtype
+
+
+def null_value_for(dtype) -> Any:
+    '''Returns the native null value for `dtype`'''
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return dtype.na_value
+    if dtype.kind in 'mM':
+        return pd.NaT
+    if dtype.kind in 'fc':
+        return np.nan
+    return None
+
+
+def object_array(values: Any) -> np.ndarray:
+    '''1-D object array of `values`, keeping sequence-like values as single items'''
+    values = list(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def cast_values(values: Any, dtype) -> Optional[Any]:
+    '''Casts `values` to `dtype`, so that writing them to a column of
+        `dtype` keeps the column dtype. Returns 'None', if they can't be
+        cast, or only with loss (e.g. 2.5 to an integer dtype).
+    '''
+    if getattr(values, 'dtype', None) == dtype:
+        return values
+    try:
+        cast = pd.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return None
+    if pd.api.types.is_integer_dtype(dtype) \
+            and pd.api.types.infer_dtype(values, skipna=True) not in ('integer', 'empty') \
+            and changed_mask(pd.Series(values, dtype=object), pd.Series(cast, dtype=object)).any():
+        return None
+    return cast
+
+
 def pandas_obj_insert_rows(obj: Union[DF, SER], at_index: int,
                            new_rows: Union[DF, SER]) -> Union[DF, SER]:
     above = obj.iloc[0: at_index]
@@ -48,3 +106,24 @@ def pandas_obj_remove_rows(obj: Union[DF, SER], row: int, count: int) -> Union[D
     obj = obj.drop(index=obj.index[index_rows])
     obj = obj.reset_index(drop=True)
     return obj
+
+
+def consecutive_runs(values: np.ndarray) -> List[Tuple[int, int]]:
+    '''Consecutive runs of sorted integers, as (first, last) pairs'''
+    if values.size == 0:
+        return []
+    bounds = np.flatnonzero(np.diff(values) != 1)
+    firsts = np.r_[values[0], values[bounds + 1]]
+    lasts = np.r_[values[bounds], values[-1]]
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+
+def changed_mask(old: SER, new: SER) -> np.ndarray:
+    '''Boolean array, True where `old` and `new` values differ by position.
+        Null values are equal to each other.
+    '''
+    old = old.reset_index(drop=True)
+    new = new.reset_index(drop=True)
+    both_null = old.isna().to_numpy() & new.isna().to_numpy()
+    equal = (old == new).fillna(False).to_numpy(dtype=bool)
+    return ~(equal | both_null)
@@ -1,8 +1,8 @@
+import copy
 import logging
-from os import truncate
 import sys
 import os
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -11,10 +11,18 @@ from PySide2.QtGui import *
 from PySide2.QtWidgets import *
 from pandas.core.series import Series
 
-from qspreadsheet.common import DF, SER, pandas_obj_insert_rows, pandas_obj_remove_rows
+from qspreadsheet.common import (DF, SER, cast_values, changed_mask, consecutive_runs,
+                                 null_value_for, nullable_dtype, object_array,
+                                 pandas_obj_insert_rows, pandas_obj_remove_rows)
 from qspreadsheet.delegates import MasterDelegate
 from qspreadsheet.header_view import HeaderView
-from qspreadsheet._ndx import _Ndx
+from qspreadsheet._ndx import _KeyIndex, _Ndx
+from qspreadsheet._changes import ChangeSet, _ChangeTracker
+from qspreadsheet._buffer import _ColumnBuffer
+from qspreadsheet.undo import (CellsEdit, EditEntry, RowsInsert, RowsRemove,
+                               UndoJournal)
+from qspreadsheet.update_queue import UpdateQueue
+from qspreadsheet.worker import Worker
 from qspreadsheet import resources_rc
 
 logger = logging.getLogger(__name__)
@@ -24,32 +32,183 @@ class DataFrameModel(QAbstractTableModel):
 
     mutable_rows_enabled = Signal(bool)
     virtual_rows_enabled = Signal(bool)
+    all_rows_fetched = Signal()
+    frame_replaced = Signal()
+    edit_committed = Signal(object)
+    # (rows, columns) positions of written cells, emitted on every write,
+    # while `dataChanged` may be deferred or skipped outside the viewport
+    cells_written = Signal(object, object)
+
+    REGION_ROWS = 256
+    REFRESH_MAX_RUNS = 64
 
     def __init__(self, df: DF, header_model: HeaderView,
                  delegate: MasterDelegate, parent: Optional[QWidget] = None) -> None:
         QAbstractTableModel.__init__(self, parent=parent)
         self.delegate = delegate
         self._init_data(df)
-
-        non_nullables = list(self.delegate.non_nullable_delegates.keys())
-        if non_nullables:
-            self.col_ndx.set_non_nullable(non_nullables, True)
+        self._init_non_nullables()
             
         self.header_model = header_model
-        self.is_dirty = False
+        # set with `is_dirty`, for changes which are not tracked
+        self._marked_dirty = False
+
+        # Lazy loading: rows are fetched from `_chunks` on demand.
+        # If set, sorting and filtering first load all remaining rows,
+        # otherwise they apply to the already loaded rows only.
+        self.full_load_on_sort = True
+        self.full_load_on_filter = True
+        # Cleared for data the model must not modify or replace, e.g. a view
+        # of shared memory: edits are refused, and sorting is disabled
+        self.editable = True
+        self.sorting_enabled = True
+        self._chunks: Optional[Iterator[DF]] = None
+        self._fetching = False
+        self._fetched: List[Optional[DF]] = []
+        self._fetch_pool: Optional[QThreadPool] = None
+        # Set while rows/values come from the data source, and not from
+        # the user. These are 'committed' and don't make the model dirty.
+        self._source_update = False
+
+        # Streaming appends: rows appended within `append_interval` msec
+        # are inserted at once. If `max_rows` is set, the oldest rows are
+        # dropped to keep the row count at `max_rows`.
+        self.max_rows: Optional[int] = None
+        self._pending_appends: List[DF] = []
+        self._append_buffer: Optional[_ColumnBuffer] = None
+        self._append_buffer_frame: Optional[DF] = None
+        self._append_timer = QTimer(self)
+        self._append_timer.setSingleShot(True)
+        self._append_timer.setInterval(16)
+        self._append_timer.timeout.connect(self.flush_appends)
+
+        # Bulk cell updates: touched cells are merged into one rectangle
+        # per `REGION_ROWS` rows, and `dataChanged` is emitted once per
+        # update interval, only for regions in the viewport (if known).
+        self._dirty_regions: Dict[int, List[int]] = {}
+        self._viewport: Optional[Tuple[int, int]] = None
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(16)
+        self._update_timer.timeout.connect(self.flush_updates)
+
+        # Rows dropped from the data at once by `refresh`, while their
+        # removal is still being notified, run by run
+        self._removing_ahead = False
+        self._removed_ahead = 0
+
+        # Key column value -> row position, used by `upsert_rows`
+        self._key_index: Optional[_KeyIndex] = None
+
+        # User edits, as compact deltas. Undo and redo are replayed
+        # with `_replaying` set, so they are not recorded again.
+        self.undo_journal = UndoJournal(parent=self)
+        self._replaying = False
+
+        # Incremented on every change of the data
+        self.version = 0
+        self._snapshot: Optional[Tuple[int, DF]] = None
+        # column position -> (column version, copy) of the last snapshot
+        self._snapshot_columns: Dict[int, Tuple[int, SER]] = {}
+        self.update_queue: Optional[UpdateQueue] = None
 
         self.dataChanged.connect(self.on_dataChanged)
         self.rowsInserted.connect(self.on_rowsInserted)
+        self.rowsAboutToBeRemoved.connect(self.on_rowsAboutToBeRemoved)
         self.rowsRemoved.connect(self.on_rowsRemoved)
+        self.layoutChanged.connect(self._on_layout_changed)
+        self.modelReset.connect(self._on_layout_changed)
 
-    def _init_data(self, df: DF):
-        self._df = df.copy()
+    def _init_data(self, df: DF, copy: bool = True):
+        self._df = df.copy() if copy else df
         self.row_ndx = _Ndx(self._df.index)
         self.col_ndx = _Ndx(self._df.columns)
+        self._changes = _ChangeTracker(self._df.index.size)
+        # model `version` of the last change of each column
+        self._column_versions = np.zeros(self._df.columns.size, dtype=np.int64)
         # freeze columns
         self.row_ndx.is_mutable = True
         self.row_ndx.count_virtual = _Ndx.VIRTUAL_COUNT
 
+    def _init_non_nullables(self):
+        non_nullables = list(self.delegate.non_nullable_delegates.keys())
+        if non_nullables:
+            self.col_ndx.set_non_nullable(non_nullables, True)
+
+    def reset_frame(self, df: DF, copy: bool = True):
+        """Replaces the model data with `df`.
+
+            Rows in progress, rows not loaded yet from the chunk source and
+            pending appended rows are discarded, while the mutable and
+            virtual rows settings are kept.
+
+            Parameters
+            ----------
+            df : DataFrame. The new data
+
+            copy : bool. Default is 'True'. If 'False', the model works on
+            `df` directly, e.g. when `df` is a view of shared memory.
+        """
+        is_mutable = self.row_ndx.is_mutable
+        count_virtual = self.row_ndx.count_virtual
+
+        self.beginResetModel()
+        self._init_data(df, copy=copy)
+        self._init_non_nullables()
+        self.row_ndx.is_mutable = is_mutable
+        self.row_ndx.count_virtual = count_virtual
+        self._chunks = None
+        self._fetched = []
+        self._pending_appends = []
+        self._append_timer.stop()
+        self._append_buffer = None
+        self._dirty_regions.clear()
+        self.undo_journal.clear()
+        self.frame_replaced.emit()
+        self.endResetModel()
+
+    def set_source_frame(self, df: DF):
+        """Replaces the data with `df`, without copying, when the data
+            source changed the data in place. `df` must have the same
+            columns. Rows are inserted or removed at the bottom, to
+            match the new row count, and are committed rows.
+        """
+        old_size = self._df.index.size
+        new_size = df.index.size
+        self._source_update = True
+        try:
+            if new_size > old_size:
+                self.beginInsertRows(QModelIndex(), old_size, new_size - 1)
+                self._df = df
+                self.endInsertRows()
+            elif new_size < old_size:
+                self.beginRemoveRows(QModelIndex(), new_size, old_size - 1)
+                self._df = df
+                self.endRemoveRows()
+            else:
+                self._df = df
+        finally:
+            self._source_update = False
+        self._append_buffer = None
+
+    def notify_rows_changed(self, first: int, last: int):
+        """Notifies rows changed outside of the model (e.g. in shared memory),
+            with merged `dataChanged`, like `update_cells`.
+        """
+        left, right = 0, self._df.columns.size - 1
+        self.cells_written.emit(np.arange(first, last + 1), range(left, right + 1))
+        for block in range(first // self.REGION_ROWS, last // self.REGION_ROWS + 1):
+            top = max(first, block * self.REGION_ROWS)
+            bottom = min(last, (block + 1) * self.REGION_ROWS - 1)
+            region = self._dirty_regions.get(block)
+            if region is None:
+                self._dirty_regions[block] = [top, left, bottom, right]
+            else:
+                self._dirty_regions[block] = [min(region[0], top), left,
+                                              max(region[2], bottom), right]
+        self._increment_version()
+        self._update_timer.start()
+
     @property
     def df(self):
         # TODO: FIXME: self.col_ndx.in_progress_mask.values
@@ -60,11 +219,50 @@ class DataFrameModel(QAbstractTableModel):
         not_inprogress_columns = ~self.col_ndx.in_progress_mask.values
         return self._df.loc[not_inprogress_rows, not_inprogress_columns].copy()
 
+    @property
+    def is_dirty(self) -> bool:
+        """'True' if the user changed the data since the last `mark_clean`"""
+        return self._marked_dirty or self._changes.is_dirty
+
+    @is_dirty.setter
+    def is_dirty(self, value: bool):
+        if value:
+            self._marked_dirty = True
+        else:
+            self.mark_clean()
+
+    @property
+    def row_ids(self) -> np.ndarray:
+        """Stable id of each row, which identifies the row in `get_changes`"""
+        return self._changes.row_ids
+
+    def get_changes(self) -> ChangeSet:
+        """Returns the user changes since the last `mark_clean`:
+            inserted, updated (with the original values) and deleted rows,
+            and the edited cells. Only the changed rows are read, and a cell
+            edited back to its original value is not changed. Rows in
+            progress are not included.
+        """
+        return self._changes.changes(
+            self._df, self.row_ndx.in_progress_mask.to_numpy(dtype=bool))
+
+    def mark_clean(self, row_ids: Optional[Iterable[int]] = None):
+        """Accepts the changes of `row_ids` (e.g. after saving them),
+            or all changes if 'None'.
+        """
+        if row_ids is None:
+            self._marked_dirty = False
+        self._changes.discard(row_ids)
+
+    def is_cell_dirty(self, row: int, column: int) -> bool:
+        """'True' if the user edited the cell"""
+        return self._changes.is_cell_dirty(row, column)
+
     def columnCount(self, parent: QModelIndex) -> int:
         return self.col_ndx.count
 
     def rowCount(self, parent: QModelIndex) -> int:
-        return self.row_ndx.count
+        return self.row_ndx.count + self._removed_ahead
 
     def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
         # logger.debug('data({}, {}), role: {}'.format( index.row(), index.column(), role))
@@ -116,17 +314,31 @@ class DataFrameModel(QAbstractTableModel):
         return None
 
     def setData(self, index: QModelIndex, value: Any, role=Qt.EditRole) -> bool:
-        if not index.isValid():
+        if not index.isValid() or not self.editable:
             return False
 
         # If user has typed in the last row
-        if self.row_ndx.is_virtual(index.row()):
+        is_virtual = self.row_ndx.is_virtual(index.row())
+        if is_virtual:
+            self.undo_journal.begin_group()
             self.insertRow(index.row(), QModelIndex())
 
         # if self.col_ndx.is_virtual(index.column()):
         #     self.insertColumn(self.col_ndx.count, QModelIndex())
 
+        value = self._coerce_value(index.column(), value)
+        old_value = self._df.iloc[index.row(), index.column()]
         self._df.iloc[index.row(), index.column()] = value
+        self._changes.edit(index.row(), index.column(), old_value, value)
+        self._append_buffer = None
+        self._invalidate_key_index(index.column())
+        self._record(CellsEdit(positions=np.array([index.row()]),
+                               row_ids=self.row_ids[[index.row()]],
+                               columns=np.array([index.column()]),
+                               old_values=object_array([old_value]),
+                               new_values=object_array([value])))
+        if is_virtual:
+            self.undo_journal.end_group()
 
         # update rows in progress
         if self.row_ndx.in_progress_mask.iloc[index.row()]:
@@ -138,6 +350,7 @@ class DataFrameModel(QAbstractTableModel):
                 if not pd.isnull(value):
                     self.row_ndx.reduce_non_nullable_in_progress(index.row())
 
+        self.cells_written.emit(np.array([index.row()]), [index.column()])
         self.dataChanged.emit(index, index)
         return True
 
@@ -177,6 +390,7 @@ class DataFrameModel(QAbstractTableModel):
 
         self.beginInsertRows(QModelIndex(), row, row + count - 1)
 
+        self._ensure_nullable_columns()
         new_rows = self.null_rows(start_index=row, count=count)
         self._df = pandas_obj_insert_rows(self._df, row, new_rows)
 
@@ -203,6 +417,8 @@ class DataFrameModel(QAbstractTableModel):
         if not index.isValid():
             return Qt.ItemIsEnabled
         flag = QAbstractTableModel.flags(self, index)
+        if not self.editable:
+            return flag
 
         if self.row_ndx.is_virtual(index.row()):
             return flag | Qt.ItemIsEditable
@@ -238,9 +454,11 @@ class DataFrameModel(QAbstractTableModel):
 
     def add_virtual_row(self):
         at_index = self._df.index.size
+        self._ensure_nullable_columns()
         bottom_row = self.null_rows(start_index=at_index, count=1)
-        self._df = self._df.append(bottom_row)
+        self._df = pandas_obj_insert_rows(self._df, at_index, bottom_row)
         self.row_ndx.insert(at_index, 1)
+        self._changes.insert(at_index, 1, committed=False)
 
     def add_virtual_column(self):
         at_index = self._df.columns.size
@@ -248,20 +466,68 @@ class DataFrameModel(QAbstractTableModel):
         self.col_ndx.insert(at_index, 1)        
 
     def null_rows(self, start_index: int, count: int) -> DF:
-        nulls_row: Dict[int, Any] = self.delegate.null_value()
-        data = {self._df.columns[ndx]: null_value
-                for ndx, null_value in nulls_row.items()}
+        """Null rows, with the same dtypes as the data columns"""
+        index = range(start_index, start_index + count)
+        data = {}
+        for ndx, dtype in enumerate(self._df.dtypes):
+            dtype = nullable_dtype(dtype)
+            data[ndx] = pd.Series(null_value_for(dtype), index=index, dtype=dtype)
 
-        nulls_df = pd.DataFrame(data=data,
-                                index=range(start_index, start_index + count))
+        nulls_df = pd.DataFrame(data=data, index=index)
+        nulls_df.columns = self._df.columns
         return nulls_df
 
-    def on_dataChanged(self, first: QModelIndex, last: QModelIndex, roles):
-        self.is_dirty = True
+    def _ensure_nullable_columns(self, columns: Optional[Iterable[int]] = None):
+        """Converts NumPy integer and boolean columns to their pandas
+            nullable dtypes, before any null values are written to them
+        """
+        if columns is None:
+            columns = range(self._df.columns.size)
+        dtypes = {self._df.columns[ndx]: nullable_dtype(self._df.dtypes.iloc[ndx])
+                  for ndx in columns}
+        dtypes = {column: dtype for column, dtype in dtypes.items()
+                  if dtype != self._df.dtypes[column]}
+        if dtypes:
+            self._df = self._df.astype(dtypes)
+
+    def _upcast_column(self, column: int, values: Any):
+        """Changes the dtype of `column` to one, which can hold `values` as
+            well, e.g. int to float for 2.5, as pandas would on concatenation
+        """
+        values = pd.Series(values, dtype=object).infer_objects()
+        name = self._df.columns[column]
+        dtype = pd.concat([self._df.iloc[:1, column], values.iloc[:1]], ignore_index=True).dtype
+        logger.info('Column `{}` changed from {} to {}.'.format(
+            str(name), self._df.dtypes.iloc[column], dtype))
+        self._df = self._df.astype({name: dtype})
+
+    def _coerce_value(self, column_index: int, value: Any) -> Any:
+        """Replaces null `value` with the column dtype's native null value"""
+        if not pd.api.types.is_scalar(value) or not pd.isnull(value):
+            return value
+        self._ensure_nullable_columns([column_index])
+        return null_value_for(self._df.dtypes.iloc[column_index])
+
+    def on_dataChanged(self, first: QModelIndex, last: QModelIndex, roles=None):
+        if first.isValid() and last.isValid():
+            self._increment_version(columns=slice(first.column(), last.column() + 1))
+        else:
+            self._increment_version()
 
     def on_rowsInserted(self, parent: QModelIndex, first: int, last: int):
-        self.is_dirty = True
+        self._increment_version()
         self.row_ndx.insert(at_index=first, count=last - first + 1)
+        self._changes.insert(first, last - first + 1, committed=self._source_update)
+        if self._key_index is not None:
+            if first == self._key_index.size:
+                self._key_index.extend(self._df[self._key_index.key].iloc[first: last + 1])
+            else:
+                self._key_index = None
+        if self._source_update:
+            return
+        self._record(RowsInsert(at_index=first, row_ids=self.row_ids[first: last + 1].copy(),
+                                rows=self._df.iloc[first: last + 1].copy(),
+                                inserted=np.ones(last - first + 1, dtype=bool)))
 
         rows_inserted = list(range(first, last + 1))
 
@@ -275,20 +541,689 @@ class DataFrameModel(QAbstractTableModel):
             self.row_ndx.set_non_nullable_in_progress(
                 rows_inserted, self.col_ndx.non_nullable_mask.sum())
 
+    def on_rowsAboutToBeRemoved(self, parent: QModelIndex, first: int, last: int):
+        if self._source_update:
+            return
+        rows = self._df.iloc[first: last + 1]
+        row_ids = self.row_ids[first: last + 1].copy()
+        self._record(RowsRemove(at_index=first, row_ids=row_ids, rows=rows.copy(),
+                                inserted=self._changes.inserted_mask(row_ids)))
+        self._changes.delete(rows, first)
+
     def on_rowsRemoved(self, parent: QModelIndex, first: int, last: int):
-        self.is_dirty = True
+        self._increment_version()
+        self._key_index = None
+        if self._removing_ahead:
+            return
         self.row_ndx.remove(at_index=first, count=last - first + 1)
+        self._changes.remove(first, last - first + 1)
 
     def sort(self, column_index: int, order: Qt.SortOrder) -> None:
         """Sort table by given column number.
+
+            NOTE: When lazy loading, all remaining rows are fetched first,
+            unless `full_load_on_sort` is disabled, in which case only
+            the loaded rows are sorted and rows fetched later are appended
+            unsorted at the bottom.
         """
+        if not self.sorting_enabled:
+            logger.info('Sorting is disabled.')
+            return
+        if self.full_load_on_sort:
+            self.fetch_all()
+        elif self.canFetchMore(QModelIndex()):
+            logger.info('Sorting the loaded rows only.')
+
         self.layoutAboutToBeChanged.emit()
         
         ascending = True if order == Qt.AscendingOrder else False
-        column_name = self._df.columns[column_index]
-        real_rows = self._df.iloc[ : self.row_ndx.count]
-        virtual_rows = self._df.iloc[self.row_ndx.count : ]
-        real_rows = real_rows.sort_values(by=column_name, ascending=ascending, ignore_index=truncate)
-        self._df = real_rows.append(virtual_rows)
+        column: SER = self._df.iloc[:, column_index].reset_index(drop=True)
+        # stable sort on the column values keeps the column dtypes intact,
+        # as opposed to sorting the whole frame by label
+        order = column.sort_values(ascending=ascending, kind='mergesort',
+                                   na_position='last').index.values
+        self._df = self._df.take(order).reset_index(drop=True)
+        self.row_ndx.take(order)
+        self._changes.take(order)
+
+        self.layoutChanged.emit()
+
+    def set_chunk_source(self, chunks: Iterable[DF], background: bool = False):
+        """Lazy loads the rows from `chunks`, as the user scrolls down.
+
+            Parameters
+            ----------
+            chunks : Iterable[DataFrame]. Chunks with the same columns as the
+            model, e.g. `pd.read_csv(..., chunksize=...)` or a generator.
+
+            background : bool. Default is 'False'. If set, keep fetching
+            the chunks in a worker thread until all rows are loaded.
+        """
+        self._chunks = iter(chunks)
+        if background:
+            self.start_background_fetch()
+
+    @property
+    def is_fully_loaded(self) -> bool:
+        return self._chunks is None
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return self._chunks is not None
+
+    def fetchMore(self, parent: QModelIndex):
+        if self._chunks is None or self._fetching:
+            return
+        self._append_chunk(next(self._chunks, None))
+
+    def fetch_all(self):
+        """Loads all remaining rows at once"""
+        if self._chunks is None:
+            return
+        if self._fetching:
+            # wait for the worker to release the chunks iterator
+            self._fetch_pool.waitForDone()
+            self._fetching = False
+            self._append_fetched()
+        if self._chunks is None:
+            return
+        chunks = list(self._chunks)
+        self._append_chunk(pd.concat(chunks) if chunks else None)
+        self._append_chunk(None)
+
+    def start_background_fetch(self):
+        """Fetches the remaining chunks one by one in a worker thread"""
+        if self._chunks is None or self._fetching:
+            return
+        if self._fetch_pool is None:
+            self._fetch_pool = QThreadPool(self)
+            self._fetch_pool.setMaxThreadCount(1)
+
+        def _next_chunk(*args, **kwargs):
+            self._fetched.append(next(self._chunks, None))
+
+        worker = Worker(func=_next_chunk)
+        worker.signals.result.connect(self._on_chunk_fetched)
+        worker.signals.error.connect(self._on_fetch_error)
+        self._fetching = True
+        self._fetch_pool.start(worker)
+
+    def _on_chunk_fetched(self, *args):
+        self._fetching = False
+        self._append_fetched()
+        self.start_background_fetch()
+
+    def _append_fetched(self):
+        while self._fetched:
+            self._append_chunk(self._fetched.pop(0))
+
+    def _on_fetch_error(self, exc_info):
+        logger.error(msg='Fetching rows failed.', exc_info=exc_info)
+        self._fetching = False
+        self._append_fetched()
+        self._append_chunk(None)
+
+    def _append_chunk(self, chunk: Optional[DF]):
+        if chunk is None:
+            if self._chunks is not None:
+                self._chunks = None
+                self.all_rows_fetched.emit()
+            return
+        self._append_committed(chunk)
+
+    def _append_committed(self, frame: DF):
+        """Appends `frame` rows, coming from the data source, as committed rows"""
+        if frame.index.size == 0:
+            return
+        first = self._df.index.size
+        last = first + frame.index.size - 1
+        frame = frame.set_axis(range(first, last + 1), axis=0)
+
+        self._source_update = True
+        try:
+            self.beginInsertRows(QModelIndex(), first, last)
+            self._df = pd.concat([self._df, frame[self._df.columns]])
+            self.endInsertRows()
+        finally:
+            self._source_update = False
+
+    @property
+    def append_interval(self) -> int:
+        """Interval in msec, in which appended rows are coalesced"""
+        return self._append_timer.interval()
+
+    def set_append_interval(self, msec: int):
+        self._append_timer.setInterval(msec)
+
+    @property
+    def pending_append_count(self) -> int:
+        """Number of appended rows, not yet inserted in the model"""
+        return sum(frame.index.size for frame in self._pending_appends)
+
+    def append_rows(self, rows: Union[DF, Iterable[Mapping[Any, Any]], Mapping[Any, Iterable]]):
+        """Appends rows from a live data feed at the bottom of the table.
+
+            The rows are inserted as committed rows, at most once per
+            `append_interval`, with a single `rowsInserted` notification.
+            Call `flush_appends` to insert pending rows immediately.
+
+            Parameters
+            ----------
+            rows : DataFrame, list of records or dict of columns. Missing columns are set to null.
+        """
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if frame.index.size == 0:
+            return
+        self._pending_appends.append(frame)
+        if not self._append_timer.isActive():
+            self._append_timer.start()
+
+    def flush_appends(self):
+        """Inserts the pending appended rows"""
+        self._append_timer.stop()
+        if not self._pending_appends:
+            return
+        frames, self._pending_appends = self._pending_appends, []
+        frame = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        frame = self._conform_rows(frame)
 
+        if self._append_buffer is None or self._append_buffer_frame is not self._df:
+            self._append_buffer = _ColumnBuffer(self._df)
+
+        first = self._df.index.size
+        last = first + frame.index.size - 1
+        self._source_update = True
+        try:
+            self.beginInsertRows(QModelIndex(), first, last)
+            self._append_buffer.append(frame)
+            self._set_buffer_frame()
+            self.endInsertRows()
+
+            excess = self._df.index.size - self.max_rows if self.max_rows else 0
+            if excess > 0:
+                self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+                self._append_buffer.drop_front(excess)
+                self._set_buffer_frame()
+                self.endRemoveRows()
+        finally:
+            self._source_update = False
+
+    def _conform_rows(self, frame: DF) -> DF:
+        """Casts `frame` to the columns and dtypes of the data"""
+        frame = frame.reindex(columns=self._df.columns)
+
+        # NumPy int and bool columns can't hold the nulls
+        with_nulls = [ndx for ndx, dtype in enumerate(self._df.dtypes)
+                      if nullable_dtype(dtype) != dtype and frame.iloc[:, ndx].isna().any()]
+        if with_nulls:
+            self._ensure_nullable_columns(with_nulls)
+        return frame.astype(self._df.dtypes.to_dict())
+
+    def _set_buffer_frame(self):
+        self._df = self._append_buffer.frame()
+        self._append_buffer_frame = self._df
+
+    def set_viewport(self, first_row: int, last_row: int):
+        """Sets the range of the visible rows.
+
+            Updates from `update_cells` and `update_frame` outside of this
+            range are not repainted with `dataChanged`, since their rows are
+            read when the view scrolls to them. `cells_written` is emitted
+            for all updates.
+        """
+        self._viewport = (first_row, last_row)
+
+    def repaint_rows(self, first: int, last: int):
+        """Emits `dataChanged` for rows `first` to `last` at once, also
+            outside of the viewport, e.g. for the rows a filter proxy shows
+            or hides after `update_cells`.
+        """
+        self.dataChanged.emit(self.index(first, 0),
+                              self.index(last, self._df.columns.size - 1))
+
+    def set_update_interval(self, msec: int):
+        self._update_timer.setInterval(msec)
+
+    def update_cells(self, rows: Iterable[int], columns: Union[int, Iterable[int]], values: Iterable[Any]):
+        """Writes the values of many cells at once, e.g. from a live data feed.
+
+            The values are written column by column, and the touched cells
+            are notified with merged `dataChanged` ranges, at most once per
+            update interval. Updates are committed values and don't make
+            the model dirty.
+
+            Values of mixed types are not coerced to a common type, each
+            column's values are cast to the column dtype.
+
+            Parameters
+            ----------
+            rows : sequence of int. Row position of each cell
+
+            columns : int or sequence of int. Column position of each cell
+
+            values : sequence. New value of each cell
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+        columns = np.broadcast_to(np.asarray(columns, dtype=np.int64), rows.shape)
+        if not isinstance(values, np.ndarray):
+            values = object_array(values)
+        self._write_cells(rows, columns, values)
+        self._update_timer.start()
+
+    def update_frame(self, frame: DF):
+        """Writes the values of `frame`, like `update_cells`.
+
+            `frame` index holds the row positions and its
+            columns are column names of the model.
+        """
+        rows = np.asarray(frame.index, dtype=np.int64)
+        if rows.size == 0:
+            return
+        for ndx in range(frame.columns.size):
+            column = self._df.columns.get_loc(frame.columns[ndx])
+            self._write_column(column, rows, frame.iloc[:, ndx].values)
+        self._update_timer.start()
+
+    def flush_updates(self):
+        """Repaints the pending updates from `update_cells`/`update_frame`.
+            Only the repaint is deferred, `cells_written` is emitted on write.
+        """
+        self._update_timer.stop()
+        regions, self._dirty_regions = self._dirty_regions, {}
+        last_row = self._df.index.size - 1
+
+        self._source_update = True
+        try:
+            for top, left, bottom, right in regions.values():
+                bottom = min(bottom, last_row)
+                if top > bottom:
+                    continue
+                if self._viewport is not None:
+                    first_visible, last_visible = self._viewport
+                    if bottom < first_visible or top > last_visible:
+                        continue
+                self.dataChanged.emit(self.index(top, left), self.index(bottom, right))
+        finally:
+            self._source_update = False
+
+    def _write_cells(self, rows: np.ndarray, columns: np.ndarray, values: np.ndarray,
+                     committed: bool = True) -> Optional[np.ndarray]:
+        """Writes the cells column by column. If not `committed`, the
+            writes are user edits, and the old values are returned.
+        """
+        order = np.argsort(columns, kind='stable')
+        bounds = np.flatnonzero(np.diff(columns[order])) + 1
+        old_values = None if committed else np.empty(rows.size, dtype=object)
+        for positions in np.split(order, bounds):
+            column_old = self._write_column(int(columns[positions[0]]), rows[positions],
+                                            values[positions], committed=committed)
+            if old_values is not None:
+                old_values[positions] = column_old
+        return old_values
+
+    def _write_column(self, column: int, rows: np.ndarray, values: Any,
+                      committed: bool = True) -> Optional[np.ndarray]:
+        if pd.isnull(values).any():
+            self._ensure_nullable_columns([column])
+        cast = cast_values(values, self._df.dtypes.iloc[column])
+        if cast is None:
+            self._upcast_column(column, values)
+            cast = cast_values(values, self._df.dtypes.iloc[column])
+        if cast is not None:
+            values = cast
+        old_values = None if committed \
+            else object_array(self._df.iloc[rows, column].values)
+
+        if self._append_buffer is not None and self._append_buffer_frame is self._df:
+            # the frame is a view of the buffer, so write through the buffer
+            self._append_buffer.put(column, rows, values)
+            if not self._append_buffer.is_view(column):
+                # e.g. Arrow-backed columns are copies of the buffer
+                self._df.iloc[rows, column] = values
+        else:
+            self._df.iloc[rows, column] = values
+            self._append_buffer = None
+        self._increment_version(columns=column)
+        self._invalidate_key_index(column)
+        if committed:
+            self._changes.commit_cells(column, rows)
+        else:
+            self._changes.edit_many(column, rows, old_values, object_array(values))
+        self._mark_dirty_region(column, rows)
+        self.cells_written.emit(rows, [column])
+        return old_values
+
+    def _mark_dirty_region(self, column: int, rows: np.ndarray):
+        rows = np.sort(rows)
+        blocks, starts = np.unique(rows // self.REGION_ROWS, return_index=True)
+        ends = np.r_[starts[1:], rows.size] - 1
+        for block, top, bottom in zip(blocks.tolist(), rows[starts].tolist(), rows[ends].tolist()):
+            region = self._dirty_regions.get(block)
+            if region is None:
+                self._dirty_regions[block] = [top, column, bottom, column]
+            else:
+                region[0] = min(region[0], top)
+                region[1] = min(region[1], column)
+                region[2] = max(region[2], bottom)
+                region[3] = max(region[3], column)
+
+    def _increment_version(self, columns: Any = None):
+        self.version += 1
+        if columns is None:
+            self._column_versions[:] = self.version
+        else:
+            self._column_versions[columns] = self.version
+
+    @property
+    def column_versions(self) -> np.ndarray:
+        """Model `version` of the last change of each column"""
+        return self._column_versions.copy()
+
+    def _on_layout_changed(self, *args):
+        self._increment_version()
+        self._key_index = None
+
+    def _invalidate_key_index(self, column: int):
+        if self._key_index is not None \
+                and self._df.columns[column] == self._key_index.key:
+            self._key_index = None
+
+    def upsert_rows(self, rows: DF, key: Any):
+        """Updates the rows matching `rows` by the `key` column values,
+            and appends the remaining rows, like `append_rows`.
+
+            If `rows` has duplicate keys, the last row wins.
+        """
+        if rows.index.size == 0:
+            return
+        # pending rows must be in the key index
+        self.flush_appends()
+        rows = rows.drop_duplicates(subset=key, keep='last')
+
+        if self._key_index is None or self._key_index.key != key \
+                or self._key_index.size != self._df.index.size:
+            self._key_index = _KeyIndex(key, self._df[key])
+        positions = self._key_index.get_positions(rows[key])
+
+        found = np.flatnonzero(positions >= 0)
+        if found.size:
+            updates = rows.iloc[found].drop(columns=[key])
+            self.update_frame(updates.set_axis(positions[found], axis=0))
+        missing = np.flatnonzero(positions < 0)
+        if missing.size:
+            self.append_rows(rows.iloc[missing])
+
+    def refresh(self, new_df: DF, key: Any):
+        """Updates the data to `new_df`, a new snapshot of the data source,
+            with minimal notifications, so that filters, sorting, scroll
+            position and selection are kept.
+
+            Rows are matched by the `key` column values. Rows missing in
+            `new_df` are removed, changed cells are updated like with
+            `update_frame`, and new rows are appended at the bottom. The
+            matched rows keep their current order, and rows in progress
+            are kept. The changes are committed values.
+
+            Removed rows are dropped from the data at once, and notified
+            with one `rowsRemoved` per range of consecutive rows. If they
+            are scattered in more than `REFRESH_MAX_RUNS` ranges, they are
+            notified with one layout change instead, which re-evaluates the
+            filters over all rows, like sorting does.
+
+            Parameters
+            ----------
+            new_df : DataFrame. The new data, with the model columns and unique keys
+
+            key : Any. The key column
+        """
+        if not new_df.columns.equals(self._df.columns):
+            raise ValueError('`new_df` columns differ from the model columns, '
+                             'use `reset_frame` instead.')
+        new_keys = pd.Index(new_df[key])
+        if not new_keys.is_unique:
+            raise ValueError('Key column `{}` has duplicate values.'.format(str(key)))
+        self.flush_appends()
+
+        # position of each current row in `new_df`, -1 if removed
+        positions = new_keys.get_indexer(self._df[key])
+        in_progress = self.row_ndx.in_progress_mask.to_numpy(dtype=bool)
+        removed = np.flatnonzero((positions < 0) & ~in_progress)
+        runs = consecutive_runs(removed)
+        if len(runs) > self.REFRESH_MAX_RUNS:
+            self._remove_rows_in_layout(removed)
+        elif removed.size:
+            self._remove_rows_ahead(removed, runs)
+        positions = np.delete(positions, removed)
+
+        rows = np.flatnonzero(positions >= 0)
+        new_rows = positions[rows]
+        all_rows = rows.size == self._df.index.size
+        in_order = np.array_equal(new_rows, np.arange(new_rows.size))
+        for column in range(self._df.columns.size):
+            if self._df.columns[column] == key:
+                continue
+            old_values = self._df.iloc[:, column]
+            if not all_rows:
+                old_values = old_values.iloc[rows]
+            new_values = new_df.iloc[:, column]
+            new_values = new_values.iloc[:new_rows.size] if in_order \
+                else new_values.iloc[new_rows]
+            changed = changed_mask(old_values, new_values)
+            if changed.any():
+                self._write_column(column, rows[changed], new_values.values[changed])
+
+        added = np.ones(new_df.index.size, dtype=bool)
+        added[new_rows] = False
+        if added.any():
+            self.append_rows(new_df.iloc[np.flatnonzero(added)].reset_index(drop=True))
+            self.flush_appends()
+        self.flush_updates()
+
+    def _take_rows(self, removed: np.ndarray):
+        """Drops the committed `removed` rows with one `take`, without notifications"""
+        kept = np.ones(self._df.index.size, dtype=bool)
+        kept[removed] = False
+        kept = np.flatnonzero(kept)
+        self._df = self._df.take(kept).reset_index(drop=True)
+        self.row_ndx.take(kept)
+        self._changes.remove_many(removed)
+
+    def _remove_rows_in_layout(self, removed: np.ndarray):
+        """Drops the committed `removed` rows in one layout change. The
+            persistent indexes of the kept rows are moved up, and the ones
+            of the removed rows are invalidated.
+        """
+        self.layoutAboutToBeChanged.emit()
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+        for index in old_indexes:
+            row = index.row()
+            at = int(np.searchsorted(removed, row))
+            if at < removed.size and removed[at] == row:
+                new_indexes.append(QModelIndex())
+            else:
+                new_indexes.append(self.index(row - at, index.column()))
+        self._take_rows(removed)
+        self.changePersistentIndexList(old_indexes, new_indexes)
         self.layoutChanged.emit()
+
+    def _remove_rows_ahead(self, removed: np.ndarray, runs: List[Tuple[int, int]]):
+        """Drops the committed `removed` rows with one `take`, then notifies
+            their removal by `runs`, from the bottom. `rowCount` counts the
+            rows not notified yet, so it's consistent with the notifications.
+        """
+        self._take_rows(removed)
+
+        self._source_update = True
+        self._removing_ahead = True
+        self._removed_ahead = removed.size
+        try:
+            for first, last in reversed(runs):
+                self.beginRemoveRows(QModelIndex(), first, last)
+                self._removed_ahead -= last - first + 1
+                self.endRemoveRows()
+        finally:
+            self._source_update = False
+            self._removing_ahead = False
+            self._removed_ahead = 0
+
+    def edit_cells(self, rows: Iterable[int], columns: Union[int, Iterable[int]], values: Iterable[Any]):
+        """Edits many cells at once as the user, e.g. when pasting, with a
+            single undo step. Like `update_cells`, but the changes are
+            tracked and make the model dirty.
+
+            Parameters
+            ----------
+            rows : sequence of int. Row position of each cell
+
+            columns : int or sequence of int. Column position of each cell
+
+            values : sequence. New value of each cell
+        """
+        if not self.editable:
+            logger.error('Calling `edit_cells` on a read-only model.')
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+        columns = np.array(np.broadcast_to(np.asarray(columns, dtype=np.int64), rows.shape))
+        values = object_array(values)
+        old_values = self._write_cells(rows, columns, values, committed=False)
+        self.flush_updates()
+        self._record(CellsEdit(positions=rows, row_ids=self.row_ids[rows], columns=columns,
+                               old_values=old_values, new_values=values))
+
+    def undo(self) -> bool:
+        """Reverts the last user edit. Returns 'False' if there is nothing to undo."""
+        entry = self.undo_journal.take_undo()
+        if entry is None:
+            return False
+        self._replay(entry.inverse())
+        return True
+
+    def redo(self) -> bool:
+        """Repeats the last undone edit. Returns 'False' if there is nothing to redo."""
+        entry = self.undo_journal.take_redo()
+        if entry is None:
+            return False
+        self._replay(entry)
+        return True
+
+    def _record(self, entry: EditEntry):
+        if self._replaying:
+            return
+        self.undo_journal.record(entry)
+        self.edit_committed.emit(entry)
+
+    def _replay(self, entry: EditEntry):
+        self._replaying = True
+        try:
+            entry.apply(self)
+        finally:
+            self._replaying = False
+        self.edit_committed.emit(entry)
+
+    def _find_rows(self, positions: np.ndarray, row_ids: np.ndarray) -> np.ndarray:
+        """Current positions of `row_ids`, -1 for removed rows.
+            `positions` are checked first, so this is O(len(row_ids)),
+            unless the rows moved.
+        """
+        current = self.row_ids
+        if positions.size and positions.max() < current.size \
+                and np.array_equal(current[positions], row_ids):
+            return positions
+        return pd.Index(current).get_indexer(row_ids)
+
+    def _edit_cells_by_id(self, positions: np.ndarray, row_ids: np.ndarray,
+                          columns: np.ndarray, values: np.ndarray):
+        rows = self._find_rows(positions, row_ids)
+        found = rows >= 0
+        if not found.all():
+            logger.warning('{} edited cells were removed.'.format((~found).sum()))
+            rows, columns, values = rows[found], columns[found], values[found]
+        if rows.size:
+            self._write_cells(rows, columns, values, committed=False)
+            self.flush_updates()
+
+    def _insert_rows_by_id(self, at_index: int, row_ids: np.ndarray, rows: DF, inserted: np.ndarray):
+        at_index = min(at_index, self._df.index.size)
+        last = at_index + row_ids.size - 1
+        rows = self._conform_rows(rows).set_axis(range(at_index, last + 1), axis=0)
+
+        # inserted as committed rows, the tracker restores their state
+        self._source_update = True
+        try:
+            self.beginInsertRows(QModelIndex(), at_index, last)
+            self._df = pandas_obj_insert_rows(self._df, at_index, rows)
+            self.endInsertRows()
+        finally:
+            self._source_update = False
+        self._changes.restore(at_index, row_ids, inserted, rows)
+
+    def _remove_rows_by_id(self, at_index: int, row_ids: np.ndarray):
+        positions = self._find_rows(np.arange(at_index, at_index + row_ids.size), row_ids)
+        positions = np.sort(positions[positions >= 0])
+        for first, last in reversed(consecutive_runs(positions)):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            self._df = pandas_obj_remove_rows(self._df, first, last - first + 1)
+            self.endRemoveRows()
+
+    def _checkpoint(self) -> Dict[str, Any]:
+        """Copy of the data and of the change tracking state, see `EditJournal`"""
+        return {'frame': self._df.copy(),
+                'changes': copy.deepcopy(self._changes),
+                'row_index': self.row_ndx._data.copy()}
+
+    def _restore_checkpoint(self, frame: DF, changes: _ChangeTracker, row_index: DF):
+        self.reset_frame(frame, copy=False)
+        self._changes = changes
+        self.row_ndx._data = row_index
+
+    def snapshot(self) -> Tuple[int, DF]:
+        """Returns `(version, df)`, a consistent copy of the committed data,
+            for readers on background threads.
+
+            Only the columns changed since the last snapshot are copied (see
+            `column_versions`), the others are shared with it. While rows
+            are in progress, the whole frame is copied.
+
+            NOTE: Must be called on the GUI thread. The copy is reused
+            until the model changes, so readers must not modify it.
+        """
+        if self._snapshot is None or self._snapshot[0] != self.version:
+            if self.row_ndx.in_progress_mask.any():
+                self._snapshot_columns = {}
+                frame = self.df
+            else:
+                frame = self._snapshot_frame()
+            self._snapshot = (self.version, frame)
+        return self._snapshot
+
+    def _snapshot_frame(self) -> DF:
+        """Frame of the columns not in progress, copying the changed ones only"""
+        copies = {}
+        positions = np.flatnonzero(~self.col_ndx.in_progress_mask.values)
+        for ndx in positions.tolist():
+            version = int(self._column_versions[ndx])
+            column = self._df.iloc[:, ndx]
+            copied = self._snapshot_columns.get(ndx)
+            if copied is None or copied[0] != version or copied[1].dtype != column.dtype \
+                    or copied[1].size != column.size:
+                copied = (version, column.copy())
+            copies[ndx] = copied
+        self._snapshot_columns = copies
+
+        frame = pd.DataFrame({ndx: copies[ndx][1] for ndx in positions.tolist()},
+                             index=self._df.index, copy=False)
+        frame.columns = self._df.columns[positions]
+        return frame
+
+    def enable_update_queue(self, maxsize: int = 100_000, interval: int = 16) -> UpdateQueue:
+        """Creates the queue, through which other threads can update the model.
+
+            NOTE: Must be called on the GUI thread.
+        """
+        if self.update_queue is None:
+            self.update_queue = UpdateQueue(self, maxsize=maxsize, interval=interval)
+        return self.update_queue
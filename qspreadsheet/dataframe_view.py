@@ -1,5 +1,6 @@
 import logging
 import os
+import re
 import sys
 import traceback
 from functools import partial
@@ -16,9 +17,14 @@ from qspreadsheet import resources_rc
 from qspreadsheet.common import DF, is_iterable, standard_icon
 from qspreadsheet.custom_widgets import ActionButtonBox
 from qspreadsheet.dataframe_model import DataFrameModel
-from qspreadsheet.delegates import (ColumnDelegate, MasterDelegate,
-                                    automap_delegates)
+from qspreadsheet.delegates import (ColumnDelegate, DateDelegate, MasterDelegate,
+                                    automap_delegates, dtype_kind)
 from qspreadsheet.header_view import HeaderView, HeaderWidget
+from qspreadsheet.journal import EditJournal
+from qspreadsheet.menus import DateFilterWidgetAction, RangeFilterWidgetAction
+from qspreadsheet.predicates import (CONTAINS, EQ, FUZZY, GE, GT, LE, LT, NE, PREFIX,
+                                     REGEX, WHOLE_WORD, AboveAverage, Between, Compare,
+                                     IsNull, Predicate, TopN, is_comparable)
 from qspreadsheet.sort_filter_proxy import DataFrameSortFilterProxy
 from qspreadsheet.worker import Worker
 
@@ -43,6 +49,9 @@ class DataFrameView(QTableView):
         parent : [ QWidget ].  Default is 'None'. Parent for this view.
     '''
 
+    # emitted when the view is closed, e.g. to stop feeding its model
+    closed = Signal()
+
     def __init__(self, df: DF, delegates: Optional[Mapping[Any, ColumnDelegate]] = None, parent=None) -> None:
         super(DataFrameView, self).__init__(parent)
         self.threadpool = QThreadPool(self)
@@ -68,8 +77,98 @@ class DataFrameView(QTableView):
             self.header_model.header_widgets[col_ndx].set_filtered(False))
 
         self.horizontalScrollBar().valueChanged.connect(self._model.on_horizontal_scroll)
+        self.verticalScrollBar().valueChanged.connect(self._update_model_viewport)
+        self._proxy.layoutChanged.connect(self._update_model_viewport)
+        self._proxy.rowsInserted.connect(self._update_model_viewport)
+        self._proxy.rowsRemoved.connect(self._update_model_viewport)
         self.set_column_widths()
 
+        undo_shortcut = QShortcut(QKeySequence.Undo, self)
+        undo_shortcut.activated.connect(self.undo)
+        redo_shortcut = QShortcut(QKeySequence.Redo, self)
+        redo_shortcut.activated.connect(self.redo)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[DF],
+                    delegates: Optional[Mapping[Any, ColumnDelegate]] = None,
+                    background: bool = False, parent=None) -> 'DataFrameView':
+        '''Creates a view, which shows the first chunk immediately and
+            lazy loads the remaining chunks as the user scrolls down.
+
+            Parameters
+            ----------
+
+            chunks : Iterable[`pandas.DataFrame`]. Data frames with the same columns,
+            e.g. `pd.read_csv(..., chunksize=...)` or a generator of frames.
+
+            delegates : [ Mapping[column, ColumnDelegate] ].  Default is 'None'.
+
+            background : bool.  Default is 'False'. If set, the remaining
+            chunks are also fetched in a worker thread.
+
+            parent : [ QWidget ].  Default is 'None'. Parent for this view.
+        '''
+        chunks = iter(chunks)
+        view = cls(df=next(chunks), delegates=delegates, parent=parent)
+        view.dataframe_model.set_chunk_source(chunks, background=background)
+        return view
+
+    def set_dataframe(self, df: DF, delegates: Optional[Mapping[Any, ColumnDelegate]] = None):
+        '''Shows `df` in this view, reusing the header, delegates, model and proxy.
+
+            Header widgets are renamed, added or deleted only as needed, and
+            the delegate of a column is kept, if the column has the same name
+            and kind of dtype as before. When the columns are the same, only
+            the data is swapped, and the column widths and edit states are kept.
+            Filters are cleared.
+
+            Parameters
+            ----------
+
+            df : `pandas.DataFrame`. The data frame to manage
+
+            delegates : [ Mapping[column, ColumnDelegate] ].  Default is 'None'.
+            Delegates for some or all columns. Delegates of the other
+            columns are reused or guessed with `automap_delegates`.
+        '''
+        old_df = self._model._df
+        same_columns = df.columns.equals(old_df.columns)
+        disabled = self._model.col_ndx.disabled_mask.values.copy()
+
+        old_delegates = self._main_delegate.delegates
+        old_kinds = {column: (ndx, dtype_kind(dtype))
+                     for ndx, (column, dtype) in enumerate(old_df.dtypes.items())}
+        delegates = delegates or {}
+        column_delegates = {}
+        missing = []
+        for ndx, (column, dtype) in enumerate(df.dtypes.items()):
+            if column in delegates:
+                delegate = delegates[column]
+                delegate.setObjectName(str(column))
+                column_delegates[ndx] = delegate
+                continue
+            old_ndx, kind = old_kinds.get(column, (None, None))
+            if kind == dtype_kind(dtype) and old_ndx in old_delegates:
+                column_delegates[ndx] = old_delegates[old_ndx]
+            else:
+                missing.append(column)
+        if missing:
+            for column, delegate in automap_delegates(df[missing], nullable=True).items():
+                delegate.setObjectName(str(column))
+                column_delegates[df.columns.get_loc(column)] = delegate
+        self._main_delegate.set_column_delegates(column_delegates)
+        # the model's `headerData` returns the header widgets,
+        # so they must match the new columns before the reset
+        if not same_columns:
+            self.header_model.set_columns(df.columns.astype(str))
+
+        self._model.reset_frame(df)
+        if same_columns:
+            self._model.col_ndx.set_disabled_mask(np.flatnonzero(disabled), True)
+        else:
+            self.set_column_widths()
+        self._update_model_viewport()
+
     def sizeHint(self) -> QSize:
         width = 0
         for i in range(self._df.shape[1]):
@@ -80,6 +179,33 @@ class DataFrameView(QTableView):
 
         return QSize(width, self.height())
 
+    def closeEvent(self, event: QCloseEvent):
+        super(DataFrameView, self).closeEvent(event)
+        if event.isAccepted():
+            self.closed.emit()
+
+    def resizeEvent(self, event: QResizeEvent):
+        super(DataFrameView, self).resizeEvent(event)
+        self._update_model_viewport()
+
+    def _update_model_viewport(self, *args):
+        '''Lets the model know which source rows are visible'''
+        row_count = self._proxy.rowCount()
+        if row_count == 0:
+            return
+        first = self.rowAt(0)
+        last = self.rowAt(self.viewport().height())
+        first = max(first, 0)
+        last = row_count - 1 if last < 0 else last
+
+        # sorting is done by the source model, so the source rows
+        # of the visible proxy rows are in the same order
+        source_first = self._proxy.mapToSource(self._proxy.index(first, 0)).row()
+        source_last = self._proxy.mapToSource(self._proxy.index(last, 0)).row()
+        if source_first < 0 or source_last < 0:
+            source_last = self._model.rowCount(QModelIndex()) - 1
+        self._model.set_viewport(max(source_first, 0), source_last)
+
     def contextMenuEvent(self, event: QContextMenuEvent):
         '''Implements right-clicking on cell.
 
@@ -139,7 +265,7 @@ class DataFrameView(QTableView):
         '''(Private) Used to avoid circular reference, when calling self._temp_df
         '''
         current = self.itemDelegate()
-        if current is not None:
+        if current is not None and current is not self._main_delegate:
             current.deleteLater()
 
         for column, column_delegate in delegates.items():
@@ -216,15 +342,9 @@ class DataFrameView(QTableView):
         menu.addAction(standard_icon('CommandLink'),
                        "Filter By Value", partial(self.filter_by_value, row_ndx, col_ndx))
 
-        # GreaterThan/LessThan filter
-        # def _cmp_filter(s_col, op):
-        #     return op(s_col, cell_val)
-        # menu.addAction("Filter Greater Than",
-        #                 partial(self._data_model.filterFunction, col_ndx=col_ndx,
-        #                         function=partial(_cmp_filter, op=operator.ge)))
-        # menu.addAction("Filter Less Than",
-        #                 partial(self._data_model.filterFunction, col_ndx=col_ndx,
-        #                         function=partial(_cmp_filter, op=operator.le)))
+        # Typed filters: comparisons, ranges, top-N, ...
+        menu.addMenu(self.make_predicate_menu(row_ndx, col_ndx))
+
         menu.addAction(standard_icon('DialogResetButton'),
                     "Clear Filter",
                     self.clear_all_filters).setEnabled(self._proxy.is_data_filtered)
@@ -252,20 +372,87 @@ class DataFrameView(QTableView):
         menu.addAction("Open in Excel...", self.async_to_excel)
         return menu
 
+    def make_predicate_menu(self, row_ndx: int, col_ndx: int) -> QMenu:
+        '''Create submenu of typed filters, comparing the raw values
+            of the column with the value of the clicked cell
+        '''
+        column = self._model._df.iloc[:, col_ndx]
+        comparable = is_comparable(column)
+        kind = dtype_kind(column.dtype)
+        if kind == 'datetime':
+            title = 'Date Filters'
+        elif comparable:
+            title = 'Number Filters'
+        else:
+            title = 'Text Filters'
+        menu = QMenu(title, self)
+
+        value = self._cell_value(row_ndx, col_ndx)
+        has_value = value is not None and not pd.isnull(value)
+        display = self.model().data(self.model().index(row_ndx, col_ndx), Qt.DisplayRole)
+        comparisons = [(EQ, 'Equals'), (NE, 'Does Not Equal')]
+        if comparable:
+            comparisons += [(GT, 'Greater Than'), (GE, 'Greater Than Or Equal To'),
+                            (LT, 'Less Than'), (LE, 'Less Than Or Equal To')]
+        for op, text in comparisons:
+            menu.addAction(f'{text} `{display}`',
+                           partial(self.filter_by_predicate, col_ndx, Compare(op, value))
+                           ).setEnabled(has_value)
+
+        if not comparable:
+            menu.addSeparator()
+            text = display if has_value else ''
+            for mode, title in [(CONTAINS, 'Contains'), (PREFIX, 'Begins With'),
+                                (WHOLE_WORD, 'Contains Whole Word'),
+                                (REGEX, 'Matches Regular Expression'), (FUZZY, 'Similar To')]:
+                menu.addAction(f'{title}...', partial(self.filter_text, col_ndx, mode, title, text))
+
+        if comparable:
+            menu.addSeparator()
+            menu.addAction('Between...', partial(self.filter_between, col_ndx))
+            menu.addAction('Top 10...', partial(self.filter_top_n, col_ndx, True))
+            menu.addAction('Bottom 10...', partial(self.filter_top_n, col_ndx, False))
+            if kind != 'bool':
+                menu.addAction('Above Average',
+                               partial(self.filter_by_predicate, col_ndx, AboveAverage()))
+                menu.addAction('Below Average',
+                               partial(self.filter_by_predicate, col_ndx, AboveAverage(below=True)))
+
+        menu.addSeparator()
+        menu.addAction('Is Empty', partial(self.filter_by_predicate, col_ndx, IsNull()))
+        menu.addAction('Is Not Empty',
+                       partial(self.filter_by_predicate, col_ndx, IsNull(negate=True)))
+        return menu
+
     def make_header_menu(self, col_ndx: int, header_widget: HeaderWidget) -> QMenu:
         '''Create popup menu used for header'''
 
         menu = QMenu(self)
-        filter_widget = self._proxy.create_filter_widget()
-        self._proxy.set_filter_key_column(col_ndx)
-        filter_widget.setParent(self)
+        if isinstance(self._model.delegate.delegates.get(col_ndx), DateDelegate):
+            # Year/month/day tree, instead of a list of formatted dates
+            filter_widget = self._proxy.create_date_filter_widget()
+            self._proxy.set_filter_key_column(col_ndx)
+            filter_widget.setParent(self)
+            self._proxy.async_populate_date_tree()
+        elif self._proxy.use_range_filter(col_ndx):
+            # Range slider over the quantiles, instead of a list of millions of values
+            filter_widget = self._proxy.create_range_filter_widget()
+            self._proxy.set_filter_key_column(col_ndx)
+            filter_widget.setParent(self)
+            self._proxy.async_populate_range()
+        else:
+            filter_widget = self._proxy.create_filter_widget()
+            self._proxy.set_filter_key_column(col_ndx)
+            filter_widget.setParent(self)
 
-        # Filter Menu Action
-        filter_widget.str_filter.returnPressed.connect(self.apply_and_close_header_menu)
-        filter_widget.str_filter.textChanged.connect(self.filter_list_widget_by_text)
+            # Filter Menu Action
+            filter_widget.str_filter.returnPressed.connect(self.apply_and_close_header_menu)
+            filter_widget.str_filter.textChanged.connect(self.filter_list_widget_by_text)
+            filter_widget.match_mode_combo.currentIndexChanged.connect(
+                lambda _: self.filter_list_widget_by_text(filter_widget.str_filter.lineEdit.text()))
 
-        self._proxy.set_filter_key_column(col_ndx)
-        self._proxy.async_populate_list()
+            self._proxy.set_filter_key_column(col_ndx)
+            self._proxy.async_populate_list()
 
         menu.addAction(filter_widget)
 
@@ -280,10 +467,12 @@ class DataFrameView(QTableView):
         # Sort Ascending/Decending Menu Action
         menu.addAction(standard_icon('TitleBarShadeButton'),
                        "Sort Ascending",
-                       partial(self.model().sort, col_ndx, Qt.AscendingOrder))
+                       partial(self.model().sort, col_ndx, Qt.AscendingOrder)
+                       ).setEnabled(self._model.sorting_enabled)
         menu.addAction(standard_icon('TitleBarUnshadeButton'),
                        "Sort Descending",
-                       partial(self.model().sort, col_ndx, Qt.DescendingOrder))
+                       partial(self.model().sort, col_ndx, Qt.DescendingOrder)
+                       ).setEnabled(self._model.sorting_enabled)
 
         menu.addSeparator()
 
@@ -342,8 +531,10 @@ class DataFrameView(QTableView):
             _insert(rows)
         else:
             groups = _consecutive_groups(rows)
+            self._model.undo_journal.begin_group()
             for rows in reversed(groups):
                 _insert(rows)
+            self._model.undo_journal.end_group()
 
     def remove_rows(self):
         if not self._model.row_ndx.is_mutable:
@@ -371,12 +562,47 @@ class DataFrameView(QTableView):
         if sequential:
             self.model().removeRows(rows[0], len(rows), QModelIndex())
         else:
+            self._model.undo_journal.begin_group()
             for row in reversed(rows):
                 self.model().removeRows(row, 1, QModelIndex())
+            self._model.undo_journal.end_group()
+
+    def enable_journal(self, path: str, recover: bool = True, **kwargs) -> EditJournal:
+        '''Journals the edits to `path`, so they survive a crash.
+
+            Parameters
+            ----------
+
+            path : str. Path of the journal file
+
+            recover : bool.  Default is 'True'. If set, edits of a previous
+            session in the journal are replayed first. The view must show
+            the same original data as in that session.
+
+            kwargs : Passed to `EditJournal`
+        '''
+        journal = EditJournal(path, parent=self, **kwargs)
+        if recover:
+            journal.recover(self._model)
+        journal.attach(self._model)
+        return journal
+
+    def undo(self):
+        '''Reverts the last edit'''
+        self._model.undo()
+
+    def redo(self):
+        '''Repeats the last reverted edit'''
+        self._model.redo()
     
     def apply_and_close_header_menu(self):
         self.blockSignals(True)
-        self._proxy.apply_list_filter(self.header_menu)
+        if isinstance(self._proxy._filter_widget, DateFilterWidgetAction):
+            self._proxy.apply_date_filter()
+        elif isinstance(self._proxy._filter_widget, RangeFilterWidgetAction):
+            self._proxy.apply_range_filter()
+        else:
+            self._proxy.apply_list_filter(self.header_menu)
         self.blockSignals(False)
         self.header_menu.close()
 
@@ -393,6 +619,54 @@ class DataFrameView(QTableView):
         self._proxy.set_filter_key_column(col_ndx)
         self._proxy.string_filter(cell_val)
 
+    def filter_by_predicate(self, col_ndx: int, predicate: Predicate):
+        '''Filters column `col_ndx` with a typed predicate, see `qspreadsheet.predicates`'''
+        self._proxy.set_filter_key_column(col_ndx)
+        self._proxy.predicate_filter(predicate)
+
+    def filter_between(self, col_ndx: int):
+        column = self._model._df.iloc[:, col_ndx]
+        header = self.header_model.header_widgets[col_ndx].short_text
+        low, ok = QInputDialog.getText(self, 'Between', f'`{header}` from:',
+                                       text=str(column.min()))
+        if not ok:
+            return
+        high, ok = QInputDialog.getText(self, 'Between', f'`{header}` to:',
+                                        text=str(column.max()))
+        if not ok:
+            return
+        try:
+            predicate = Between(_parse_value(column, low), _parse_value(column, high))
+        except (ValueError, TypeError) as e:
+            QMessageBox.warning(self, 'Invalid Value', str(e))
+            return
+        self.filter_by_predicate(col_ndx, predicate)
+
+    def filter_text(self, col_ndx: int, mode: str, title: str, text: str = ''):
+        '''Filters column `col_ndx` by display text, in match `mode`'''
+        header = self.header_model.header_widgets[col_ndx].short_text
+        text, ok = QInputDialog.getText(self, title, f'`{header}` {title.lower()}:', text=text)
+        if not ok or not text:
+            return
+        self._proxy.set_filter_key_column(col_ndx)
+        try:
+            self._proxy.string_filter(text, mode)
+        except re.error as e:
+            QMessageBox.warning(self, 'Invalid Regular Expression', str(e))
+
+    def filter_top_n(self, col_ndx: int, largest: bool = True):
+        title = 'Top N' if largest else 'Bottom N'
+        n, ok = QInputDialog.getInt(self, title, 'Number of rows:', 10, 1, 2**31 - 1)
+        if ok:
+            self.filter_by_predicate(col_ndx, TopN(n, largest=largest))
+
+    def _cell_value(self, row_ndx: int, col_ndx: int) -> Any:
+        '''Raw value of the cell at view row `row_ndx`'''
+        source_row = self._proxy.mapToSource(self._proxy.index(row_ndx, col_ndx)).row()
+        if source_row < 0 or source_row >= self._model._df.index.size:
+            return None
+        return self._model._df.iat[source_row, col_ndx]
+
     @property
     def is_dirty(self) -> bool:
         return self._model.is_dirty
@@ -419,18 +693,28 @@ class DataFrameView(QTableView):
         self._proxy.filter_list_widget_by_text(text=text)    
 
     def async_to_excel(self):
-        worker = Worker(self.to_excel)
+        # the worker reads a snapshot, the model may change meanwhile
+        _, data = self._model.snapshot()
+        worker = Worker(self.to_excel, data=data,
+                        accepted=self._proxy.accepted.copy(),
+                        columns=self._get_visible_column_names())
         worker.signals.error.connect(self.on_error)
         self.threadpool.start(worker)
 
-    def to_excel(self, *args, **kwargs):
+    def to_excel(self, data: Optional[DF] = None, accepted: Optional[pd.Series] = None,
+                 columns: Optional[List[Any]] = None, *args, **kwargs):
         logger.info('Exporting to Excel Started...')
         from subprocess import Popen
-        rows = self._proxy.accepted.loc[self.df.index]
-        columns = self._get_visible_column_names()
+        if data is None:
+            data = self.df
+        if accepted is None:
+            accepted = self._proxy.accepted
+        if columns is None:
+            columns = self._get_visible_column_names()
+        rows = accepted.loc[data.index]
         fname = 'temp.xlsx'
         logger.info('Writing to Excel file...')
-        self.df.loc[rows, columns].to_excel(fname, 'Output')
+        data.loc[rows, columns].to_excel(fname, 'Output')
         logger.info('Opening Excel...')
         Popen(fname, shell=True)
         logger.info('Exporting to Excel Finished')
@@ -458,3 +742,15 @@ def _consecutive_groups(data: List[int]) -> List[List[int]]:
     for _, g in groupby(data, lambda n, c=count(): n-next(c)):
         groups.append(list(g))
     return groups
+
+
+def _parse_value(column: pd.Series, text: str) -> Any:
+    '''Converts `text` to a value comparable with `column`'''
+    kind = dtype_kind(column.dtype)
+    if kind == 'datetime':
+        return pd.Timestamp(text)
+    if kind in ('int', 'float'):
+        return float(text)
+    if kind == 'bool':
+        return text.strip().lower() in ('true', '1', 'yes')
+    return text
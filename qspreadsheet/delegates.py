@@ -136,6 +136,18 @@ class MasterDelegate(ColumnDelegate):
             delegate.deleteLater()
             del delegate
 
+    def set_column_delegates(self, delegates: Mapping[int, ColumnDelegate]):
+        '''Replaces all column delegates. Delegates which are
+            no longer used are deleted, reused ones are kept.
+        '''
+        used = set(id(delegate) for delegate in delegates.values())
+        for delegate in self.delegates.values():
+            if id(delegate) not in used:
+                delegate.deleteLater()
+        self.delegates = {}
+        for column_index, delegate in delegates.items():
+            self.add_column_delegate(column_index, delegate)
+
     def paint(self, painter, option, index):
         delegate = self.delegates.get(index.column())
         if delegate is not None:
@@ -470,18 +482,11 @@ def automap_delegates(df: DF,
                       nullable: Union[bool, Mapping[Any, bool]] = True
                       ) -> Dict[Any, ColumnDelegate]:
     
-    dtypes = df.dtypes.astype(str)
-
     delegates = {}
-    for columnname, dtype in dtypes.items():
-        for key, delegate_class in default_delegates.items():
-            if key in dtype:
-                delegate = delegate_class()
-                break
-        else:
-            delegate = StringDelegate()
-
-        delegates[columnname] = delegate
+    for columnname, dtype in df.dtypes.items():
+        delegate_class = default_delegates.get(
+            dtype_kind(dtype), StringDelegate)
+        delegates[columnname] = delegate_class()
 
     if isinstance(nullable, bool):
         if nullable:
@@ -498,6 +503,29 @@ def automap_delegates(df: DF,
     return delegates
 
 
+def dtype_kind(dtype) -> str:
+    '''Maps column dtype to a `default_delegates` key
+
+        NumPy, pandas nullable (`Int64`, `Float64`, `boolean`, `string`)
+        and Arrow-backed (`int64[pyarrow]`, `string[pyarrow]`, ...) dtypes
+        are all recognized explicitly, instead of matching the dtype name.
+
+        Returns
+        -------
+        One of `'bool'`, `'int'`, `'float'`, `'datetime'` or `'object'`
+    '''
+    types = pd.api.types
+    if types.is_bool_dtype(dtype):
+        return 'bool'
+    if types.is_integer_dtype(dtype):
+        return 'int'
+    if types.is_float_dtype(dtype):
+        return 'float'
+    if types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'object'
+
+
 def as_qdate(datelike: DateLike, format: Optional[str] = None) -> QDate:
     '''Converts date-like value to QDate
 
@@ -63,6 +63,11 @@ class HeaderWidget(QWidget):
             self._text, Qt.ElideRight, self.label.width())
         self.label.setText(elided_text)
 
+    def set_text(self, text: str):
+        self._text = str(text)
+        self.button.setObjectName(self._text)
+        self.label.setText(self.short_text)
+
     def set_filtered(self, filtered: bool):
         if filtered == self.is_filtered:
             return
@@ -81,11 +86,7 @@ class HeaderView(QHeaderView):
         self.filter_btn_mapper = QSignalMapper(self)
 
         for name in columns:
-            name = str(name)
-            header_widget = HeaderWidget(labelText=name, parent=self)
-            self.filter_btn_mapper.setMapping(header_widget.button, name)
-            header_widget.button.clicked.connect(self.filter_btn_mapper.map)
-            self.header_widgets.append(header_widget)
+            self._add_header_widget(str(name))
 
         self.sectionResized.connect(self.on_section_resized)
         self.sectionMoved.connect(self.on_section_moved)
@@ -102,6 +103,37 @@ class HeaderView(QHeaderView):
                 border: 1px solid #21618c; }''')
                 
 
+    def _add_header_widget(self, name: str) -> HeaderWidget:
+        header_widget = HeaderWidget(labelText=name, parent=self)
+        self.filter_btn_mapper.setMapping(header_widget.button, name)
+        header_widget.button.clicked.connect(self.filter_btn_mapper.map)
+        self.header_widgets.append(header_widget)
+        return header_widget
+
+    def set_columns(self, columns: Iterable[str]):
+        '''Updates the header widgets to `columns`, reusing the existing ones.
+            Only the texts of renamed columns are changed, and widgets
+            are added or deleted to match the column count.
+        '''
+        columns = [str(name) for name in columns]
+        for header_widget, name in zip(self.header_widgets, columns):
+            if header_widget.text() == name:
+                continue
+            header_widget.set_text(name)
+            self.filter_btn_mapper.removeMappings(header_widget.button)
+            self.filter_btn_mapper.setMapping(header_widget.button, name)
+
+        while len(self.header_widgets) > len(columns):
+            header_widget = self.header_widgets.pop()
+            self.filter_btn_mapper.removeMappings(header_widget.button)
+            header_widget.deleteLater()
+
+        for name in columns[len(self.header_widgets):]:
+            header_widget = self._add_header_widget(name)
+            if self.isVisible():
+                header_widget.show()
+        self.fix_item_positions()
+
     def showEvent(self, e: QShowEvent):
         for i, header in enumerate(self.header_widgets):
             header.setParent(self)
@@ -0,0 +1,260 @@
+import logging
+import os
+import pickle
+import struct
+import zlib
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+from PySide2.QtCore import *
+
+from qspreadsheet.dataframe_model import DataFrameModel
+from qspreadsheet.undo import EditEntry
+from qspreadsheet.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'QSJ1'
+# record header: payload length, crc32, sequence number, kind
+_HEADER = struct.Struct('<IIQB')
+ENTRY = 1
+DEFAULT_COMPACT_BYTES = 64 * 1024 * 1024
+
+
+class EditJournal(QObject):
+    '''Crash-safe, append-only journal of the user edits of `DataFrameModel`.
+
+        Every committed edit (cell edits, row inserts and removals, undo
+        and redo) is appended to the journal file as a binary record:
+        length, CRC32, sequence number, kind and the pickled `EditEntry`.
+        The file is fsync-ed at most once per `sync_interval` msec.
+
+        When the journal grows over `compact_bytes`, the model data is
+        written to a checkpoint file (`path` + '.checkpoint') in a worker
+        thread, and the journal is truncated to the records after it.
+
+        After a crash, load the original data in a new model and call
+        `recover`, which restores the checkpoint and replays the journal.
+
+        Usage
+        -----
+            journal = EditJournal('table.journal')
+            journal.recover(view.dataframe_model)
+            journal.attach(view.dataframe_model)
+
+        NOTE: Only user edits are journaled. Rows and values from the data
+        source (appends, bulk updates) are expected to come from the source
+        again.
+
+        Parameters
+        ----------
+
+        path : str. Path of the journal file
+
+        sync_interval : int.  Default is 1000. Maximum msec between fsyncs
+
+        compact_bytes : int.  Default is 64 MB. Journal size, which triggers compaction
+    '''
+
+    compacted = Signal()
+    error = Signal(tuple)
+
+    def __init__(self, path: str, sync_interval: int = 1000,
+                 compact_bytes: int = DEFAULT_COMPACT_BYTES, parent: Optional[QObject] = None) -> None:
+        super(EditJournal, self).__init__(parent)
+        self.path = path
+        self.checkpoint_path = path + '.checkpoint'
+        self.compact_bytes = compact_bytes
+        self._model: Optional[DataFrameModel] = None
+        self._file: Optional[BinaryIO] = None
+        self._seq = 0
+        self._compacting = False
+        # incremented when the journal is cleared, while compacting
+        self._generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._sync_timer = QTimer(self)
+        self._sync_timer.setSingleShot(True)
+        self._sync_timer.setInterval(sync_interval)
+        self._sync_timer.timeout.connect(self.sync)
+
+    def recover(self, model: DataFrameModel) -> int:
+        '''Restores the checkpoint, if any, and replays the journal into
+            `model`, which holds the original data. Returns the number
+            of replayed records.
+
+            NOTE: Call before `attach`.
+        '''
+        checkpoint_seq = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as f:
+                checkpoint = pickle.load(f)
+            checkpoint_seq = checkpoint.pop('seq')
+            model._restore_checkpoint(**checkpoint)
+
+        count = 0
+        for seq, kind, entry in read_records(self.path):
+            self._seq = seq
+            if seq <= checkpoint_seq or kind != ENTRY:
+                continue
+            model._replay(entry)
+            count += 1
+        self._seq = max(self._seq, checkpoint_seq)
+        if count:
+            logger.info('Replayed {} journal records.'.format(count))
+        return count
+
+    def attach(self, model: DataFrameModel):
+        '''Starts journaling the edits of `model`'''
+        self._model = model
+        self._open()
+        model.edit_committed.connect(self.append)
+        model.frame_replaced.connect(self.clear)
+        model.destroyed.connect(lambda *args: self.close())
+
+    def append(self, entry: EditEntry):
+        payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        self._seq += 1
+        self._file.write(_pack(self._seq, ENTRY, payload))
+        if not self._sync_timer.isActive():
+            self._sync_timer.start()
+        if not self._compacting and self._file.tell() > self.compact_bytes:
+            self.compact()
+
+    def sync(self):
+        '''Flushes the appended records to the disk'''
+        self._sync_timer.stop()
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def clear(self):
+        '''Drops the journal and the checkpoint, e.g. after the data is saved'''
+        if self._file is not None:
+            self._file.close()
+        self._generation += 1
+        _remove(self.checkpoint_path)
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self.sync()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def compact(self):
+        '''Writes a checkpoint of the model in the background, and drops
+            the journal records included in it.
+        '''
+        if self._compacting or self._model is None:
+            return
+        self.sync()
+        self._compacting = True
+        state = self._model._checkpoint()
+        state['seq'] = self._seq
+        offset = self._file.tell()
+        generation = self._generation
+
+        worker = Worker(_write_checkpoint, self.checkpoint_path, state)
+        worker.signals.result.connect(lambda *args: self._truncate(offset, generation))
+        worker.signals.error.connect(self._on_compact_error)
+        self._pool.start(worker)
+
+    def _truncate(self, offset: int, generation: int):
+        '''Keeps only the records appended after `offset`'''
+        self._compacting = False
+        if generation != self._generation:
+            # the journal was cleared meanwhile, the checkpoint is stale
+            _remove(self.checkpoint_path)
+            return
+        if self._file is None:
+            return
+        self.sync()
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self.compacted.emit()
+
+    def _on_compact_error(self, exc_info: Tuple):
+        self._compacting = False
+        logger.error('Journal compaction failed.', exc_info=exc_info)
+        self.error.emit(exc_info)
+
+    def _open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= len(MAGIC):
+            valid_size = _valid_size(self.path)
+            self._file = open(self.path, 'r+b')
+            # drop a record which was half written during a crash
+            self._file.truncate(valid_size)
+            self._file.seek(valid_size)
+        else:
+            self._file = open(self.path, 'wb')
+            self._file.write(MAGIC)
+
+
+def read_records(path: str) -> Iterator[Tuple[int, int, Any]]:
+    '''Reads `(sequence number, kind, entry)` records of the journal at `path`.
+        Stops at the first incomplete or corrupt record.
+    '''
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not an edit journal: {}'.format(path))
+        for seq, kind, payload in _iter_payloads(f):
+            yield seq, kind, pickle.loads(payload)
+
+
+def _iter_payloads(f: BinaryIO) -> Iterator[Tuple[int, int, bytes]]:
+    while True:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        length, crc, seq, kind = _HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(header[8:] + payload) != crc:
+            logger.warning('Journal ends with an incomplete record, at sequence {}.'.format(seq))
+            return
+        yield seq, kind, payload
+
+
+def _valid_size(path: str) -> int:
+    with open(path, 'rb') as f:
+        f.seek(len(MAGIC))
+        size = len(MAGIC)
+        for _, _, payload in _iter_payloads(f):
+            size += _HEADER.size + len(payload)
+    return size
+
+
+def _pack(seq: int, kind: int, payload: bytes) -> bytes:
+    tail = struct.pack('<QB', seq, kind)
+    crc = zlib.crc32(tail + payload)
+    return struct.pack('<II', len(payload), crc) + tail + payload
+
+
+def _write_checkpoint(path: str, state: Dict[str, Any], *args, **kwargs):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
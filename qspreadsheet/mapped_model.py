@@ -0,0 +1,377 @@
+import glob
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from PySide2.QtCore import *
+from PySide2.QtGui import *
+from PySide2.QtWidgets import *
+
+from qspreadsheet.common import DF, SER
+from qspreadsheet.delegates import MasterDelegate
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+Predicate = Callable[[SER], Any]
+
+
+class MappedColumns():
+    '''Read-only columnar storage, backed by memory mapped files.
+
+        Use `from_feather` to map a Feather (v2) / Arrow IPC file, or
+        `from_npy_dir` to map a directory of `.npy` files, one per column.
+        Values are only read from the mapped pages when requested, in
+        blocks of rows, so the resident set stays small regardless of the
+        file size.
+
+        NOTE: Compressed Feather files can not be memory mapped and
+        are decompressed in memory by `pyarrow`.
+    '''
+
+    def __init__(self, columns: Mapping[Any, Any]) -> None:
+        self._columns: List[Any] = list(columns.values())
+        self.columns = pd.Index(list(columns.keys()))
+        sizes = {len(column) for column in self._columns}
+        if len(sizes) > 1:
+            raise ValueError('All columns must have the same length.')
+        self.num_rows = sizes.pop() if sizes else 0
+
+    @classmethod
+    def from_feather(cls, path: str) -> 'MappedColumns':
+        '''Maps Feather (v2) / Arrow IPC file'''
+        _require_pyarrow()
+        source = pa.memory_map(path, 'r')
+        table = pa.ipc.open_file(source).read_all()
+        return cls(OrderedDict(
+            (name, table.column(i)) for i, name in enumerate(table.column_names)))
+
+    @classmethod
+    def from_npy_dir(cls, path: str, columns: Optional[Sequence[str]] = None) -> 'MappedColumns':
+        '''Maps a directory of `.npy` files, one file per column.
+
+            Parameters
+            ----------
+            path : str. Directory with the `.npy` files
+
+            columns : [ Sequence[str] ].  Default is 'None'. Column names
+            (file names without the `.npy` extension) in display order.
+            If 'None', all files in the directory are used, sorted by name.
+        '''
+        if columns is None:
+            files = sorted(glob.glob(os.path.join(path, '*.npy')))
+            columns = [os.path.splitext(os.path.basename(f))[0] for f in files]
+        return cls(OrderedDict(
+            (name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+            for name in columns))
+
+    @property
+    def dtypes(self) -> SER:
+        return self.empty_frame().dtypes
+
+    def empty_frame(self) -> DF:
+        '''Zero rows `DataFrame` with the columns and dtypes of the storage.
+
+            Useful to create the column delegates with `automap_delegates`.
+        '''
+        return pd.DataFrame({name: self.block(ndx, 0, 0)
+                             for ndx, name in enumerate(self.columns)})
+
+    def block(self, column: int, start: int, stop: int) -> SER:
+        '''Values of the rows in range [`start`, `stop`), for given column'''
+        data = self._columns[column]
+        if isinstance(data, np.ndarray):
+            return pd.Series(np.array(data[start:stop]))
+        return data.slice(start, stop - start).to_pandas()
+
+    def take(self, column: int, positions: np.ndarray) -> SER:
+        '''Values at given row positions, for given column'''
+        data = self._columns[column]
+        if isinstance(data, np.ndarray):
+            return pd.Series(data[positions])
+        return data.take(pa.array(positions)).to_pandas()
+
+    def chunks(self, column: int, positions: Optional[np.ndarray] = None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[int, SER]]:
+        '''Yields `(offset, values)` chunks for given column.
+
+            If `positions` are provided, only values at these row
+            positions are yielded, and `offset` refers to `positions`.
+        '''
+        size = self.num_rows if positions is None else positions.size
+        for start in range(0, size, chunk_size):
+            stop = min(start + chunk_size, size)
+            if positions is None:
+                yield start, self.block(column, start, stop)
+            else:
+                yield start, self.take(column, positions[start:stop])
+
+    def argsort(self, column: int, positions: Optional[np.ndarray] = None,
+                ascending: bool = True) -> np.ndarray:
+        '''Stable sort order of the column values, with nulls at the end.
+
+            If `positions` are provided, only values at these positions are
+            sorted and the result holds positions into `positions`.
+        '''
+        data = self._columns[column]
+        if isinstance(data, np.ndarray):
+            values = data if positions is None else data[positions]
+            values = pd.Series(values)
+        else:
+            values = data if positions is None else data.take(pa.array(positions))
+            order = 'ascending' if ascending else 'descending'
+            return np.asarray(pc.sort_indices(
+                values, sort_keys=[('', order)], null_placement='at_end'))
+        return values.sort_values(ascending=ascending, kind='mergesort',
+                                  na_position='last').index.values
+
+
+class MappedDataFrameModel(QAbstractTableModel):
+    '''Read-only table model over `MappedColumns`.
+
+        The display values are formatted on demand, one block of rows at
+        a time, and only a limited number of formatted blocks is cached.
+        Filters and sorting are evaluated column by column, in chunks,
+        never loading more than one column of the file in memory.
+
+        If `editable` is set, edits are kept in an overlay on top of the
+        mapped data. Use `overlay_frame` to retrieve them.
+
+        Parameters
+        ----------
+
+        source : `MappedColumns`. The mapped data
+
+        delegate : [ MasterDelegate ].  Default is 'None'. Delegate used to
+        format the display values. Create it with `automap_delegates`
+        over `source.empty_frame()`.
+
+        editable : bool.  Default is 'False'. Keep edits in an overlay
+
+        parent : [ QWidget ].  Default is 'None'. Parent for this model.
+    '''
+
+    BLOCK_SIZE = 256
+    MAX_CACHED_BLOCKS = 512
+
+    def __init__(self, source: MappedColumns, delegate: Optional[MasterDelegate] = None,
+                 editable: bool = False, parent: Optional[QWidget] = None) -> None:
+        QAbstractTableModel.__init__(self, parent=parent)
+        self.source = source
+        self.delegate = delegate
+        self.editable = editable
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+
+        # view row -> source row, 'None' when not sorted or filtered
+        self._rows: Optional[np.ndarray] = None
+        self._filters: Dict[int, Predicate] = {}
+        self._sort_key: Optional[Tuple[int, Qt.SortOrder]] = None
+        self._overlay: Dict[int, Dict[int, Any]] = {}
+        self._blocks: 'OrderedDict[Tuple[int, int], Tuple[SER, List[str]]]' = OrderedDict()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if self._rows is None:
+            return self.source.num_rows
+        return self._rows.size
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return self.source.columns.size
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+
+        if role == Qt.DisplayRole:
+            _, display = self._block_for(index)
+            return display[index.row() % self.BLOCK_SIZE]
+
+        if role == Qt.EditRole:
+            return self._value_at(index)
+
+        if self.delegate is None:
+            return None
+
+        if role == Qt.TextAlignmentRole:
+            return int(self.delegate.alignment(index))
+        if role == Qt.BackgroundRole:
+            return self.delegate.background_brush(index)
+        if role == Qt.ForegroundRole:
+            return self.delegate.foreground_brush(index)
+        if role == Qt.FontRole:
+            return self.delegate.font(index)
+        return None
+
+    def setData(self, index: QModelIndex, value: Any, role=Qt.EditRole) -> bool:
+        if not index.isValid() or not self.editable:
+            return False
+        source_row = self.source_row(index.row())
+        self._overlay.setdefault(index.column(), {})[source_row] = value
+        self._blocks.pop((index.column(), index.row() // self.BLOCK_SIZE), None)
+        self.dataChanged.emit(index, index)
+        return True
+
+    def flags(self, index: QModelIndex):
+        flag = QAbstractTableModel.flags(self, index)
+        if self.editable:
+            return flag | Qt.ItemIsEditable
+        return flag
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int) -> Any:
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self.source.columns[section])
+        return str(self.source_row(section))
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
+        self.layoutAboutToBeChanged.emit()
+        self._sort_key = (column, order)
+        self._update_rows()
+        self.layoutChanged.emit()
+
+    def source_row(self, row: int) -> int:
+        '''Maps view row to the row in the mapped file'''
+        if self._rows is None:
+            return row
+        return int(self._rows[row])
+
+    def set_filter(self, column: int, predicate: Predicate):
+        '''Filters the rows with `predicate`, evaluated on the column values.
+
+            `predicate` is called with chunks of the column values,
+            as `pandas.Series`, and must return a boolean mask.
+        '''
+        self.beginResetModel()
+        self._filters[column] = predicate
+        self._update_rows()
+        self.endResetModel()
+
+    def remove_filter(self, column: int):
+        if column not in self._filters:
+            return
+        self.beginResetModel()
+        self._filters.pop(column)
+        self._update_rows()
+        self.endResetModel()
+
+    def clear_filters(self):
+        self.beginResetModel()
+        self._filters.clear()
+        self._update_rows()
+        self.endResetModel()
+
+    def overlay_frame(self) -> DF:
+        '''Edited values, indexed by the row in the mapped file'''
+        return pd.DataFrame({self.source.columns[column]: pd.Series(edits)
+                             for column, edits in self._overlay.items()})
+
+    def discard_edits(self):
+        self.beginResetModel()
+        self._overlay.clear()
+        self._blocks.clear()
+        self.endResetModel()
+
+    def _update_rows(self):
+        self._blocks.clear()
+        positions: Optional[np.ndarray] = None
+        for column, predicate in self._filters.items():
+            positions = self._filtered_positions(column, predicate, positions)
+
+        if self._sort_key is not None:
+            column, order = self._sort_key
+            ascending = (order == Qt.AscendingOrder)
+            if self._overlay.get(column):
+                values = pd.concat([values for _, values in self._column_chunks(column, positions)],
+                                   ignore_index=True)
+                sort_order = values.sort_values(ascending=ascending, kind='mergesort',
+                                                na_position='last').index.values
+            else:
+                sort_order = self.source.argsort(column, positions, ascending)
+            positions = sort_order if positions is None else positions[sort_order]
+        self._rows = positions
+
+    def _filtered_positions(self, column: int, predicate: Predicate,
+                            positions: Optional[np.ndarray]) -> np.ndarray:
+        accepted = []
+        for offset, values in self._column_chunks(column, positions):
+            mask = np.asarray(predicate(values), dtype=bool)
+            found = np.flatnonzero(mask) + offset
+            accepted.append(found if positions is None else positions[found])
+        if not accepted:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(accepted)
+
+    def _column_chunks(self, column: int, positions: Optional[np.ndarray]
+                       ) -> Iterator[Tuple[int, SER]]:
+        '''Column chunks, with the overlay values applied'''
+        edits = self._overlay.get(column)
+        for offset, values in self.source.chunks(column, positions, self.chunk_size):
+            if edits:
+                rows = (np.arange(offset, offset + values.size) if positions is None
+                        else positions[offset: offset + values.size])
+                values = self._apply_overlay(values, rows, edits)
+            yield offset, values
+
+    @staticmethod
+    def _apply_overlay(values: SER, rows: np.ndarray, edits: Dict[int, Any]) -> SER:
+        edited_rows = np.fromiter(edits.keys(), dtype=np.int64, count=len(edits))
+        found = np.flatnonzero(np.isin(rows, edited_rows))
+        if found.size:
+            values = values.astype(object)
+            for i in found:
+                values.iloc[i] = edits[int(rows[i])]
+        return values
+
+    def _block_for(self, index: QModelIndex) -> Tuple[SER, List[str]]:
+        block_no = index.row() // self.BLOCK_SIZE
+        key = (index.column(), block_no)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+
+        start = block_no * self.BLOCK_SIZE
+        stop = min(start + self.BLOCK_SIZE, self.rowCount())
+        if self._rows is None:
+            rows = np.arange(start, stop)
+            values = self.source.block(index.column(), start, stop)
+        else:
+            rows = self._rows[start:stop]
+            values = self.source.take(index.column(), rows)
+        edits = self._overlay.get(index.column())
+        if edits:
+            values = self._apply_overlay(values, rows, edits)
+
+        display = [self._display(self.index(start + i, index.column()), value)
+                   for i, value in enumerate(values)]
+        block = (values, display)
+        self._blocks[key] = block
+        if len(self._blocks) > self.MAX_CACHED_BLOCKS:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _display(self, index: QModelIndex, value: Any) -> str:
+        if self.delegate is not None:
+            return self.delegate.display_data(index, value)
+        if pd.isnull(value):
+            return '.NA'
+        return str(value)
+
+    def _value_at(self, index: QModelIndex) -> Any:
+        values, _ = self._block_for(index)
+        return values.iloc[index.row() % self.BLOCK_SIZE]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('Memory mapping Feather/Arrow IPC files requires `pyarrow`.')
@@ -1,7 +1,9 @@
 import logging
 import os
 import sys
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
 
 from PySide2.QtCore import *
 from PySide2.QtGui import *
@@ -10,7 +12,10 @@ from PySide2.QtWidgets import *
 from qspreadsheet import resources_rc
 from qspreadsheet.common import LEFT, SER, standard_icon
 from qspreadsheet.custom_widgets import LabeledLineEdit
+from qspreadsheet._date_tree import DAY, DateHierarchy, DateNode, merge_ranges
 from qspreadsheet.dataframe_model import DataFrameModel
+from qspreadsheet.predicates import CONTAINS, FUZZY, PREFIX, REGEX, WHOLE_WORD
+from qspreadsheet.sketches import ColumnSummary
 from qspreadsheet.worker import Worker
 
 logger = logging.getLogger(__name__)
@@ -21,6 +26,12 @@ class FilterWidgetAction(QWidgetAction):
 
     all_deselected = Signal(bool)
 
+    VALUE_ROLE = Qt.UserRole + 1
+    COUNT_ROLE = Qt.UserRole + 2
+
+    MATCH_MODES = [('Contains', CONTAINS), ('Begins With', PREFIX), ('Whole Word', WHOLE_WORD),
+                   ('Regular Expression', REGEX), ('Similar To', FUZZY)]
+
     def __init__(self, parent=None) -> None:
         """Checkbox list filter menu
 
@@ -42,6 +53,12 @@ class FilterWidgetAction(QWidgetAction):
         self.str_filter = LabeledLineEdit('Filter', parent=parent)
         layout.addWidget(self.str_filter)
 
+        # How the filter text matches the values
+        self.match_mode_combo = QComboBox(widget)
+        for text, mode in self.MATCH_MODES:
+            self.match_mode_combo.addItem(text, mode)
+        layout.addWidget(self.match_mode_combo)
+
         self.list = QListWidget(widget)
         self.list.setStyleSheet("""
             QListView::item:selected {
@@ -53,6 +70,10 @@ class FilterWidgetAction(QWidgetAction):
 
         layout.addWidget(self.list)
 
+        # Number of rows matching the checked values, out of all rows
+        self.match_label = QLabel(widget)
+        layout.addWidget(self.match_label)
+
         # This button in made visible if the number 
         # of items to show is more than the initial limit
         btn = QPushButton('Not all items showing')
@@ -69,12 +90,46 @@ class FilterWidgetAction(QWidgetAction):
         # Signals/slots
         self.list.itemChanged.connect(self.on_listitem_changed)
         self.num_checked = 0
+        # rows of each value, by lower case value, see `set_counts`
+        self.counts: Dict[str, int] = {}
+        self.total_count = 0
+        self.matched_count = 0
         
     def addItem(self, item: QListWidgetItem):
         if item.checkState() == Qt.Checked:
             self.num_checked += 1
+            self.matched_count += self._count(item)
         self.list.addItem(item)
 
+    def addValue(self, value: str, state: Qt.CheckState) -> QListWidgetItem:
+        """Adds a checkable item for `value`, showing its number of rows"""
+        count = self.counts.get(value.lower())
+        item = QListWidgetItem(value if count is None else '{} ({:,})'.format(value, count))
+        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+        item.setCheckState(state)
+        item.setData(self.VALUE_ROLE, value)
+        item.setData(self.COUNT_ROLE, count or 0)
+        self.addItem(item)
+        return item
+
+    def set_counts(self, counts: Dict[str, int], total: int):
+        """Sets the rows of each value, by lower case value, and the
+            number of all rows, before the values are added
+        """
+        self.counts = counts
+        self.total_count = total
+        self.update_match_label()
+
+    def update_match_label(self):
+        if not self.counts:
+            self.match_label.clear()
+            return
+        self.match_label.setText('{:,} of {:,} rows will match'.format(
+            self.matched_count, self.total_count))
+
+    def _count(self, item: QListWidgetItem) -> int:
+        return item.data(self.COUNT_ROLE) or 0
+
     def addSelectAllItem(self, state: Qt.CheckState) -> QListWidgetItem:
         """Adding '(Select All)' item at the beginning of the QListWidget"""
         item = QListWidgetItem('(Select All)')
@@ -88,8 +143,14 @@ class FilterWidgetAction(QWidgetAction):
     def clear(self):
         self.list.clear()
         self.num_checked = 0
+        self.matched_count = 0
+        self.update_match_label()
         self.all_deselected.emit(True)
 
+    @property
+    def match_mode(self) -> str:
+        return self.match_mode_combo.currentData()
+
     @property
     def list_items_count(self) -> int:
         """Number of list items, excluding the '(Select All)' item"""
@@ -101,22 +162,27 @@ class FilterWidgetAction(QWidgetAction):
         if item is self.select_all_item:
             # Handle "select all" item click
             state = item.checkState()
+            matched_count = 0
             # Select/deselect all items
             for i in range(self.list.count()):
                 itm = self.list.item(i)
                 if itm is self.select_all_item:
                     continue
                 itm.setCheckState(state)
+                matched_count += self._count(itm)
             
             all_unchecked = (state == Qt.Unchecked)
             # -1 is for the select_all_item
             self.num_checked = 0 if all_unchecked else self.list_items_count
+            self.matched_count = 0 if all_unchecked else matched_count
         else:
             # Non "select all" item 
             if item.checkState() == Qt.Unchecked:
                 self.num_checked -= 1
+                self.matched_count -= self._count(item)
             elif item.checkState() == Qt.Checked:
                 self.num_checked += 1
+                self.matched_count += self._count(item)
             assert(self.num_checked >= 0)
             
             # figure out what "select all" should be
@@ -130,6 +196,7 @@ class FilterWidgetAction(QWidgetAction):
         else:
             self.all_deselected.emit(False)
 
+        self.update_match_label()
         self.list.scrollToItem(item)
         self.list.blockSignals(False)
 
@@ -140,5 +207,269 @@ class FilterWidgetAction(QWidgetAction):
             if itm is self.select_all_item:
                 continue
             if itm.checkState() == Qt.Checked:
-                checked.append(itm.text())
+                value = itm.data(self.VALUE_ROLE)
+                checked.append(itm.text() if value is None else value)
         return checked
+
+
+class DateFilterWidgetAction(QWidgetAction):
+    """Year/month/day tree filter menu, for date columns"""
+
+    all_deselected = Signal(bool)
+
+    NODE_ROLE = Qt.UserRole + 1
+
+    def __init__(self, parent=None) -> None:
+        """Year/month/day tree filter menu
+
+            Months and days are added when their year or month
+            is expanded. Checked nodes are translated to day ranges
+            with `selection`.
+
+            Arguments
+            ----------
+
+            parent: (Widget)
+                Parent
+        """
+        super(DateFilterWidgetAction, self).__init__(parent)
+
+        widget = QWidget()
+        layout = QVBoxLayout()
+
+        self.tree = QTreeWidget(widget)
+        self.tree.setHeaderHidden(True)
+        self.tree.setMinimumHeight(150)
+        self.tree.setUniformRowHeights(True)
+        layout.addWidget(self.tree)
+
+        widget.setLayout(layout)
+        self.setDefaultWidget(widget)
+
+        self.hierarchy: Optional[DateHierarchy] = None
+        # nodes of the tree items, items keep the list index
+        self._nodes: List[DateNode] = []
+        self.select_all_item: Optional[QTreeWidgetItem] = None
+        self.blanks_item: Optional[QTreeWidgetItem] = None
+
+        # Signals/slots
+        self.tree.itemExpanded.connect(self.on_item_expanded)
+        self.tree.itemChanged.connect(self.on_item_changed)
+
+    def set_hierarchy(self, hierarchy: DateHierarchy):
+        self.tree.blockSignals(True)
+        self.tree.clear()
+        self.hierarchy = hierarchy
+        self._nodes = []
+        self.blanks_item = None
+
+        root = QTreeWidgetItem(['(Select All)'])
+        root.setFlags(root.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsAutoTristate)
+        root.setCheckState(0, Qt.Checked)
+        for node in hierarchy.years():
+            root.addChild(self._make_item(node, _check_state(node)))
+        if hierarchy.null_count:
+            item = QTreeWidgetItem(['(Blanks) ({:,})'.format(hierarchy.null_count)])
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(0, Qt.Checked if hierarchy.null_checked else Qt.Unchecked)
+            root.addChild(item)
+            self.blanks_item = item
+        self.select_all_item = root
+        self.tree.addTopLevelItem(root)
+        root.setExpanded(True)
+        self.tree.blockSignals(False)
+        self.all_deselected.emit(root.checkState(0) == Qt.Unchecked)
+
+    def _make_item(self, node: DateNode, state: Qt.CheckState) -> QTreeWidgetItem:
+        item = QTreeWidgetItem(['{} ({:,})'.format(node.label, node.count)])
+        item.setFlags(item.flags() | Qt.ItemIsUserCheckable | Qt.ItemIsAutoTristate)
+        item.setCheckState(0, state)
+        item.setData(0, self.NODE_ROLE, len(self._nodes))
+        self._nodes.append(node)
+        if node.level < DAY:
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+        return item
+
+    def on_item_expanded(self, item: QTreeWidgetItem):
+        """Adds the months of a year, or the days of a month"""
+        node = self._node(item)
+        if node is None or item.childCount() or node.level == DAY:
+            return
+        parent_state = item.checkState(0)
+        self.tree.blockSignals(True)
+        for child in self.hierarchy.children(node):
+            # a partially checked node is not expanded yet, its
+            # children are checked as in the hierarchy
+            state = _check_state(child) if parent_state == Qt.PartiallyChecked else parent_state
+            item.addChild(self._make_item(child, state))
+        self.tree.blockSignals(False)
+
+    def _node(self, item: QTreeWidgetItem) -> Optional[DateNode]:
+        ndx = item.data(0, self.NODE_ROLE)
+        return None if ndx is None else self._nodes[ndx]
+
+    def on_item_changed(self, item: QTreeWidgetItem, column: int):
+        self.all_deselected.emit(self.select_all_item.checkState(0) == Qt.Unchecked)
+
+    @property
+    def is_all_selected(self) -> bool:
+        return self.select_all_item is not None \
+            and self.select_all_item.checkState(0) == Qt.Checked
+
+    def selection(self) -> Tuple[np.ndarray, bool]:
+        """Checked `[start, stop)` day ranges, merged, and whether
+            the blanks are checked
+        """
+        ranges = []
+        for i in range(self.select_all_item.childCount()):
+            item = self.select_all_item.child(i)
+            if item is not self.blanks_item:
+                self._collect_ranges(item, ranges)
+        include_null = self.blanks_item is not None \
+            and self.blanks_item.checkState(0) == Qt.Checked
+        return merge_ranges(ranges), include_null
+
+    def _collect_ranges(self, item: QTreeWidgetItem, ranges: list):
+        node = self._node(item)
+        state = item.checkState(0)
+        if state == Qt.Checked:
+            ranges.append((node.start, node.stop))
+        elif state == Qt.PartiallyChecked:
+            if item.childCount():
+                for i in range(item.childCount()):
+                    self._collect_ranges(item.child(i), ranges)
+            else:
+                ranges.extend(self.hierarchy.checked_ranges(node))
+
+
+class RangeFilterWidgetAction(QWidgetAction):
+    """Range slider filter menu, for large numeric and datetime columns"""
+
+    all_deselected = Signal(bool)
+
+    def __init__(self, parent=None) -> None:
+        """Range slider filter menu
+
+            The sliders move over the quantile ticks (0%, 1%, ... 100%)
+            of a `ColumnSummary`, and the most frequent values are listed.
+            An estimated summary is shown first, and replaced by the
+            exact one when it's ready, see `set_summary`.
+
+            Arguments
+            ----------
+
+            parent: (Widget)
+                Parent
+        """
+        super(RangeFilterWidgetAction, self).__init__(parent)
+
+        widget = QWidget()
+        layout = QVBoxLayout()
+
+        self.summary_label = QLabel('Computing...', widget)
+        layout.addWidget(self.summary_label)
+
+        self.low_slider = self._make_slider(widget)
+        self.high_slider = self._make_slider(widget)
+        layout.addWidget(self.low_slider)
+        layout.addWidget(self.high_slider)
+
+        self.range_label = QLabel(widget)
+        layout.addWidget(self.range_label)
+
+        layout.addWidget(QLabel('Most frequent values', widget))
+        self.top_list = QListWidget(widget)
+        self.top_list.setMinimumHeight(100)
+        self.top_list.setSelectionMode(QAbstractItemView.NoSelection)
+        layout.addWidget(self.top_list)
+
+        widget.setLayout(layout)
+        self.setDefaultWidget(widget)
+
+        self.summary: Optional[ColumnSummary] = None
+
+        # Signals/slots
+        self.low_slider.valueChanged.connect(self.on_low_changed)
+        self.high_slider.valueChanged.connect(self.on_high_changed)
+
+    def _make_slider(self, parent: QWidget) -> QSlider:
+        slider = QSlider(Qt.Horizontal, parent)
+        slider.setRange(0, 0)
+        slider.setTickPosition(QSlider.TicksBelow)
+        slider.setEnabled(False)
+        return slider
+
+    def set_summary(self, summary: ColumnSummary):
+        """Shows `summary`, unless the exact summary is shown already.
+            Slider positions are kept, as quantile ticks.
+        """
+        if self.summary is not None and self.summary.exact and not summary.exact:
+            return
+        is_first = self.summary is None
+        self.summary = summary
+        prefix = '' if summary.exact else '≈'
+        self.summary_label.setText('{:,} rows, {}{:,} distinct values, {:,} blanks'.format(
+            summary.count, prefix, summary.distinct, summary.null_count))
+
+        last_tick = max(len(summary.quantiles) - 1, 0)
+        for slider in (self.low_slider, self.high_slider):
+            slider.blockSignals(True)
+            slider.setRange(0, last_tick)
+            slider.setTickInterval(max(last_tick // 10, 1))
+            slider.setEnabled(last_tick > 0)
+            slider.blockSignals(False)
+        if is_first:
+            self.low_slider.setValue(0)
+            self.high_slider.setValue(last_tick)
+        self.update_range_label()
+
+        self.top_list.clear()
+        for value, count in summary.top:
+            self.top_list.addItem('{} ({}{:,})'.format(value, prefix, count))
+        self.all_deselected.emit(last_tick == 0)
+
+    def on_low_changed(self, value: int):
+        if value > self.high_slider.value():
+            self.high_slider.setValue(value)
+        self.update_range_label()
+
+    def on_high_changed(self, value: int):
+        if value < self.low_slider.value():
+            self.low_slider.setValue(value)
+        self.update_range_label()
+
+    def update_range_label(self):
+        if self.summary is None or not self.summary.quantiles:
+            self.range_label.clear()
+            return
+        low, high = self.low_slider.value(), self.high_slider.value()
+        last_tick = len(self.summary.quantiles) - 1
+        low_value, high_value = self.range()
+        self.range_label.setText('{} – {}  ({}% – {}%)'.format(
+            _format_value(low_value), _format_value(high_value),
+            round(100 * low / last_tick), round(100 * high / last_tick)))
+
+    @property
+    def is_full_range(self) -> bool:
+        return self.low_slider.value() == self.low_slider.minimum() \
+            and self.high_slider.value() == self.high_slider.maximum()
+
+    def range(self) -> Tuple[Any, Any]:
+        """Values at the low and high slider ticks"""
+        quantiles = self.summary.quantiles
+        return quantiles[self.low_slider.value()], quantiles[self.high_slider.value()]
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return '{:,.6g}'.format(value)
+    return str(value)
+
+
+def _check_state(node: DateNode) -> Qt.CheckState:
+    if node.num_checked == node.num_days:
+        return Qt.Checked
+    if node.num_checked == 0:
+        return Qt.Unchecked
+    return Qt.PartiallyChecked
+
@@ -0,0 +1,408 @@
+import logging
+import operator
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Pattern, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qspreadsheet.common import SER
+from qspreadsheet._trigram_index import TrigramIndex, within_distance
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+logger = logging.getLogger(__name__)
+
+# below this size numexpr's overhead isn't worth it
+NUMEXPR_MIN_SIZE = 100_000
+# wider date ranges are matched with `searchsorted`, instead of a lookup table
+MAX_LOOKUP_DAYS = 1_000_000
+NS_PER_DAY = 86_400 * 10**9
+
+EQ, NE, LT, LE, GT, GE = '=', '≠', '<', '≤', '>', '≥'
+_OPERATORS: Dict[str, Callable] = {
+    EQ: operator.eq, NE: operator.ne,
+    LT: operator.lt, LE: operator.le,
+    GT: operator.gt, GE: operator.ge}
+_NUMEXPR_OPERATORS = {EQ: '==', NE: '!=', LT: '<', LE: '<=', GT: '>', GE: '>='}
+
+# text match modes, see `text_matcher`
+CONTAINS, PREFIX, WHOLE_WORD, REGEX, FUZZY = 'contains', 'prefix', 'whole word', 'regex', 'fuzzy'
+MATCH_MODES = (CONTAINS, PREFIX, WHOLE_WORD, REGEX, FUZZY)
+
+
+class Bounds(NamedTuple):
+    '''Range of accepted values, 'None' is unbounded'''
+    low: Any
+    high: Any
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+
+
+class Predicate():
+    '''Filter condition on the raw values of a column.
+
+        Predicates are kept by the filter, instead of the masks they
+        produce, so they can be evaluated again when the data changes.
+        `mask` is vectorized: numeric and datetime columns are compared
+        as NumPy arrays (with numexpr, if installed), other columns
+        with pandas operations.
+    '''
+
+    # 'True' if each value is accepted on its own, so changed
+    # rows can be evaluated again without the rest of the column
+    row_wise = True
+
+    def mask(self, column: SER) -> np.ndarray:
+        '''Boolean array, 'True' for the accepted values of `column`'''
+        raise NotImplementedError()
+
+    def describe(self) -> str:
+        raise NotImplementedError()
+
+    def bounds(self) -> Optional[Bounds]:
+        '''Range of the accepted values, if the predicate is a range,
+            so it can be resolved with a sorted index of the column.
+        '''
+        return None
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(type(self).__name__, self.describe())
+
+
+class Compare(Predicate):
+    '''Compares values with `value`, `op` is one of =, ≠, <, ≤, >, ≥.
+        Null values are only accepted by ≠.
+    '''
+
+    def __init__(self, op: str, value: Any) -> None:
+        if op not in _OPERATORS:
+            raise ValueError('Invalid comparison operator: {}'.format(op))
+        self.op = op
+        self.value = value
+
+    def mask(self, column: SER) -> np.ndarray:
+        values, value = _operands(column, self.value)
+        if values is None:
+            result = _OPERATORS[self.op](column, value)
+            return result.to_numpy(dtype=bool, na_value=self.op == NE)
+        if ne is not None and values.size >= NUMEXPR_MIN_SIZE and values.dtype.kind in 'fiub':
+            return ne.evaluate('values {} value'.format(_NUMEXPR_OPERATORS[self.op]))
+        with np.errstate(invalid='ignore'):
+            return _OPERATORS[self.op](values, value)
+
+    def describe(self) -> str:
+        return '{} {}'.format(self.op, self.value)
+
+    def bounds(self) -> Optional[Bounds]:
+        if self.op == EQ:
+            return Bounds(self.value, self.value)
+        if self.op in (LT, LE):
+            return Bounds(None, self.value, high_inclusive=self.op == LE)
+        if self.op in (GT, GE):
+            return Bounds(self.value, None, low_inclusive=self.op == GE)
+        return None
+
+
+class Between(Predicate):
+    '''Accepts values in [`low`, `high`], or (`low`, `high`) if not `inclusive`'''
+
+    def __init__(self, low: Any, high: Any, inclusive: bool = True) -> None:
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+
+    def mask(self, column: SER) -> np.ndarray:
+        values, low = _operands(column, self.low)
+        _, high = _operands(column, self.high)
+        if values is None:
+            inclusive = 'both' if self.inclusive else 'neither'
+            return column.between(low, high, inclusive=inclusive).to_numpy(dtype=bool, na_value=False)
+        if ne is not None and values.size >= NUMEXPR_MIN_SIZE and values.dtype.kind in 'fiub':
+            expr = '(values >= low) & (values <= high)' if self.inclusive \
+                else '(values > low) & (values < high)'
+            return ne.evaluate(expr)
+        with np.errstate(invalid='ignore'):
+            if self.inclusive:
+                return (values >= low) & (values <= high)
+            return (values > low) & (values < high)
+
+    def describe(self) -> str:
+        brackets = '[]' if self.inclusive else '()'
+        return '{}{}, {}{}'.format(brackets[0], self.low, self.high, brackets[1])
+
+    def bounds(self) -> Optional[Bounds]:
+        return Bounds(self.low, self.high, self.inclusive, self.inclusive)
+
+
+class IsNull(Predicate):
+    '''Accepts null values, or non-null values if `negate`'''
+
+    def __init__(self, negate: bool = False) -> None:
+        self.negate = negate
+
+    def mask(self, column: SER) -> np.ndarray:
+        mask = column.isna().to_numpy(dtype=bool)
+        return ~mask if self.negate else mask
+
+    def describe(self) -> str:
+        return 'is not null' if self.negate else 'is null'
+
+
+class TopN(Predicate):
+    '''Accepts the `n` largest values, or the `n` smallest if not `largest`.
+        Values tied with the n-th value are accepted too.
+    '''
+
+    row_wise = False
+
+    def __init__(self, n: int, largest: bool = True) -> None:
+        if n < 1:
+            raise ValueError('`n` must be positive.')
+        self.n = n
+        self.largest = largest
+
+    def mask(self, column: SER) -> np.ndarray:
+        values, valid = _sortable(column)
+        if values is None:
+            ranks = column.rank(method='min', ascending=not self.largest)
+            return (ranks <= self.n).to_numpy(dtype=bool, na_value=False)
+
+        valid_values = values[valid]
+        if self.n >= valid_values.size:
+            return valid
+        if self.largest:
+            threshold = np.partition(valid_values, valid_values.size - self.n)[valid_values.size - self.n]
+            return valid & (values >= threshold)
+        threshold = np.partition(valid_values, self.n - 1)[self.n - 1]
+        return valid & (values <= threshold)
+
+    def describe(self) -> str:
+        return '{} {}'.format('top' if self.largest else 'bottom', self.n)
+
+
+class AboveAverage(Predicate):
+    '''Accepts values above the column average, or below it if `below`'''
+
+    row_wise = False
+
+    def __init__(self, below: bool = False) -> None:
+        self.below = below
+
+    def mask(self, column: SER) -> np.ndarray:
+        values, valid = _sortable(column)
+        if values is None:
+            raise TypeError('Average of {} values is undefined.'.format(column.dtype))
+        if not valid.any():
+            return valid
+        mean = values[valid].astype(np.float64).mean()
+        with np.errstate(invalid='ignore'):
+            mask = values < mean if self.below else values > mean
+        return valid & mask
+
+    def describe(self) -> str:
+        return 'below average' if self.below else 'above average'
+
+
+class DateRanges(Predicate):
+    '''Accepts dates in any of the day ranges, e.g. from the date filter tree.
+
+        `ranges` are `[start, stop)` pairs of day numbers (days since
+        1970-01-01, of the wall-clock date if time zone aware), sorted
+        and not overlapping. Null values are accepted if `include_null`.
+    '''
+
+    def __init__(self, ranges: np.ndarray, include_null: bool = False) -> None:
+        self.ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        self.include_null = include_null
+
+    def mask(self, column: SER) -> np.ndarray:
+        days, valid = day_numbers(column)
+        starts, stops = self.ranges[:, 0], self.ranges[:, 1]
+        if starts.size == 0:
+            mask = np.zeros(days.size, dtype=bool)
+        elif stops[-1] - starts[0] <= MAX_LOOKUP_DAYS:
+            # lookup table of the days in the ranges, days out of
+            # the table are clipped to the 'False' ends
+            first = starts[0] - 1
+            table = np.zeros(stops[-1] - first + 1, dtype=bool)
+            for start, stop in self.ranges:
+                table[start - first: stop - first] = True
+            mask = np.take(table, days - first, mode='clip') & valid
+        else:
+            at = np.searchsorted(starts, days, side='right') - 1
+            mask = (at >= 0) & (days < stops[np.maximum(at, 0)]) & valid
+        if self.include_null:
+            mask |= ~valid
+        return mask
+
+    def describe(self) -> str:
+        return '{} date ranges{}'.format(
+            len(self.ranges), ', and empty' if self.include_null else '')
+
+    def bounds(self) -> Optional[Bounds]:
+        if len(self.ranges) != 1 or self.include_null:
+            return None
+        start, stop = (np.datetime64(int(day), 'D') for day in self.ranges[0])
+        return Bounds(pd.Timestamp(start), pd.Timestamp(stop), high_inclusive=False)
+
+
+class DisplayIn(Predicate):
+    '''Accepts values, whose display text is one of `texts`, ignoring case.
+        The predicate of the filter list.
+    '''
+
+    def __init__(self, texts: Iterable[str], display: Callable[[Any], str]) -> None:
+        self.texts = set(text.lower() for text in texts)
+        self.display = display
+
+    def mask(self, column: SER) -> np.ndarray:
+        return _display_mask(column, lambda value: self.display(value).lower() in self.texts)
+
+    def describe(self) -> str:
+        return 'one of {} values'.format(len(self.texts))
+
+
+class DisplayMatches(Predicate):
+    '''Accepts values, whose display text matches `text` in `mode`, ignoring
+        case, see `text_matcher`. Fuzzy matching uses the trigram `index` of
+        the column's distinct values, if given.
+
+        Raises `re.error` for an invalid regular expression.
+    '''
+
+    def __init__(self, text: str, display: Callable[[Any], str], mode: str = CONTAINS,
+                 max_distance: Optional[int] = None, index: Optional[TrigramIndex] = None) -> None:
+        self.text = text
+        self.display = display
+        self.mode = mode
+        self.max_distance = fuzzy_distance(text) if max_distance is None else max_distance
+        self.index = index
+        self._test = text_matcher(text, mode, self.max_distance)
+
+    def mask(self, column: SER) -> np.ndarray:
+        test = lambda value: self._test(self.display(value))
+        if self.mode == FUZZY and self.index is not None:
+            return self.index.mask(column, self.text, self.max_distance, test)
+        return _display_mask(column, test)
+
+    def describe(self) -> str:
+        if self.mode == FUZZY:
+            return '{} {!r} (≤ {} edits)'.format(self.mode, self.text, self.max_distance)
+        return '{} {!r}'.format(self.mode, self.text)
+
+
+def text_matcher(text: str, mode: str = CONTAINS,
+                 max_distance: Optional[int] = None) -> Callable[[str], bool]:
+    '''Test of display texts, ignoring case, for match `mode`:
+
+        contains, prefix, whole word, regex (searched), or fuzzy (the
+        whole text within `max_distance` edits of `text`). Patterns are
+        compiled once, and cached. Raises `re.error` for an invalid regex.
+    '''
+    lowered = text.lower()
+    if mode == CONTAINS:
+        return lambda value: lowered in value.lower()
+    if mode == PREFIX:
+        return lambda value: value.lower().startswith(lowered)
+    if mode == WHOLE_WORD:
+        search = compile_pattern(r'(?<!\w){}(?!\w)'.format(re.escape(text))).search
+        return lambda value: search(value) is not None
+    if mode == REGEX:
+        search = compile_pattern(text).search
+        return lambda value: search(value) is not None
+    if mode == FUZZY:
+        distance = fuzzy_distance(text) if max_distance is None else max_distance
+        return lambda value: within_distance(value.lower(), lowered, distance)
+    raise ValueError('Invalid match mode: {}'.format(mode))
+
+
+@lru_cache(maxsize=128)
+def compile_pattern(pattern: str) -> Pattern:
+    '''Compiled case insensitive `pattern`, cached'''
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def fuzzy_distance(text: str) -> int:
+    '''Default number of edits for fuzzy matching `text`: 1, or 2 for 8+ characters'''
+    return 1 if len(text) < 8 else 2
+
+
+def day_numbers(column: SER) -> Tuple[np.ndarray, np.ndarray]:
+    '''Days since 1970-01-01 of datetime `column` values, of the wall-clock
+        date if time zone aware, and the mask of the non-null values.
+    '''
+    if getattr(column.dtype, 'tz', None) is not None:
+        column = column.dt.tz_localize(None)
+    values = column.to_numpy()
+    if values.dtype != np.dtype('datetime64[ns]'):
+        values = values.astype('datetime64[ns]')
+    valid = ~np.isnat(values)
+    return values.view(np.int64) // NS_PER_DAY, valid
+
+
+def is_comparable(column: SER) -> bool:
+    ''''True' if the values of `column` are compared as numbers or dates'''
+    return _sortable(column)[0] is not None
+
+
+def _display_mask(column: SER, test: Callable[[Any], bool]) -> np.ndarray:
+    '''Mask of `test` on `column` values, called once per distinct value'''
+    try:
+        codes, uniques = pd.factorize(column)
+    except TypeError:
+        # unhashable values
+        return np.fromiter((test(value) for value in column), dtype=bool, count=column.size)
+    accepted = np.fromiter((test(value) for value in uniques), dtype=bool, count=len(uniques))
+    # nulls have code -1, the last item is their result
+    nulls = codes == -1
+    null_accepted = test(column.iloc[np.argmax(nulls)]) if nulls.any() else False
+    return np.append(accepted, null_accepted)[codes]
+
+
+def _sortable(column: SER) -> Tuple[Optional[np.ndarray], np.ndarray]:
+    '''Numeric view of `column`, for ordering, and the mask of the non-null values'''
+    dtype = column.dtype
+    types = pd.api.types
+    if types.is_datetime64_any_dtype(dtype):
+        return _datetimes(column).view(np.int64), column.notna().to_numpy(dtype=bool)
+    if types.is_bool_dtype(dtype) or types.is_numeric_dtype(dtype):
+        values = _numeric(column)
+        return values, ~np.isnan(values) if values.dtype.kind == 'f' else np.ones(values.size, dtype=bool)
+    return None, column.notna().to_numpy(dtype=bool)
+
+
+def _operands(column: SER, value: Any) -> Tuple[Optional[np.ndarray], Any]:
+    '''NumPy array of `column` and `value` converted to its type, or
+        'None' and `value` for the columns compared with pandas.
+    '''
+    dtype = column.dtype
+    types = pd.api.types
+    if types.is_datetime64_any_dtype(dtype):
+        value = pd.Timestamp(value)
+        if getattr(dtype, 'tz', None) is not None:
+            value = value.tz_localize(dtype.tz) if value.tz is None else value.tz_convert(dtype.tz)
+            # compared as UTC
+            value = value.tz_convert(None)
+        return _datetimes(column), np.datetime64(value.to_datetime64(), 'ns')
+    if types.is_bool_dtype(dtype) or types.is_numeric_dtype(dtype):
+        return _numeric(column), float(value) if not isinstance(value, (bool, np.bool_)) else value
+    return None, value
+
+
+def _datetimes(column: SER) -> np.ndarray:
+    '''`datetime64[ns]` array of `column`, UTC if time zone aware'''
+    if getattr(column.dtype, 'tz', None) is not None:
+        column = column.dt.tz_convert(None)
+    return column.to_numpy(dtype='datetime64[ns]')
+
+
+def _numeric(column: SER) -> np.ndarray:
+    if isinstance(column.dtype, np.dtype):
+        return column.to_numpy()
+    # nullable and Arrow-backed dtypes, missing values as NaN
+    return column.to_numpy(dtype=np.float64, na_value=np.nan)
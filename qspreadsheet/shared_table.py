@@ -0,0 +1,282 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PySide2.QtCore import *
+
+from qspreadsheet.common import DF, consecutive_runs
+from qspreadsheet.dataframe_model import DataFrameModel
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+# Layout of the shared memory block:
+#   header: seq, num_rows, capacity, block_rows, schema length (uint64 each)
+#           followed by the schema as JSON, up to HEADER_SIZE bytes
+#   block versions: uint64 per `block_rows` rows
+#   columns: `capacity` values each, 8-byte aligned
+HEADER_SIZE = 4096
+_SEQ, _NUM_ROWS, _CAPACITY, _BLOCK_ROWS, _SCHEMA_LEN = range(5)
+_SCHEMA_OFFSET = 64
+DEFAULT_BLOCK_ROWS = 4096
+
+
+class _SharedTable():
+    '''Numpy views over the shared memory block of a table'''
+
+    def __init__(self, shm: Any) -> None:
+        self.shm = shm
+        self.header = np.ndarray((5,), dtype=np.uint64, buffer=shm.buf)
+        schema_len = int(self.header[_SCHEMA_LEN])
+        schema = json.loads(bytes(shm.buf[_SCHEMA_OFFSET: _SCHEMA_OFFSET + schema_len]))
+        self.schema: 'OrderedDict[str, np.dtype]' = OrderedDict(
+            (name, np.dtype(dtype)) for name, dtype in schema)
+        self.capacity = int(self.header[_CAPACITY])
+        self.block_rows = int(self.header[_BLOCK_ROWS])
+
+        num_blocks = _num_blocks(self.capacity, self.block_rows)
+        self.versions = np.ndarray((num_blocks,), dtype=np.uint64,
+                                   buffer=shm.buf, offset=HEADER_SIZE)
+        self.columns: List[np.ndarray] = []
+        offset = HEADER_SIZE + num_blocks * 8
+        for dtype in self.schema.values():
+            self.columns.append(np.ndarray((self.capacity,), dtype=dtype,
+                                           buffer=shm.buf, offset=offset))
+            offset += _aligned(self.capacity * dtype.itemsize)
+
+    @property
+    def num_rows(self) -> int:
+        return int(self.header[_NUM_ROWS])
+
+    def frame(self, num_rows: Optional[int] = None) -> DF:
+        '''Zero-copy `DataFrame` over the first `num_rows` rows'''
+        num_rows = self.num_rows if num_rows is None else num_rows
+        data = {ndx: column[:num_rows] for ndx, column in enumerate(self.columns)}
+        df = pd.DataFrame(data, index=pd.RangeIndex(num_rows), copy=False)
+        df.columns = list(self.schema.keys())
+        return df
+
+    def release(self):
+        self.header = self.versions = None
+        self.columns = []
+
+
+class SharedTablePublisher():
+    '''Writes a fixed-schema table into shared memory, for `SharedTableSubscriber`.
+
+        Each column is a fixed size array in the shared memory block. Every
+        `block_rows` rows have a version, which is bumped only when values in
+        these rows change, so subscribers only repaint the changed rows. A
+        sequence counter is odd while writing, so subscribers never pick up
+        a half written update.
+
+        Parameters
+        ----------
+
+        schema : Mapping[column name, dtype]. Fixed-size NumPy dtypes only
+
+        capacity : int. Maximum number of rows
+
+        name : [ str ].  Default is 'None'. Shared memory name, generated if 'None'
+
+        block_rows : int.  Default is 4096. Rows per version block
+    '''
+
+    def __init__(self, schema: Mapping[str, Any], capacity: int,
+                 name: Optional[str] = None, block_rows: int = DEFAULT_BLOCK_ROWS) -> None:
+        _require_shared_memory()
+        dtypes = [(str(column), np.dtype(dtype)) for column, dtype in schema.items()]
+        for column, dtype in dtypes:
+            if dtype.hasobject:
+                raise TypeError('Column `{}` has no fixed-size dtype: {}'.format(column, dtype))
+        schema_json = json.dumps([(column, dtype.str) for column, dtype in dtypes]).encode()
+        if _SCHEMA_OFFSET + len(schema_json) > HEADER_SIZE:
+            raise ValueError('Schema is too large.')
+
+        num_blocks = _num_blocks(capacity, block_rows)
+        size = HEADER_SIZE + num_blocks * 8 + sum(
+            _aligned(capacity * dtype.itemsize) for _, dtype in dtypes)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[_SCHEMA_OFFSET: _SCHEMA_OFFSET + len(schema_json)] = schema_json
+        header = np.ndarray((5,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = (0, 0, capacity, block_rows, len(schema_json))
+        del header
+
+        self._table = _SharedTable(shm)
+        self._table.versions[:] = 0
+        self._version = 0
+
+    @classmethod
+    def from_frame(cls, df: DF, capacity: Optional[int] = None,
+                   name: Optional[str] = None) -> 'SharedTablePublisher':
+        '''Creates publisher with the schema of `df` and publishes it'''
+        publisher = cls(schema=df.dtypes.to_dict(),
+                        capacity=capacity or df.index.size, name=name)
+        publisher.publish(df)
+        return publisher
+
+    @property
+    def name(self) -> str:
+        return self._table.shm.name
+
+    def publish(self, df: DF, start: int = 0, num_rows: Optional[int] = None):
+        '''Writes `df` rows at row position `start`.
+
+            Parameters
+            ----------
+            df : DataFrame. Rows with the publisher's columns
+
+            start : int. Default is 0. Row position of the first row
+
+            num_rows : [ int ].  Default is 'None'. New row count of the
+            table. If 'None', the table holds the rows up to the last row of `df`.
+        '''
+        table = self._table
+        stop = start + df.index.size
+        if num_rows is None:
+            num_rows = max(stop, table.num_rows) if start else stop
+        if stop > table.capacity or num_rows > table.capacity:
+            raise ValueError('Table capacity of {} rows exceeded.'.format(table.capacity))
+
+        changed = np.zeros(df.index.size, dtype=bool)
+        for ndx, column in enumerate(table.schema):
+            new_values = df[column].to_numpy(dtype=table.columns[ndx].dtype)
+            old_values = table.columns[ndx][start:stop]
+            changed |= ~((old_values == new_values) | (pd.isnull(old_values) & pd.isnull(new_values)))
+
+        self._version += 1
+        header = table.header
+        header[_SEQ] += 1  # odd: writing
+        for ndx, column in enumerate(table.schema):
+            table.columns[ndx][start:stop] = df[column].to_numpy(dtype=table.columns[ndx].dtype)
+        changed_blocks = np.unique((np.flatnonzero(changed) + start) // table.block_rows)
+        table.versions[changed_blocks] = self._version
+        if num_rows != table.num_rows:
+            header[_NUM_ROWS] = num_rows
+        header[_SEQ] += 1  # even: done
+
+    def close(self, unlink: bool = True):
+        shm = self._table.shm
+        self._table.release()
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+class SharedTableSubscriber(QObject):
+    '''Shows a table published by `SharedTablePublisher` in `DataFrameModel`.
+
+        The model works directly on the shared memory (zero-copy). Every
+        `interval` msec the block versions are compared with the last seen
+        ones, and only the rows of changed blocks are repainted.
+
+        NOTE: `attach` makes the model read-only and disables sorting on it,
+        since edits would write to the publisher's memory, and sorting would
+        replace the data with a copy, which isn't updated any more.
+
+        Parameters
+        ----------
+
+        name : str. Shared memory name of the publisher
+
+        interval : int.  Default is 1000. Polling interval in msec
+    '''
+
+    def __init__(self, name: str, interval: int = 1000, parent: Optional[QObject] = None) -> None:
+        super(SharedTableSubscriber, self).__init__(parent)
+        _require_shared_memory()
+        self._table = _SharedTable(_attach(name))
+        self._seen = np.zeros_like(self._table.versions)
+        self._model: Optional[DataFrameModel] = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.poll)
+
+    def frame(self) -> DF:
+        '''Zero-copy `DataFrame` over the published rows'''
+        return self._table.frame()
+
+    def attach(self, model: DataFrameModel):
+        '''Sets the model data to the shared table and starts polling.
+            The model is made read-only, and sorting is disabled on it.
+        '''
+        num_rows, versions = self._read_state()
+        self._model = model
+        model.reset_frame(self._table.frame(num_rows), copy=False)
+        model.editable = False
+        model.sorting_enabled = False
+        model.enable_mutable_rows(False)
+        model.enable_virtual_row(False)
+        self._seen = versions if versions is not None else self._table.versions.copy()
+        self._timer.start()
+
+    def poll(self):
+        '''Repaints the rows of the changed blocks'''
+        if self._model is None:
+            return
+        num_rows, versions = self._read_state()
+        if versions is None:
+            # publisher is writing, try again on the next tick
+            return
+
+        if num_rows != self._model._df.index.size:
+            self._model.set_source_frame(self._table.frame(num_rows))
+
+        changed = np.flatnonzero(versions != self._seen)
+        self._seen = versions
+        block_rows = self._table.block_rows
+        for first_block, last_block in consecutive_runs(changed):
+            first = first_block * block_rows
+            last = min((last_block + 1) * block_rows, num_rows) - 1
+            if first <= last:
+                self._model.notify_rows_changed(first, last)
+
+    def close(self):
+        self._timer.stop()
+        self._model = None
+        shm = self._table.shm
+        self._table.release()
+        shm.close()
+
+    def _read_state(self) -> Tuple[int, Optional[np.ndarray]]:
+        header = self._table.header
+        seq = int(header[_SEQ])
+        if seq % 2:
+            return self._table.num_rows, None
+        num_rows = int(header[_NUM_ROWS])
+        versions = self._table.versions.copy()
+        if int(header[_SEQ]) != seq:
+            return num_rows, None
+        return num_rows, versions
+
+
+def _num_blocks(capacity: int, block_rows: int) -> int:
+    return max(1, -(-capacity // block_rows))
+
+
+def _aligned(size: int) -> int:
+    return -(-size // 8) * 8
+
+
+def _attach(name: str) -> Any:
+    '''Attaches to existing shared memory, without taking ownership of it'''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13, the resource tracker would unlink the
+        # memory when the subscriber process exits
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _require_shared_memory():
+    if shared_memory is None:
+        raise ImportError('Shared memory tables require Python 3.8 or newer.')
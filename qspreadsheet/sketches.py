@@ -0,0 +1,327 @@
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from qspreadsheet.common import SER
+from qspreadsheet.predicates import _sortable
+
+logger = logging.getLogger(__name__)
+
+# values are added in chunks, so a pass needs memory for one chunk only
+SKETCH_CHUNK_SIZE = 1_000_000
+# number of quantile ticks: 0%, 1%, ... 100%
+NUM_QUANTILE_TICKS = 101
+
+
+class ColumnSummary(NamedTuple):
+    '''Distinct count, quantiles and most frequent values of a column,
+        estimated by `ColumnSketch.summary`, or exact by `exact_summary`.
+    '''
+    count: int
+    null_count: int
+    distinct: int
+    # values at the quantile ticks, in the column's type
+    quantiles: List[Any]
+    # (value, count), most frequent first
+    top: List[Tuple[Any, int]]
+    exact: bool
+
+
+class HyperLogLog():
+    '''Distinct count estimate, with 2 ** `precision` registers.
+
+        The relative standard error is about 1.04 / sqrt(2 ** `precision`),
+        0.8% for the default. Values are hashed with
+        `pandas.util.hash_pandas_object`, and the registers are updated
+        vectorized, with `np.maximum.at`.
+
+        Parameters
+        ----------
+
+        precision : int. Default is 14. Between 4 and 18
+    '''
+
+    def __init__(self, precision: int = 14) -> None:
+        if not 4 <= precision <= 18:
+            raise ValueError('Invalid HyperLogLog precision: {}'.format(precision))
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values: SER):
+        if values.size == 0:
+            return
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        p = np.uint64(self.precision)
+        buckets = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        # the guard bit limits the rank to 64 - p + 1
+        rest = (hashes << p) | (np.uint64(1) << (p - np.uint64(1)))
+        ranks = (65 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> float:
+        m = self.registers.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # linear counting, for small cardinalities
+            return m * np.log(m / zeros)
+        return float(raw)
+
+
+class TDigest():
+    '''Quantile estimate, as about `compression` / 2 weighted centroids.
+
+        A batch of values is merged with the centroids vectorized: the
+        points are sorted and grouped by the integer part of the k1 scale
+        function of their cumulative weight, which keeps the centroids
+        small at the tails, where quantiles need to be more accurate.
+
+        Parameters
+        ----------
+
+        compression : int. Default is 200
+    '''
+
+    def __init__(self, compression: int = 200) -> None:
+        self.compression = compression
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values: np.ndarray):
+        '''Adds non-null numeric `values`'''
+        if values.size == 0:
+            return
+        values = np.sort(values.astype(np.float64, copy=False))
+        self.min = min(self.min, float(values[0]))
+        self.max = max(self.max, float(values[-1]))
+        # the centroids are sorted, and are inserted in the sorted values
+        at = np.searchsorted(values, self.means)
+        self._compress(np.insert(values, at, self.means),
+                       np.insert(np.ones(values.size), at, self.weights))
+
+    def merge(self, other: 'TDigest'):
+        if other.count == 0:
+            return
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        means = np.concatenate([self.means, other.means])
+        order = np.argsort(means, kind='stable')
+        self._compress(means[order], np.concatenate([self.weights, other.weights])[order])
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        '''Groups sorted points to centroids'''
+        total = weights.sum()
+        q = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1))
+        groups = np.floor(k).astype(np.int64)
+        groups -= groups[0]
+        new_weights = np.bincount(groups, weights)
+        keep = new_weights > 0
+        self.weights = new_weights[keep]
+        self.means = np.bincount(groups, weights * means)[keep] / self.weights
+        self.count = int(round(total))
+
+    def quantile(self, q) -> np.ndarray:
+        '''Values at quantiles `q`, between 0 and 1'''
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        centers = (np.cumsum(self.weights) - self.weights / 2) / self.count
+        return np.interp(q, np.r_[0, centers, 1], np.r_[self.min, self.means, self.max])
+
+    def cdf(self, x) -> np.ndarray:
+        '''Fraction of the values less than or equal to `x`'''
+        x = np.asarray(x, dtype=np.float64)
+        if self.count == 0:
+            return np.full(x.shape, np.nan)
+        centers = (np.cumsum(self.weights) - self.weights / 2) / self.count
+        return np.interp(x, np.r_[self.min, self.means, self.max], np.r_[0, centers, 1])
+
+
+class HeavyHitters():
+    '''Most frequent values, as a Misra-Gries summary of `capacity` counters.
+
+        Each chunk of values is counted exactly (`value_counts`) and merged
+        with the summary. Counts are lower bounds, by at most `error`, and
+        values more frequent than count / (`capacity` + 1) are always kept.
+
+        Parameters
+        ----------
+
+        capacity : int. Default is 100
+    '''
+
+    def __init__(self, capacity: int = 100) -> None:
+        self.capacity = capacity
+        self.counts: Dict[Any, int] = {}
+        self.error = 0
+
+    def add(self, values: SER):
+        if values.size == 0:
+            return
+        chunk_counts = values.value_counts()
+        # values outside the summary and the chunk's top `capacity` + 1
+        # can't be over the threshold below
+        candidates = set(self.counts)
+        candidates.update(chunk_counts.index[:self.capacity + 1])
+        chunk_counts = chunk_counts.reindex(list(candidates), fill_value=0)
+        combined = {value: self.counts.get(value, 0) + int(count)
+                    for value, count in chunk_counts.items()}
+        self._trim(combined)
+
+    def merge(self, other: 'HeavyHitters'):
+        combined = dict(self.counts)
+        for value, count in other.counts.items():
+            combined[value] = combined.get(value, 0) + count
+        self.error += other.error
+        self._trim(combined)
+
+    def _trim(self, combined: Dict[Any, int]):
+        if len(combined) <= self.capacity:
+            self.counts = combined
+            return
+        threshold = sorted(combined.values(), reverse=True)[self.capacity]
+        self.error += threshold
+        self.counts = {value: count - threshold
+                       for value, count in combined.items() if count > threshold}
+
+    def top(self, n: int = 10) -> List[Tuple[Any, int]]:
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class ColumnSketch():
+    '''Approximate summary of a column: distinct count (`HyperLogLog`),
+        quantiles of numeric and datetime values (`TDigest`) and the
+        most frequent values (`HeavyHitters`).
+
+        Built in one pass over chunks of `SKETCH_CHUNK_SIZE` values, and
+        updated with `update`, e.g. with appended rows. Sketches can't
+        drop values, so edited or removed rows need a new sketch.
+
+        Parameters
+        ----------
+
+        column : [ `pandas.Series` ].  Default is 'None'. Values to add
+
+        precision, compression, capacity : int. Parameters of the sketches
+    '''
+
+    def __init__(self, column: Optional[SER] = None, precision: int = 14,
+                 compression: int = 200, capacity: int = 100) -> None:
+        self.dtype = None
+        self.count = 0
+        self.null_count = 0
+        self.distinct = HyperLogLog(precision)
+        self.digest = TDigest(compression)
+        self.heavy_hitters = HeavyHitters(capacity)
+        if column is not None:
+            self.update(column)
+
+    def update(self, values: SER):
+        if self.dtype is None:
+            self.dtype = values.dtype
+        for start in range(0, values.size, SKETCH_CHUNK_SIZE):
+            self._add(values.iloc[start: start + SKETCH_CHUNK_SIZE])
+
+    def _add(self, chunk: SER):
+        sortable, valid = _sortable(chunk)
+        self.count += chunk.size
+        self.null_count += int(chunk.size - np.count_nonzero(valid))
+        if sortable is not None:
+            self.digest.add(sortable[valid])
+        chunk = chunk[valid]
+        try:
+            self.distinct.add(chunk)
+            self.heavy_hitters.add(chunk)
+        except TypeError:
+            # unhashable values, e.g. lists
+            chunk = chunk.astype(str)
+            self.distinct.add(chunk)
+            self.heavy_hitters.add(chunk)
+
+    @property
+    def is_comparable(self) -> bool:
+        return self.digest.count > 0
+
+    def distinct_count(self) -> int:
+        return int(round(self.distinct.estimate()))
+
+    def quantiles(self, q) -> List[Any]:
+        '''Values at quantiles `q`, in the column's type'''
+        if not self.is_comparable:
+            return []
+        return _from_sortable(self.digest.quantile(q), self.dtype)
+
+    def range_count(self, low: Any, high: Any) -> int:
+        '''Estimated number of values in [`low`, `high`]'''
+        low, high = _to_sortable([low, high], self.dtype)
+        fractions = self.digest.cdf([low, high])
+        return int(round((fractions[1] - fractions[0]) * self.digest.count))
+
+    def summary(self, num_ticks: int = NUM_QUANTILE_TICKS, num_top: int = 10) -> ColumnSummary:
+        return ColumnSummary(count=self.count, null_count=self.null_count,
+                             distinct=self.distinct_count(),
+                             quantiles=self.quantiles(np.linspace(0, 1, num_ticks)),
+                             top=self.heavy_hitters.top(num_top), exact=False)
+
+
+def exact_summary(column: SER, num_ticks: int = NUM_QUANTILE_TICKS,
+                  num_top: int = 10) -> ColumnSummary:
+    '''Exact `ColumnSummary` of `column`'''
+    sortable, valid = _sortable(column)
+    quantiles = []
+    if sortable is not None and valid.any():
+        values = sortable[valid].astype(np.float64, copy=False)
+        quantiles = _from_sortable(np.quantile(values, np.linspace(0, 1, num_ticks)),
+                                   column.dtype)
+    column = column[valid]
+    try:
+        counts = column.value_counts()
+    except TypeError:
+        counts = column.astype(str).value_counts()
+    return ColumnSummary(count=int(valid.size),
+                         null_count=int(valid.size - np.count_nonzero(valid)),
+                         distinct=int(counts.size), quantiles=quantiles,
+                         top=[(value, int(count)) for value, count in counts.iloc[:num_top].items()],
+                         exact=True)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    '''Number of bits of uint64 `values`, without the leading zeros'''
+    values = values.copy()
+    length = np.zeros(values.size, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        shift = np.uint64(shift)
+        high = values >= (np.uint64(1) << shift)
+        length[high] += int(shift)
+        values[high] >>= shift
+    return length + (values > 0)
+
+
+def _from_sortable(values: np.ndarray, dtype) -> List[Any]:
+    '''Converts the numeric view of `_sortable` back to `dtype` values'''
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        stamps = pd.to_datetime(np.round(values).astype(np.int64))
+        tz = getattr(dtype, 'tz', None)
+        if tz is not None:
+            # compared as UTC
+            stamps = stamps.tz_localize('UTC').tz_convert(tz)
+        return list(stamps)
+    return [float(value) for value in values]
+
+
+def _to_sortable(values: List[Any], dtype) -> List[float]:
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        stamps = [pd.Timestamp(value) for value in values]
+        return [float((stamp.tz_convert(None) if stamp.tz is not None else stamp).value)
+                for stamp in stamps]
+    return [float(value) for value in values]
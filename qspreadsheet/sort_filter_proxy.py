@@ -1,6 +1,7 @@
 import logging
 from logging import log
 import os
+import re
 import traceback
 
 from numpy.lib.function_base import disp
@@ -9,7 +10,7 @@ from qspreadsheet.worker import Worker
 from numpy.core.fromnumeric import alltrue, size
 from qspreadsheet.dataframe_model import DataFrameModel
 import sys
-from typing import Any, Dict, Generator, Iterable, List, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -18,15 +19,32 @@ from PySide2.QtGui import *
 from PySide2.QtWidgets import *
 
 from qspreadsheet import resources_rc
-from qspreadsheet.common import DF, SER, pandas_obj_insert_rows, pandas_obj_remove_rows
+from qspreadsheet.common import DF, SER, consecutive_runs
+from qspreadsheet._filter_engine import FilterEngine
+from qspreadsheet._trigram_index import TrigramIndex
 from qspreadsheet._ndx import _Ndx
-from qspreadsheet.menus import FilterWidgetAction
+from qspreadsheet.menus import DateFilterWidgetAction, FilterWidgetAction, RangeFilterWidgetAction
+from qspreadsheet.predicates import (CONTAINS, FUZZY, REGEX, Between, DateRanges, DisplayIn,
+                                     DisplayMatches, Predicate, fuzzy_distance, is_comparable,
+                                     text_matcher)
+from qspreadsheet.sketches import ColumnSketch, ColumnSummary, exact_summary
+from qspreadsheet._date_tree import DateHierarchy
+from qspreadsheet._sorted_index import SortedColumnIndex
 
 logger = logging.getLogger(__name__)
 
 INITIAL_FILTER_LIMIT = 5000
 FILTER_VALUES_STEP = 5000
 DEFAULT_FILTER_INDEX = -1
+# edit policies: rows edited by the user stay visible until the
+# filters change, or are filtered again immediately
+KEEP_VISIBLE, REFILTER = 'keep_visible', 'refilter'
+# more changed rows drop the sorted index, instead of patching it
+SORTED_INDEX_PATCH_LIMIT = 10_000
+# numeric and datetime columns with more rows are filtered with a range slider
+RANGE_FILTER_MIN_ROWS = 1_000_000
+# rows or values matched between checks for cancellation
+MATCH_CHUNK_SIZE = 100_000
 
 class DataFrameSortFilterProxy(QSortFilterProxyModel):
 
@@ -38,6 +56,9 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
         self._model: DataFrameModel = model
         self._model.rowsInserted.connect(self.on_rows_inserted)
         self._model.rowsRemoved.connect(self.on_rows_removed)
+        self._model.frame_replaced.connect(self.on_frame_replaced)
+        self._model.cells_written.connect(self.on_cells_written)
+        self._model.layoutChanged.connect(self.on_layout_changed)
 
         self._column_index = 0
         self._filter_widget = None
@@ -46,75 +67,491 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
         self._display_values: Optional[SER] = None
         self._filter_values: Optional[SER] = None
         self._display_values_gen = None
-        self._showing_all_display_values = False
-        self.filter_cache: Dict[int, SER] = {
-            DEFAULT_FILTER_INDEX : self.alltrues() }
-        self.accepted = self.filter_cache[DEFAULT_FILTER_INDEX].copy()
+        # checked state of the filter list values, by the model data index
+        self._list_checked: Optional[SER] = None
+        # mask of each filtered column, and the accepted rows
+        self._engine = FilterEngine(self._model._df.index.size)
+        # predicate of each filtered column, evaluated again on data changes
+        self.predicates: Dict[int, Predicate] = {}
+        # range filters use a sorted index of the column, built in the
+        # background after the first range filter on the column
+        self.use_sorted_index = True
+        self._sorted_indexes: Dict[int, SortedColumnIndex] = {}
+        self._building_indexes: set = set()
+        # incremented when the data changes, to drop indexes being built
+        self._index_generation = 0
+        # whether rows edited by the user stay visible, see `refilter_rows`
+        self.edit_policy = KEEP_VISIBLE
+        self._user_edit = False
+        # filters depending on the whole column are evaluated again once,
+        # after a batch of writes
+        self._reapply_scheduled = False
+        # large columns are filtered with a range slider, over the summary
+        # of a column sketch, which is kept and updated with appended rows
+        self.range_filter_min_rows = RANGE_FILTER_MIN_ROWS
+        self._sketches: Dict[int, ColumnSketch] = {}
+        # incremented when the data changes, to drop sketches being built
+        self._sketch_generation = 0
+        # trigram indexes of the columns' display texts, for fuzzy filters,
+        # and of the filter list values
+        self._text_indexes: Dict[int, TrigramIndex] = {}
+        self._list_index: Optional[TrigramIndex] = None
+        # incremented by each text match, cancels the running ones
+        self._match_generation = 0
 
     def create_filter_widget(self) -> FilterWidgetAction:
         if self._filter_widget:
             self._filter_widget.deleteLater()
+        self._match_generation += 1
         self._filter_widget = FilterWidgetAction()
         self._filter_widget.show_all_btn.clicked.connect(
             self.async_refill_list)
         return self._filter_widget
 
-    def add_filter_mask(self, mask: SER):
-        if self._column_index in self.filter_cache:
-            self.filter_cache.pop(self._column_index)
-        self.filter_cache[self._column_index] = mask
-        # update accepted
-        self._update_accepted(mask)
-        self.column_filtered.emit(self._column_index)
+    def create_date_filter_widget(self) -> DateFilterWidgetAction:
+        if self._filter_widget:
+            self._filter_widget.deleteLater()
+        self._filter_widget = DateFilterWidgetAction()
+        return self._filter_widget
 
-    def remove_filter_mask(self, column_index):
-        if column_index in self.filter_cache:
-            self.filter_cache.pop(column_index)
-        self._update_accepted(self.filter_mask)
-        self.column_unfiltered.emit(self._column_index)
+    def async_populate_date_tree(self):
+        """Builds the year/month/day tree of the filter key column in the
+            background, from the rows accepted by the other filters
+        """
+        self._ensure_loaded_for_filter()
+        col_ndx = self._column_index
+        previous = self._engine.accepted_excluding(col_ndx) & ~self._in_progress()
+        # the worker reads a copy, the model may change meanwhile
+        column = self._column_values(col_ndx)[previous].copy()
+        accepted = self._engine.column_mask(col_ndx)[previous] \
+            if self.is_column_filtered(col_ndx) else None
+        worker = Worker(func=_build_date_hierarchy, column=column, accepted=accepted)
+        worker.signals.result.connect(self._filter_widget.set_hierarchy)
+        worker.signals.error.connect(self.parent().on_error)
+        self._pool.start(worker)
 
-    def _update_accepted(self, mask: SER):
-        self.accepted.loc[:] = False
-        self.accepted.loc[mask.index] = mask
+    def apply_date_filter(self):
+        if self._filter_widget.select_all_item is None:
+            return
+        is_filtered = self.is_column_filtered(self._column_index)
+        if self._filter_widget.is_all_selected:
+            if not is_filtered:
+                return
+            self.remove_filter_mask(self._column_index)
+            self.invalidateFilter()
+            return
+        ranges, include_null = self._filter_widget.selection()
+        self.predicate_filter(DateRanges(ranges, include_null))
 
-    def string_filter(self, text: str):
-        values, _ = self.get_model_values()
+    def use_range_filter(self, col_ndx: int) -> bool:
+        '''Whether column `col_ndx` is filtered with a range slider'''
+        return self._model._df.shape[0] >= self.range_filter_min_rows \
+            and is_comparable(self._column_values(col_ndx))
 
-        self._display_values = pd.Series({
-            ndx : self._model.delegate.display_data(self._model.index(ndx, self._column_index), value)
-            for ndx, value in values.items()})
-        self._showing_all_display_values = True
+    def create_range_filter_widget(self) -> RangeFilterWidgetAction:
+        if self._filter_widget:
+            self._filter_widget.deleteLater()
+        self._filter_widget = RangeFilterWidgetAction()
+        return self._filter_widget
 
-        if text:
-            mask = self._display_values.str.lower().str.contains(text.lower())
+    def async_populate_range(self):
+        """Shows the summary of the filter key column in the range filter
+            widget: the sketch's estimate right away, if it's built, and the
+            exact summary when it's computed in the background. The sketch
+            covers all rows, so it's used only if no other column is filtered.
+        """
+        self._ensure_loaded_for_filter()
+        col_ndx = self._column_index
+        widget = self._filter_widget
+        previous = self._engine.accepted_excluding(col_ndx) & ~self._in_progress()
+        column = self._column_values(col_ndx)
+        if previous.all():
+            sketch = self._sketches.get(col_ndx)
+            if sketch is None:
+                self._build_sketch(col_ndx, column, widget)
+            else:
+                widget.set_summary(sketch.summary())
+        # the worker reads a copy, the model may change meanwhile
+        worker = Worker(func=_exact_summary, column=column[previous].copy())
+        worker.signals.result.connect(lambda summary: self._show_summary(widget, summary))
+        worker.signals.error.connect(self.parent().on_error)
+        self._pool.start(worker)
+
+    def apply_range_filter(self):
+        widget = self._filter_widget
+        if widget.summary is None or not widget.summary.quantiles:
+            return
+        if widget.is_full_range:
+            if self.is_column_filtered(self._column_index):
+                self.remove_filter_mask(self._column_index)
+                self.invalidateFilter()
+            return
+        low, high = widget.range()
+        self.predicate_filter(Between(low, high))
+
+    def _build_sketch(self, col_ndx: int, column: SER,
+                      widget: Optional[RangeFilterWidgetAction] = None):
+        generation = self._sketch_generation
+        worker = Worker(func=_build_column_sketch, column=column.copy())
+        worker.signals.result.connect(
+            lambda sketch: self._on_sketch_built(col_ndx, generation, sketch, widget))
+        worker.signals.error.connect(self.parent().on_error)
+        self._pool.start(worker)
+
+    def _on_sketch_built(self, col_ndx: int, generation: int, sketch: ColumnSketch,
+                         widget: Optional[RangeFilterWidgetAction]):
+        if generation != self._sketch_generation:
+            return
+        self._sketches[col_ndx] = sketch
+        self._show_summary(widget, sketch.summary())
+
+    def _show_summary(self, widget: Optional[RangeFilterWidgetAction], summary: ColumnSummary):
+        # the menu may be closed meanwhile, and its widget replaced
+        if widget is not None and widget is self._filter_widget:
+            widget.set_summary(summary)
+
+    def drop_sketches(self, columns: Optional[Iterable[int]] = None):
+        '''Drops the sketches of `columns` (default all), after their values
+            changed or rows were removed, which sketches can't account for
+        '''
+        self._sketch_generation += 1
+        if columns is None:
+            self._sketches.clear()
+            return
+        for col_ndx in columns:
+            self._sketches.pop(col_ndx, None)
+
+    def drop_text_indexes(self, columns: Optional[Iterable[int]] = None):
+        '''Drops the trigram indexes of `columns` (default all), after their
+            values changed or rows were inserted, removed or reordered
+        '''
+        if columns is None:
+            self._text_indexes.clear()
+            return
+        for col_ndx in columns:
+            self._text_indexes.pop(col_ndx, None)
+
+    def _update_sketches(self, first: int, last: int):
+        '''Adds appended rows to the sketches, or drops them for other inserts'''
+        self._sketch_generation += 1
+        if not self._sketches:
+            return
+        if last != self._engine.size - 1:
+            self._sketches.clear()
+            return
+        complete = ~self._in_progress()[first: last + 1]
+        for col_ndx, sketch in self._sketches.items():
+            sketch.update(self._column_values(col_ndx).iloc[first: last + 1][complete])
+
+    def add_filter_mask(self, mask: np.ndarray, predicate: Optional[Predicate] = None,
+                        col_ndx: Optional[int] = None):
+        '''Sets the filter of column `col_ndx` (default the filter key
+            column), `mask` is positional over all model rows
+        '''
+        if col_ndx is None:
+            col_ndx = self._column_index
+        self._engine.set_mask(col_ndx, mask)
+        if predicate is None:
+            self.predicates.pop(col_ndx, None)
         else:
-            mask = pd.Series(data=True, index=self._display_values.index)
+            self.predicates[col_ndx] = predicate
+        self.column_filtered.emit(col_ndx)
 
-        self.add_filter_mask(mask)
+    def remove_filter_mask(self, column_index):
+        self._engine.remove(column_index)
+        self.predicates.pop(column_index, None)
+        self.column_unfiltered.emit(column_index)
+
+    def predicate_filter(self, predicate: Predicate):
+        '''Filters the filter key column with a typed `predicate`, which is
+            evaluated on the raw column values, not on the display strings.
+        '''
+        self._ensure_loaded_for_filter()
+        self.add_filter_mask(self._predicate_mask(self._column_index, predicate), predicate)
         self.invalidateFilter()
 
-    def filter_list_widget_by_text(self, text: str):
-        self._filter_widget.clear()
-        if text:
-            mask = self._filter_values.str.lower().str.contains(text.lower())
-            filter_values = self._filter_values.loc[mask]
-            if filter_values.size == 0:
-                return
+    def on_layout_changed(self):
+        '''Rows are reordered (e.g. sorted) or removed (see
+            `DataFrameModel.refresh`), so the positional masks are evaluated
+            again. The proxy maps the rows again after the layout change,
+            so `invalidateFilter` isn't needed.
+        '''
+        self.drop_sorted_indexes()
+        self.drop_text_indexes()
+        num_rows = self._model._df.index.size
+        if num_rows != self._engine.size:
+            # the masks are set again by `reapply_predicates`
+            self._engine.clear(size=num_rows)
+            self.drop_sketches()
+        self.reapply_predicates(invalidate=False)
+
+    def reapply_predicates(self, invalidate: bool = True):
+        '''Evaluates the filters again, e.g. after the data changed'''
+        if not self.predicates:
+            return
+        for col_ndx, predicate in self.predicates.items():
+            self._engine.set_mask(col_ndx, self._predicate_mask(col_ndx, predicate), update=False)
+        self._engine.update()
+        if invalidate:
+            self.invalidateFilter()
+
+    def _predicate_mask(self, col_ndx: int, predicate: Predicate) -> np.ndarray:
+        '''Mask of the rows accepted by `predicate`, over all model rows'''
+        column = self._column_values(col_ndx)
+
+        bounds = predicate.bounds()
+        index = self._sorted_indexes.get(col_ndx)
+        if bounds is not None and index is not None:
+            mask = index.range_mask(*bounds)
+        else:
+            mask = predicate.mask(column)
+            if bounds is not None and self.use_sorted_index and is_comparable(column):
+                self._build_sorted_index(col_ndx, column)
+        # rows in progress stay visible
+        return mask | self._in_progress()
+
+    def _in_progress(self) -> np.ndarray:
+        return self._model.row_ndx.in_progress_mask.to_numpy(dtype=bool)
+
+    def _display_function(self, col_ndx: int):
+        '''Display text of column `col_ndx` values, as filtered by the filter list'''
+        index = self._model.index(0, col_ndx)
+        delegate = self._model.delegate
+        return lambda value: delegate.display_data(index, value)
+
+    def _column_values(self, col_ndx: int) -> SER:
+        '''Column of the model data, including the rows in progress.
+            Avoids copying the whole frame, as `DataFrameModel.df` does.
+        '''
+        return self._model._df.iloc[:, col_ndx]
+
+    def _build_sorted_index(self, col_ndx: int, column: SER):
+        if col_ndx in self._building_indexes:
+            return
+        self._building_indexes.add(col_ndx)
+        generation = self._index_generation
+        # the worker sorts a copy, the model may change meanwhile
+        worker = Worker(func=_build_sorted_index, column=column.copy())
+        worker.signals.result.connect(
+            lambda index: self._on_sorted_index_built(col_ndx, generation, index))
+        worker.signals.error.connect(self.parent().on_error)
+        worker.signals.finished.connect(lambda: self._building_indexes.discard(col_ndx))
+        self._pool.start(worker)
 
-            for _, value in filter_values.items():
-                item = QListWidgetItem(value)
-                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
-                item.setCheckState(Qt.Checked)
-                self._filter_widget.addItem(item)
+    def _on_sorted_index_built(self, col_ndx: int, generation: int, index: SortedColumnIndex):
+        if generation == self._index_generation:
+            self._sorted_indexes[col_ndx] = index
+
+    def drop_sorted_indexes(self):
+        '''Drops the sorted indexes, e.g. after the rows are reordered'''
+        self._sorted_indexes.clear()
+        self._index_generation += 1
+
+    def on_cells_written(self, rows: np.ndarray, columns: Iterable[int]):
+        '''Every write of the model data, including the writes not repainted.
+            Emitted before `dataChanged`, so the proxy maps the written rows
+            with the patched filter masks. Writes outside of the viewport
+            aren't notified with `dataChanged`, so the rows they show or
+            hide are notified here, see `_remap_rows`.
+        '''
+        self.drop_sketches(columns)
+        self.drop_text_indexes(columns)
+        self._update_sorted_indexes(rows, columns)
+        if any(col_ndx in self.predicates for col_ndx in columns):
+            keep_visible = self._user_edit and self.edit_policy == KEEP_VISIBLE
+            flipped = self.refilter_rows(rows, columns, keep_visible)
+            # `setData` notifies the edited cell itself
+            if flipped.size and not self._user_edit:
+                self._remap_rows(flipped)
+
+    def refilter_rows(self, rows: np.ndarray, columns: Optional[Iterable[int]] = None,
+                      keep_visible: bool = False) -> np.ndarray:
+        '''Evaluates the filters of `columns` (default all) again for the
+            source `rows` only, e.g. after edits or inserts, and patches the
+            column masks and the accepted rows. If `keep_visible`, accepted
+            rows are not hidden. Returns the rows shown or hidden.
+
+            NOTE: The proxy calls `filterAcceptsRow` only for the source rows
+            notified with `dataChanged` or `rowsInserted`. Other rows shown
+            or hidden need `_remap_rows`. Filters which depend on the whole
+            column (e.g. top-N) are evaluated again with `invalidateFilter`,
+            once for many writes.
+        '''
+        flipped = np.empty(0, dtype=np.int64)
+        predicates = {col_ndx: predicate for col_ndx, predicate in self.predicates.items()
+                      if columns is None or col_ndx in columns}
+        if not predicates:
+            return flipped
+        if not all(predicate.row_wise for predicate in predicates.values()):
+            # after the proxy handled the source change, once for many writes
+            if not self._reapply_scheduled:
+                self._reapply_scheduled = True
+                QTimer.singleShot(0, self._reapply_scheduled_predicates)
+            return flipped
+
+        in_progress = self._in_progress()
+        rows = rows[rows < min(self._engine.size, in_progress.size)]
+        # rows in progress stay visible
+        rows = rows[~in_progress[rows]]
+        if rows.size == 0:
+            return flipped
+
+        df = self._model._df
+        for col_ndx, predicate in predicates.items():
+            self._engine.patch(col_ndx, rows, predicate.mask(df.iloc[rows, col_ndx]))
+
+        accepted = self._engine.rows_accepted(rows)
+        if keep_visible:
+            accepted |= self._engine.accepted[rows]
+        flipped = rows[accepted != self._engine.accepted[rows]]
+        self._engine.accepted[rows] = accepted
+        return flipped
+
+    def _remap_rows(self, rows: np.ndarray):
+        '''Makes the proxy show or hide the source `rows`, with `dataChanged`
+            per range of consecutive rows, or with `invalidateFilter` if
+            they are scattered in more than `REFRESH_MAX_RUNS` ranges
+        '''
+        runs = consecutive_runs(np.unique(rows))
+        if len(runs) > self._model.REFRESH_MAX_RUNS:
+            self.invalidateFilter()
+            return
+        for first, last in runs:
+            self._model.repaint_rows(first, last)
+
+    def _reapply_scheduled_predicates(self):
+        self._reapply_scheduled = False
+        self.reapply_predicates()
+
+    def setData(self, index: QModelIndex, value: Any, role: int = Qt.EditRole) -> bool:
+        self._user_edit = True
+        try:
+            return super(DataFrameSortFilterProxy, self).setData(index, value, role)
+        finally:
+            self._user_edit = False
+
+    def insertRows(self, row: int, count: int, parent: QModelIndex = QModelIndex()) -> bool:
+        self._user_edit = True
+        try:
+            return super(DataFrameSortFilterProxy, self).insertRows(row, count, parent)
+        finally:
+            self._user_edit = False
+
+    def _update_sorted_indexes(self, rows: np.ndarray, columns: Iterable[int]):
+        '''Re-indexes the written `rows` of `columns`, or drops the indexes
+            of the columns, if too many rows were written
+        '''
+        if self._building_indexes:
+            self._index_generation += 1
+        if not self._sorted_indexes:
+            return
+        rows = np.unique(rows)
+        if rows.size > SORTED_INDEX_PATCH_LIMIT:
+            for col_ndx in columns:
+                self._sorted_indexes.pop(col_ndx, None)
+            return
 
-            state = Qt.Checked
+        for col_ndx in columns:
+            index = self._sorted_indexes.get(col_ndx)
+            if index is None:
+                continue
+            column = self._column_values(col_ndx)
+            if column.dtype != index.dtype:
+                self._sorted_indexes.pop(col_ndx)
+            else:
+                index.update(rows[rows < column.size], column)
+
+    def string_filter(self, text: str, mode: str = CONTAINS):
+        '''Filters the filter key column by the display text of its values,
+            see `predicates.text_matcher` for the match modes. Regex and
+            fuzzy filters are evaluated in the background.
+
+            Raises `re.error` for an invalid regular expression.
+        '''
+        self._ensure_loaded_for_filter()
+        predicate = DisplayMatches(text, self._display_function(self._column_index), mode,
+                                   index=self._text_indexes.get(self._column_index))
+        if mode in (REGEX, FUZZY):
+            self.async_predicate_filter(predicate)
         else:
-            mask = self.filter_mask
-            filter_values = self._filter_values
-            self.add_list_items(filter_values, mask)
-            state = Qt.Checked if mask.all() else Qt.Unchecked
+            self.predicate_filter(predicate)
+
+    def async_predicate_filter(self, predicate: Predicate):
+        '''Filters the filter key column with a row-wise `predicate`, evaluated
+            in the background, in chunks. A later text match cancels it.
+        '''
+        self._match_generation += 1
+        generation = self._match_generation
+        col_ndx = self._column_index
+        version = self._model.version
+        # the worker reads a copy, the model may change meanwhile
+        worker = Worker(func=_evaluate_predicate, predicate=predicate,
+                        column=self._column_values(col_ndx).copy(),
+                        is_cancelled=lambda: generation != self._match_generation)
+        worker.signals.result.connect(
+            lambda mask: self._on_predicate_evaluated(col_ndx, generation, version, predicate, mask))
+        worker.signals.error.connect(self.parent().on_error)
+        self._pool.start(worker)
 
-        self._filter_widget.addSelectAllItem(state)
+    def _on_predicate_evaluated(self, col_ndx: int, generation: int, version: int,
+                                predicate: Predicate, mask: Optional[np.ndarray]):
+        if mask is None or generation != self._match_generation:
+            return
+        if version == self._model.version and isinstance(predicate, DisplayMatches) \
+                and predicate.index is not None:
+            self._text_indexes[col_ndx] = predicate.index
+        if version != self._model.version:
+            # changed meanwhile, the index makes it fast for fuzzy filters
+            mask = self._predicate_mask(col_ndx, predicate)
+        else:
+            mask = mask | self._in_progress()
+        self.add_filter_mask(mask, predicate, col_ndx)
+        self.invalidateFilter()
+
+    def filter_list_widget_by_text(self, text: str):
+        """Lists the values matching `text` in the filter widget's match
+            mode. Values are matched in the background, and a later
+            call cancels the running match.
+        """
+        self._match_generation += 1
+        generation = self._match_generation
+        if not text:
+            self._filter_widget.clear()
+            mask = self._list_checked
+            self.add_list_items(self._filter_values, mask)
+            self._filter_widget.addSelectAllItem(Qt.Checked if mask.all() else Qt.Unchecked)
+            self._filter_widget.all_deselected.emit(False)
+            return
+
+        mode = self._filter_widget.match_mode
+        try:
+            matcher = text_matcher(text, mode)
+        except re.error:
+            # incomplete pattern, while typing
+            self._filter_widget.clear()
+            return
+        worker = Worker(func=_match_filter_values, values=self._filter_values, text=text,
+                        matcher=matcher, index=self._list_index if mode == FUZZY else None,
+                        fuzzy=mode == FUZZY,
+                        is_cancelled=lambda: generation != self._match_generation)
+        worker.signals.result.connect(lambda result: self._show_list_matches(generation, result))
+        worker.signals.error.connect(self.parent().on_error)
+        self._pool.start(worker)
+
+    def _show_list_matches(self, generation: int,
+                           result: Optional[Tuple[SER, Optional[TrigramIndex]]]):
+        if result is None or generation != self._match_generation:
+            return
+        filter_values, index = result
+        if index is not None:
+            self._list_index = index
+        self._filter_widget.clear()
+        if filter_values.size == 0:
+            return
+
+        for _, value in filter_values.items():
+            self._filter_widget.addValue(value, Qt.Checked)
+        self._filter_widget.addSelectAllItem(Qt.Checked)
         self._filter_widget.all_deselected.emit(False)
 
     def apply_list_filter(self, menu):
@@ -124,30 +561,22 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
         text = self._filter_widget.str_filter.lineEdit.text()
         checked = self._filter_widget.select_all_item.checkState() == Qt.Checked
         is_filtered = self.is_column_filtered(self._column_index)
-        # START HERE 
         if checked and is_filtered and not text:
             self.remove_filter_mask(self._column_index)
+            self.invalidateFilter()
         elif checked and not is_filtered and not text:
             return
         else:
-            checked_values = [s.lower() for s in self._filter_widget.values()]
-            if not self._showing_all_display_values:
-                display_values = pd.Series({ndx : value for ndx, value in self._display_values_gen})
-                self._display_values = self._display_values.append(display_values)
-                self._showing_all_display_values = True
-
-            mask = self._display_values.str.lower().isin(checked_values)
-            self.add_filter_mask(mask)
-        self.invalidateFilter()
+            # values over the initial filter limit, not listed, are unchecked
+            self.predicate_filter(DisplayIn(self._filter_widget.values(),
+                                            self._display_function(self._column_index)))
 
     def clear_filter_cache(self):
         if not self.is_data_filtered:
             return
-        indices = [index for index in self.filter_cache if index != DEFAULT_FILTER_INDEX]
-        
-        self.filter_cache.clear()
-        self.filter_cache = { DEFAULT_FILTER_INDEX : self.alltrues() }
-        self.accepted = self.filter_cache[DEFAULT_FILTER_INDEX].copy()
+        indices = self._engine.columns
+        self._engine.clear()
+        self.predicates.clear()
         self._column_index = self.last_filter_index
         self.invalidateFilter()
 
@@ -166,24 +595,35 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
 
             NOTE: *args, **kwargs signature is required by Worker
         """
-        display_values = pd.Series({ndx : value for ndx, value in self._display_values_gen})
-        self._display_values = self._display_values.append(display_values)
-        self._showing_all_display_values = True
+        display_values = pd.Series({ndx : value for ndx, value in self._display_values_gen},
+                                   dtype=object)
+        self._display_values = pd.concat([self._display_values, display_values])
         # Updating filter_values
         filter_index = display_values.str.lower().drop_duplicates().index
         filter_values = display_values.loc[filter_index]
-        self._filter_values = self._filter_values.append(filter_values)
-        self.add_list_items(filter_values, self.accepted)
+        self._filter_values = pd.concat([self._filter_values, filter_values])
+        self._list_index = None
+        self.add_list_items(filter_values, self._list_checked)
 
     def async_populate_list(self):
-        worker = Worker(func=self.populate_list)
+        self._ensure_loaded_for_filter()
+        # the worker reads a snapshot, the model may change meanwhile
+        _, data = self._model.snapshot()
+        visible, checked = self._list_masks(data)
+        worker = Worker(func=self.populate_list, data=data, visible=visible, checked=checked)
         worker.signals.error.connect(self.parent().on_error)
         # worker.run()
         self._pool.start(worker)
 
-    def populate_list(self, *args, **kwargs):
+    def populate_list(self, data: Optional[DF] = None, visible: Optional[SER] = None,
+                      checked: Optional[SER] = None, *args, **kwargs):
         self._filter_widget.clear()
-        model_values, mask = self.get_model_values()
+        if data is None:
+            data = self._model.df
+        model_values, mask = self.get_model_values(data, visible, checked)
+        self._list_checked = mask
+        self._list_index = None
+        self._filter_widget.set_counts(self.display_counts(model_values), data.shape[0])
 
         # Generator for display filter values
         self._display_values_gen = (
@@ -191,13 +631,13 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
             for ndx, value in model_values.items())
 
         if model_values.size <= INITIAL_FILTER_LIMIT:
-            self._display_values = pd.Series({ndx : value for ndx, value in self._display_values_gen})
-            self._showing_all_display_values = True
+            self._display_values = pd.Series({ndx : value for ndx, value in self._display_values_gen},
+                                             dtype=object)
             filter_index = self._display_values.str.lower().drop_duplicates().index
             self._filter_values = self._display_values.loc[filter_index]
         else:
-            self._display_values = pd.Series(name=model_values.name)
-            self._filter_values = pd.Series(name=model_values.name)
+            self._display_values = pd.Series(name=model_values.name, dtype=object)
+            self._filter_values = pd.Series(name=model_values.name, dtype=object)
 
             next_step = INITIAL_FILTER_LIMIT
             remaining = model_values.size
@@ -206,18 +646,15 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
                 # print('next_step {}, remaining {}'.format(next_step, remaining))
                 to_display = pd.Series(dict(next(self._display_values_gen)
                                 for _ in range(next_step)))
-                self._display_values = self._display_values.append(to_display)
+                self._display_values = pd.concat([self._display_values, to_display])
                 filter_index = to_display.str.lower().drop_duplicates().index
-                self._filter_values = self._filter_values.append(to_display.loc[filter_index])
+                self._filter_values = pd.concat([self._filter_values, to_display.loc[filter_index]])
                 remaining -= next_step
                 remaining = max(remaining, 0)
                 next_step = min(FILTER_VALUES_STEP, remaining)
 
             if remaining:
                 self._filter_widget.show_all_btn.setVisible(True)
-                self._showing_all_display_values = False
-            else:
-                self._showing_all_display_values = True
 
         # Add a (Select All)
         if mask.all():
@@ -226,7 +663,7 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
             select_all_state = Qt.Unchecked
 
         self._filter_widget.addSelectAllItem(select_all_state)
-        self.add_list_items(self._filter_values, self.accepted)
+        self.add_list_items(self._filter_values, mask)
 
     def add_list_items(self, values: SER, checked_mask: SER):
         """values : {pd.Series}: values to add to the list
@@ -234,10 +671,7 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
 
         for row_ndx, value in values.items():
             state = Qt.Checked if checked_mask.loc[row_ndx] else Qt.Unchecked
-            item = QListWidgetItem(value)
-            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
-            item.setCheckState(state)
-            self._filter_widget.addItem(item)
+            self._filter_widget.addValue(value, state)
         # self._list_widget.list.sortItems()
 
     def async_refill_list(self):
@@ -250,17 +684,59 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
         # worker.run()
         self._pool.start(worker)
 
-    def get_model_values(self) -> Tuple[SER, SER]:
-        # Generates filter items for given column index
-        column: SER = self._model.df.iloc[:, self._column_index]
-        filter_mask = self.filter_mask
-
-        # if the column being filtered is not the last filtered column
-        if self._column_index != self.last_filter_index:
-            filter_mask = filter_mask.loc[filter_mask]
-            column = column.loc[filter_mask.index]
+    def _ensure_loaded_for_filter(self):
+        """When the model is lazy loading, filters apply to all rows, if the
+            model's `full_load_on_filter` is set, otherwise to the loaded rows only.
+            Rows loaded later are evaluated with the filters by `refilter_rows`,
+            when they are inserted, and not by a full re-filter.
+        """
+        if self._model.full_load_on_filter:
+            self._model.fetch_all()
+        elif not self._model.is_fully_loaded:
+            logger.info('Filtering the loaded rows only.')
+
+    def get_model_values(self, data: Optional[DF] = None, visible: Optional[SER] = None,
+                         checked: Optional[SER] = None) -> Tuple[SER, SER]:
+        '''Values of the filter key column in the rows accepted by the other
+            filters, sorted, and whether they are accepted by the column filter.
+        '''
+        if data is None:
+            data = self._model.df
+        if visible is None or checked is None:
+            visible, checked = self._list_masks(data)
+        column: SER = data.iloc[:, self._column_index][visible]
         column = column.sort_values()
-        return column, filter_mask
+        return column, checked[visible]
+
+    def display_counts(self, values: SER) -> Dict[str, int]:
+        '''Number of `values` of each display text, by lower case text.
+            The display text is made once per distinct value, and the rows
+            are counted with `np.bincount` over the text codes.
+        '''
+        display = self._display_function(self._column_index)
+        try:
+            codes, uniques = pd.factorize(values)
+        except TypeError:
+            # unhashable values
+            return values.map(lambda value: display(value).lower()).value_counts().to_dict()
+        texts = [display(value).lower() for value in uniques]
+        nulls = codes == -1
+        if nulls.any():
+            texts.append(display(values.iloc[np.argmax(nulls)]).lower())
+            codes = np.where(nulls, len(uniques), codes)
+        text_codes, unique_texts = pd.factorize(pd.Series(texts, dtype=object))
+        counts = np.bincount(text_codes[codes], minlength=len(unique_texts))
+        return dict(zip(unique_texts, counts.tolist()))
+
+    def _list_masks(self, data: DF) -> Tuple[SER, SER]:
+        '''Masks of `data` rows accepted by the filters of the other columns,
+            and by the filter of the filter key column
+        '''
+        labels = self._model._df.index
+        col_ndx = self._column_index
+        visible = pd.Series(self._engine.accepted_excluding(col_ndx), index=labels)
+        checked = pd.Series(self._engine.column_mask(col_ndx), index=labels)
+        return visible.loc[data.index], checked.loc[data.index]
 
     @property
     def filter_key_column(self) -> int:
@@ -271,35 +747,69 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
 
     @property
     def is_data_filtered(self) -> bool:
-        return len(self.filter_cache) > 1
+        return bool(self._engine.columns)
 
     @property
-    def filter_mask(self) -> SER:
-        return self.filter_cache[self.last_filter_index]
+    def accepted(self) -> SER:
+        '''Mask of the accepted rows, by the model data index'''
+        return pd.Series(self._engine.accepted, index=self._model._df.index)
+
+    def accepted_count(self, excluding: Optional[int] = None) -> int:
+        '''Number of rows accepted by the filters, or by the filters of
+            the columns other than `excluding`
+        '''
+        if excluding is None:
+            return self._engine.count()
+        return self._engine.count_excluding(excluding)
 
     @property
     def last_filter_index(self) -> int:
-        return list(self.filter_cache.keys())[-1]
+        columns = self._engine.columns
+        return columns[-1] if columns else DEFAULT_FILTER_INDEX
 
     def is_column_filtered(self, col_ndx: int) -> bool:
-        return col_ndx in self.filter_cache
-
-    def alltrues(self) -> pd.Series:
-        return pd.Series(data=True, index=self._model.df.index)
+        return self._engine.is_filtered(col_ndx)
 
     def on_rows_inserted(self, parent: QModelIndex, first: int, last: int):
-        new_rows = pd.Series(data=True, index=range(first, last + 1))
-        for index, mask in self.filter_cache.items():
-            mask = pandas_obj_insert_rows(mask, first, new_rows)
-            self.filter_cache[index] = mask
-        self.accepted = pandas_obj_insert_rows(self.accepted, first, new_rows)
+        self._engine.insert_rows(first, last - first + 1)
+        self._patch_sorted_indexes(first, last - first + 1, inserted=True)
+        self._update_sketches(first, last)
+        self.drop_text_indexes()
+        keep_visible = self._user_edit and self.edit_policy == KEEP_VISIBLE
+        self.refilter_rows(np.arange(first, last + 1), keep_visible=keep_visible)
+
+    def _patch_sorted_indexes(self, first: int, count: int, inserted: bool):
+        if self._building_indexes:
+            self._index_generation += 1
+        if not self._sorted_indexes:
+            return
+        if count > SORTED_INDEX_PATCH_LIMIT:
+            self.drop_sorted_indexes()
+            return
+        for col_ndx, index in self._sorted_indexes.items():
+            if inserted:
+                index.insert(first, self._column_values(col_ndx), count)
+            else:
+                index.remove(first, count)
+
+    def on_frame_replaced(self):
+        """Drops all filters, when the model data is replaced"""
+        indices = self._engine.columns
+        self._engine.clear(size=self._model._df.index.size)
+        self.predicates.clear()
+        self.drop_sorted_indexes()
+        self.drop_sketches()
+        self.drop_text_indexes()
+        self._column_index = 0
+        for index in indices:
+            self.column_unfiltered.emit(index)
 
     def on_rows_removed(self, parent: QModelIndex, first: int, last: int):
         count = last - first + 1
-        for index, mask in self.filter_cache.items():
-            mask = pandas_obj_remove_rows(mask, first, count)
-            self.filter_cache[index] = mask
-        self.accepted = pandas_obj_remove_rows(self.accepted, first, count)
+        self._engine.remove_rows(first, count)
+        self._patch_sorted_indexes(first, count, inserted=False)
+        self.drop_sketches()
+        self.drop_text_indexes()
 
 # region Overloads
 
@@ -307,8 +817,64 @@ class DataFrameSortFilterProxy(QSortFilterProxyModel):
         self.sourceModel().sort(column, order)
         
     def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
-        if source_row < self.accepted.size:
-            return self.accepted.iloc[source_row]
+        accepted = self._engine.accepted
+        if source_row < accepted.size:
+            return bool(accepted[source_row])
         return True
 
-# endregion Overloads
\ No newline at end of file
+# endregion Overloads
+
+
+def _build_sorted_index(column: SER, *args, **kwargs) -> SortedColumnIndex:
+    return SortedColumnIndex(column)
+
+
+def _build_date_hierarchy(column: SER, accepted: Optional[np.ndarray],
+                          *args, **kwargs) -> DateHierarchy:
+    return DateHierarchy(column, accepted)
+
+
+def _build_column_sketch(column: SER, *args, **kwargs) -> ColumnSketch:
+    return ColumnSketch(column)
+
+
+def _exact_summary(column: SER, *args, **kwargs) -> ColumnSummary:
+    return exact_summary(column)
+
+
+def _evaluate_predicate(predicate: Predicate, column: SER, is_cancelled: Callable[[], bool],
+                        *args, **kwargs) -> Optional[np.ndarray]:
+    '''Mask of row-wise `predicate` on `column`, evaluated in chunks.
+        'None' if cancelled. Builds the trigram index for fuzzy filters.
+    '''
+    if isinstance(predicate, DisplayMatches) and predicate.mode == FUZZY \
+            and predicate.index is None:
+        predicate.index = TrigramIndex.from_column(column, predicate.display)
+    mask = np.empty(column.size, dtype=bool)
+    for start in range(0, column.size, MATCH_CHUNK_SIZE):
+        if is_cancelled():
+            return None
+        mask[start: start + MATCH_CHUNK_SIZE] = predicate.mask(
+            column.iloc[start: start + MATCH_CHUNK_SIZE])
+    return mask
+
+
+def _match_filter_values(values: SER, text: str, matcher: Callable[[str], bool],
+                         index: Optional[TrigramIndex], fuzzy: bool,
+                         is_cancelled: Callable[[], bool],
+                         *args, **kwargs) -> Optional[Tuple[SER, Optional[TrigramIndex]]]:
+    '''Filter list values matching `text`, and the trigram index of the
+        values, if built for fuzzy matching. 'None' if cancelled.
+    '''
+    if fuzzy:
+        if index is None:
+            index = TrigramIndex(values.str.lower().tolist())
+        return values[index.search(text, fuzzy_distance(text))], index
+    texts = values.to_numpy(dtype=object)
+    matched = np.empty(texts.size, dtype=bool)
+    for start in range(0, texts.size, MATCH_CHUNK_SIZE):
+        if is_cancelled():
+            return None
+        matched[start: start + MATCH_CHUNK_SIZE] = [
+            matcher(value) for value in texts[start: start + MATCH_CHUNK_SIZE]]
+    return values[matched], None
@@ -0,0 +1,218 @@
+import logging
+import sqlite3
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from PySide2.QtCore import *
+
+from qspreadsheet._changes import ChangeSet
+from qspreadsheet.common import DF, changed_mask
+from qspreadsheet.dataframe_model import DataFrameModel
+from qspreadsheet.sqlite_model import quote
+from qspreadsheet.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+class SQLiteWriteback(QObject):
+    '''Writes the user changes of `DataFrameModel` back to a SQLite table.
+
+        The changes are taken from `DataFrameModel.get_changes`, so only
+        changed rows are written:
+
+            deleted rows: `DELETE` by their original key
+
+            edited cells: `UPDATE` of the edited columns only, by the original key
+
+            inserted rows: `INSERT OR REPLACE`, an upsert if the key is
+            the primary key or has a unique index
+
+        All statements run in one transaction, on a worker thread.
+        `DELETE` and `UPDATE` run row by row, to find the rows whose key
+        is not in the table; inserts run with `executemany` in batches.
+        When the transaction commits, the written rows are marked clean
+        in the model, except rows which were edited or removed again while
+        writing. Rows whose key was not found stay dirty, and `error`
+        is emitted with a `LookupError`.
+
+        Datetimes are written as text, as `DataFrame.to_sql` does, e.g.
+        '2020-01-01 00:00:00'.
+
+        Parameters
+        ----------
+
+        model : `DataFrameModel`. The model with the changes
+
+        path : str. Path of the SQLite database file
+
+        table : str. Table name. Model columns are table columns
+
+        key : Union[str, Sequence[str]]. Key column(s), which identify the table rows
+
+        batch_size : int.  Default is 10_000. Rows per `executemany` batch,
+        and rows between progress reports
+    '''
+
+    progress = Signal(int, str)
+    committed = Signal(int)  # number of written rows
+    error = Signal(tuple)
+
+    def __init__(self, model: DataFrameModel, path: str, table: str,
+                 key: Union[str, Sequence[str]], batch_size: int = DEFAULT_BATCH_SIZE,
+                 parent: Optional[QObject] = None) -> None:
+        super(SQLiteWriteback, self).__init__(parent)
+        self._model = model
+        self.path = path
+        self.table = table
+        self.key = [key] if isinstance(key, str) else list(key)
+        self.batch_size = batch_size
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writing = False
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+    @property
+    def is_writing(self) -> bool:
+        return self._writing
+
+    def write(self) -> bool:
+        '''Writes the changes in the background. Returns 'False' if
+            there is nothing to write, or a write is running.
+        '''
+        if self._writing:
+            return False
+        changes = self._model.get_changes()
+        if changes.is_empty:
+            return False
+
+        self._writing = True
+        worker = Worker(self._write_changes, changes)
+        worker.signals.progress.connect(self.progress)
+        worker.signals.result.connect(lambda result: self._on_committed(changes, *result))
+        worker.signals.error.connect(self._on_error)
+        self._pool.start(worker)
+        return True
+
+    def wait(self):
+        '''Waits for the running write to finish'''
+        self._pool.waitForDone()
+
+    def close(self):
+        self.wait()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _write_changes(self, changes: ChangeSet, progress_callback) -> Tuple[int, np.ndarray]:
+        '''Returns the number of written rows, and the row ids of the
+            rows whose key was not found
+        '''
+        statements = list(self._statements(changes))
+        total = sum(len(params) for _, _, params in statements)
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection = self._connection
+
+        done = 0
+        unmatched: List[np.ndarray] = []
+        progress_callback.emit(0, 'Writing {} changes'.format(total))
+        # commits at the end, or rolls back on error
+        with connection:
+            cursor = connection.cursor()
+            for sql, row_ids, params in statements:
+                for start in range(0, len(params), self.batch_size):
+                    batch = params[start: start + self.batch_size]
+                    if sql.startswith('INSERT'):
+                        cursor.executemany(sql, batch)
+                    else:
+                        matched = np.ones(len(batch), dtype=bool)
+                        for i, row in enumerate(batch):
+                            cursor.execute(sql, row)
+                            matched[i] = cursor.rowcount > 0
+                        unmatched.append(row_ids[start: start + len(batch)][~matched])
+                    done += len(batch)
+                    progress_callback.emit(int(done * 100 / total),
+                                           'Written {} of {} changes'.format(done, total))
+        unmatched_ids = np.concatenate(unmatched) if unmatched else np.empty(0, dtype=np.int64)
+        return done - unmatched_ids.size, np.unique(unmatched_ids).astype(np.int64)
+
+    def _statements(self, changes: ChangeSet) -> Iterator[Tuple[str, np.ndarray, List[Tuple]]]:
+        '''SQL statements, with the row ids and the parameters of their rows'''
+        table = quote(self.table)
+        key_condition = ' AND '.join('{} = ?'.format(quote(column)) for column in self.key)
+
+        if not changes.deleted.empty:
+            sql = 'DELETE FROM {} WHERE {}'.format(table, key_condition)
+            yield sql, changes.deleted.index.values, _records(changes.deleted[self.key])
+
+        # rows are found by the original key, so the key columns are updated last
+        cells = sorted(changes.cells.items(), key=lambda item: item[0] in self.key)
+        for column, row_ids in cells:
+            # rows in progress are not in the change set
+            row_ids = row_ids[np.isin(row_ids, changes.updated.index)]
+            if row_ids.size == 0:
+                continue
+            sql = 'UPDATE {} SET {} = ? WHERE {}'.format(table, quote(column), key_condition)
+            values = changes.updated.loc[row_ids, [column]]
+            keys = changes.original.loc[row_ids, self.key]
+            yield sql, row_ids, _records(pd.concat([values, keys], axis=1))
+
+        if not changes.inserted.empty:
+            columns = changes.inserted.columns
+            sql = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+                table, ', '.join(quote(column) for column in columns),
+                ', '.join('?' * columns.size))
+            yield sql, changes.inserted.index.values, _records(changes.inserted)
+
+    def _on_committed(self, changes: ChangeSet, count: int, unmatched: np.ndarray):
+        self._writing = False
+        model = self._model
+        written = pd.concat([changes.inserted, changes.updated])
+        written = written[~np.isin(written.index.values, unmatched)]
+        positions = pd.Index(model.row_ids).get_indexer(written.index)
+
+        # rows removed while writing are deleted rows now, keep them dirty
+        exists = positions >= 0
+        written, positions = written[exists], positions[exists]
+        # rows edited while writing stay dirty
+        current = model._df.iloc[positions]
+        unchanged = np.ones(positions.size, dtype=bool)
+        for column in range(written.columns.size):
+            unchanged &= ~changed_mask(written.iloc[:, column], current.iloc[:, column])
+
+        deleted = changes.deleted.index.values
+        row_ids = np.concatenate([written.index.values[unchanged],
+                                  deleted[~np.isin(deleted, unmatched)]]).astype(np.int64)
+        model.mark_clean(row_ids)
+        logger.debug('Written {} changes to {}.'.format(count, self.table))
+        self.committed.emit(count)
+        if unmatched.size:
+            exc = LookupError('Keys of {} changed rows not found in {}, row ids: {}'.format(
+                unmatched.size, self.table, unmatched.tolist()))
+            self._on_error((LookupError, exc, None))
+
+    def _on_error(self, exc_info: Tuple):
+        self._writing = False
+        logger.error('Writing changes to {} failed.'.format(self.table), exc_info=exc_info)
+        self.error.emit(exc_info)
+
+
+def _records(frame: DF) -> List[Tuple]:
+    '''Rows of `frame` as tuples of SQLite values'''
+    columns = [_sql_values(frame.iloc[:, column]) for column in range(frame.columns.size)]
+    return list(zip(*columns))
+
+
+def _sql_values(values: pd.Series) -> List[Any]:
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return [None if pd.isnull(value) else str(value) for value in values]
+    result = values.astype(object).where(values.notna(), None).tolist()
+    for i, value in enumerate(result):
+        if isinstance(value, pd.Timestamp):
+            result[i] = str(value)
+        elif isinstance(value, np.generic):
+            result[i] = value.item()
+    return result
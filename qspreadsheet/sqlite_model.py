@@ -0,0 +1,355 @@
+import json
+import logging
+import queue
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from PySide2.QtCore import *
+from PySide2.QtGui import *
+from PySide2.QtWidgets import *
+
+from qspreadsheet.common import DF
+from qspreadsheet.delegates import MasterDelegate
+from qspreadsheet.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISTINCT_LIMIT = 5000
+Where = Tuple[str, List[Any]]
+
+
+class SQLiteSource():
+    '''Read access to a SQLite table or query, through a pool of connections.
+
+        Connections are opened read-only and may be used from any thread,
+        but only by one thread at a time, see `connection`.
+
+        Parameters
+        ----------
+
+        path : str. Path of the SQLite database file
+
+        table : [ str ].  Default is 'None'. Table or view name
+
+        query : [ str ].  Default is 'None'. `SELECT` query, used if `table` is 'None'
+
+        pool_size : int.  Default is 2. Number of pooled connections
+    '''
+
+    def __init__(self, path: str, table: Optional[str] = None, query: Optional[str] = None,
+                 pool_size: int = 2) -> None:
+        if (table is None) == (query is None):
+            raise ValueError('Provide either `table` or `query`.')
+        self.path = path
+        self.relation = quote(table) if table is not None else '({}) AS _query'.format(query)
+        self._pool: 'queue.Queue[sqlite3.Connection]' = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+
+        with self.connection() as connection:
+            cursor = connection.execute('SELECT * FROM {} LIMIT 0'.format(self.relation))
+            self.columns = pd.Index([column[0] for column in cursor.description])
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = 'file:{}?mode=ro'.format(self.path)
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        '''Borrows a connection from the pool'''
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().close()
+
+    def empty_frame(self, sample_size: int = 100) -> DF:
+        '''Zero rows `DataFrame`, with dtypes guessed from the first rows.
+
+            Useful to create the column delegates with `automap_delegates`.
+        '''
+        return self.page(where=('', []), order_by='', offset=0, limit=sample_size).iloc[:0]
+
+    def count(self, where: Where, *args, **kwargs) -> int:
+        sql = 'SELECT COUNT(*) FROM {}{}'.format(self.relation, where[0])
+        with self.connection() as connection:
+            return connection.execute(sql, where[1]).fetchone()[0]
+
+    def page(self, where: Where, order_by: str, offset: int, limit: int, *args, **kwargs) -> DF:
+        '''Rows [`offset`, `offset` + `limit`) of the filtered and sorted relation'''
+        sql = 'SELECT * FROM {}{}{} LIMIT ? OFFSET ?'.format(self.relation, where[0], order_by)
+        with self.connection() as connection:
+            cursor = connection.execute(sql, where[1] + [limit, offset])
+            rows = cursor.fetchall()
+        return pd.DataFrame.from_records(rows, columns=self.columns, coerce_float=True)
+
+    def distinct(self, column: int, where: Where, limit: int = DEFAULT_DISTINCT_LIMIT,
+                 *args, **kwargs) -> List[Any]:
+        '''Up to `limit` distinct values of `column`, sorted'''
+        name = quote(self.columns[column])
+        sql = 'SELECT DISTINCT {name} FROM {relation}{where} ORDER BY {name} LIMIT ?'.format(
+            name=name, relation=self.relation, where=where[0])
+        with self.connection() as connection:
+            return [row[0] for row in connection.execute(sql, where[1] + [limit])]
+
+
+class SQLiteTableModel(QAbstractTableModel):
+    '''Read-only table model over a SQLite table or query.
+
+        Only pages of rows around the viewport are read, on a worker
+        thread, and a limited number of pages is cached. Filters and
+        sorting are pushed down to SQLite, as `WHERE` and `ORDER BY`.
+        Rows of pages which are not read yet are shown empty, until
+        the page arrives.
+
+        It's a model for a bare `QTableView`: it has its own filter
+        methods (`set_value_filter`, `set_text_filter`), but not the
+        interface of `DataFrameModel`, so `DataFrameView` and its header
+        filter menus can't use it.
+
+        Parameters
+        ----------
+
+        source : `SQLiteSource`. The table or query
+
+        delegate : [ MasterDelegate ].  Default is 'None'. Delegate used to
+        format the display values. Create it with `automap_delegates`
+        over `source.empty_frame()`.
+
+        parent : [ QWidget ].  Default is 'None'. Parent for this model.
+    '''
+
+    PAGE_SIZE = 512
+    MAX_CACHED_PAGES = 64
+    # pages read ahead, above and below the viewport
+    PREFETCH_PAGES = 1
+
+    row_count_changed = Signal(int)
+    distinct_values_ready = Signal(int, list)
+    error = Signal(tuple)
+
+    def __init__(self, source: SQLiteSource, delegate: Optional[MasterDelegate] = None,
+                 parent: Optional[QWidget] = None) -> None:
+        QAbstractTableModel.__init__(self, parent=parent)
+        self.source = source
+        self.delegate = delegate
+        self._row_count = 0
+        self._filters: Dict[int, Where] = {}
+        self._sort_key: Optional[Tuple[int, Qt.SortOrder]] = None
+        # page number -> (values, display strings per column)
+        self._pages: 'OrderedDict[int, Tuple[DF, List[List[str]]]]' = OrderedDict()
+        self._requested: set = set()
+        # incremented when filters or sorting change, to drop stale pages
+        self._generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._update_row_count()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return self._row_count
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return self.source.columns.size
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            page = self._page_for(index.row())
+            if page is None:
+                return None
+            values, display = page
+            offset = index.row() % self.PAGE_SIZE
+            if role == Qt.DisplayRole:
+                return display[index.column()][offset]
+            return values.iat[offset, index.column()]
+
+        if self.delegate is None:
+            return None
+
+        if role == Qt.TextAlignmentRole:
+            return int(self.delegate.alignment(index))
+        if role == Qt.BackgroundRole:
+            return self.delegate.background_brush(index)
+        if role == Qt.ForegroundRole:
+            return self.delegate.foreground_brush(index)
+        if role == Qt.FontRole:
+            return self.delegate.font(index)
+        return None
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int) -> Any:
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self.source.columns[section])
+        return str(section + 1)
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
+        self.layoutAboutToBeChanged.emit()
+        self._sort_key = (column, order)
+        self._invalidate_pages()
+        self.layoutChanged.emit()
+
+    def set_viewport(self, first_row: int, last_row: int):
+        '''Reads the pages of the visible rows, and the pages around them'''
+        first_page = max(first_row // self.PAGE_SIZE - self.PREFETCH_PAGES, 0)
+        last_page = min(last_row // self.PAGE_SIZE + self.PREFETCH_PAGES,
+                        max(self._row_count - 1, 0) // self.PAGE_SIZE)
+        for page_no in range(first_page, last_page + 1):
+            if page_no not in self._pages:
+                self._request_page(page_no)
+
+    def set_value_filter(self, column: int, values: Sequence[Any]):
+        '''Shows only rows with `column` value in `values`.
+            Null values in `values` match nulls.
+        '''
+        values = list(values)
+        name = quote(self.source.columns[column])
+        non_nulls = [_json_value(value) for value in values if not pd.isnull(value)]
+        sql = '{} IN (SELECT value FROM json_each(?))'.format(name)
+        if len(non_nulls) < len(values):
+            sql = '({} OR {} IS NULL)'.format(sql, name)
+        self._set_filter(column, (sql, [json.dumps(non_nulls)]))
+
+    def set_text_filter(self, column: int, text: str):
+        '''Shows only rows with `column` value containing `text`, ignoring case'''
+        name = quote(self.source.columns[column])
+        sql = 'instr(lower(CAST({} AS TEXT)), lower(?)) > 0'.format(name)
+        self._set_filter(column, (sql, [text]))
+
+    def remove_filter(self, column: int):
+        if column not in self._filters:
+            return
+        self._filters.pop(column)
+        self._update_row_count()
+
+    def clear_filters(self):
+        self._filters.clear()
+        self._update_row_count()
+
+    def is_column_filtered(self, column: int) -> bool:
+        return column in self._filters
+
+    def fetch_distinct_values(self, column: int, limit: int = DEFAULT_DISTINCT_LIMIT):
+        '''Reads the distinct values of `column` for the filter list, in the
+            background, filtered by the other columns' filters. Emits
+            `distinct_values_ready`.
+        '''
+        where = self._where(exclude=column)
+        worker = Worker(self.source.distinct, column, where, limit)
+        worker.signals.result.connect(
+            lambda values: self.distinct_values_ready.emit(column, values))
+        worker.signals.error.connect(self.error)
+        self._pool.start(worker)
+
+    def _set_filter(self, column: int, where: Where):
+        self._filters[column] = where
+        self._update_row_count()
+
+    def _where(self, exclude: Optional[int] = None) -> Where:
+        conditions = [where for column, where in self._filters.items() if column != exclude]
+        if not conditions:
+            return ('', [])
+        sql = ' WHERE ' + ' AND '.join(condition for condition, _ in conditions)
+        return (sql, [param for _, params in conditions for param in params])
+
+    def _order_by(self) -> str:
+        if self._sort_key is None:
+            return ''
+        column, order = self._sort_key
+        name = quote(self.source.columns[column])
+        direction = 'ASC' if order == Qt.AscendingOrder else 'DESC'
+        # nulls last, in both directions
+        return ' ORDER BY ({name} IS NULL), {name} {direction}'.format(name=name, direction=direction)
+
+    def _update_row_count(self):
+        '''Counts the filtered rows in the background, then resets the model'''
+        self._generation += 1
+        generation = self._generation
+        worker = Worker(self.source.count, self._where())
+        worker.signals.result.connect(
+            lambda count: self._on_row_count(generation, count))
+        worker.signals.error.connect(self.error)
+        self._pool.start(worker)
+
+    def _on_row_count(self, generation: int, count: int):
+        if generation != self._generation:
+            return
+        self.beginResetModel()
+        self._row_count = count
+        self._invalidate_pages(new_generation=False)
+        self.endResetModel()
+        self.row_count_changed.emit(count)
+
+    def _invalidate_pages(self, new_generation: bool = True):
+        if new_generation:
+            self._generation += 1
+        self._pages.clear()
+        self._requested.clear()
+
+    def _page_for(self, row: int) -> Optional[Tuple[DF, List[List[str]]]]:
+        page_no = row // self.PAGE_SIZE
+        page = self._pages.get(page_no)
+        if page is None:
+            self._request_page(page_no)
+            return None
+        self._pages.move_to_end(page_no)
+        return page
+
+    def _request_page(self, page_no: int):
+        if page_no in self._requested:
+            return
+        self._requested.add(page_no)
+        generation = self._generation
+        worker = Worker(self.source.page, self._where(), self._order_by(),
+                        page_no * self.PAGE_SIZE, self.PAGE_SIZE)
+        worker.signals.result.connect(
+            lambda values: self._on_page_fetched(generation, page_no, values))
+        worker.signals.error.connect(self.error)
+        self._pool.start(worker)
+
+    def _on_page_fetched(self, generation: int, page_no: int, values: DF):
+        if generation != self._generation:
+            return
+        self._requested.discard(page_no)
+        start = page_no * self.PAGE_SIZE
+        display = [[self._display(self.index(start + i, column), value)
+                    for i, value in enumerate(values.iloc[:, column])]
+                   for column in range(values.columns.size)]
+        self._pages[page_no] = (values, display)
+        if len(self._pages) > self.MAX_CACHED_PAGES:
+            self._pages.popitem(last=False)
+
+        last = min(start + values.index.size, self._row_count) - 1
+        if last >= start:
+            self.dataChanged.emit(self.index(start, 0),
+                                  self.index(last, self.columnCount() - 1))
+
+    def _display(self, index: QModelIndex, value: Any) -> str:
+        if self.delegate is not None:
+            return self.delegate.display_data(index, value)
+        if pd.isnull(value):
+            return '.NA'
+        return str(value)
+
+
+def quote(name: Any) -> str:
+    '''Quotes SQL identifier'''
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value))
+    return value
@@ -0,0 +1,301 @@
+import logging
+import pickle
+import tempfile
+from collections import deque
+from typing import Any, Deque, List, Optional, Union
+
+import numpy as np
+from PySide2.QtCore import *
+
+from qspreadsheet.common import DF
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class EditEntry():
+    '''Compact delta of one user edit of `DataFrameModel`.
+
+        Entries are applied with `apply`, and `inverse` returns the
+        entry which reverts them. Rows are identified by row id, and
+        their row positions at the time of the edit are kept, so applying
+        an entry only touches the edited cells, unless rows were moved.
+    '''
+
+    def apply(self, model):
+        raise NotImplementedError()
+
+    def inverse(self) -> 'EditEntry':
+        raise NotImplementedError()
+
+    @property
+    def nbytes(self) -> int:
+        raise NotImplementedError()
+
+
+class CellsEdit(EditEntry):
+    '''Cell values changed, `(row id, column, old, new)` per cell, as arrays'''
+
+    def __init__(self, positions: np.ndarray, row_ids: np.ndarray, columns: np.ndarray,
+                 old_values: np.ndarray, new_values: np.ndarray) -> None:
+        self.positions = positions
+        self.row_ids = row_ids
+        self.columns = columns
+        self.old_values = old_values
+        self.new_values = new_values
+
+    def apply(self, model):
+        model._edit_cells_by_id(self.positions, self.row_ids, self.columns, self.new_values)
+
+    def inverse(self) -> 'CellsEdit':
+        return CellsEdit(self.positions, self.row_ids, self.columns,
+                         old_values=self.new_values, new_values=self.old_values)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(_nbytes(array) for array in (self.positions, self.row_ids, self.columns,
+                                                  self.old_values, self.new_values))
+
+
+class RowsInsert(EditEntry):
+    '''Rows inserted at `at_index`, with their column values'''
+
+    def __init__(self, at_index: int, row_ids: np.ndarray, rows: DF, inserted: np.ndarray) -> None:
+        self.at_index = at_index
+        self.row_ids = row_ids
+        self.rows = rows
+        # rows inserted by the user, as opposed to rows of the data source
+        self.inserted = inserted
+
+    def apply(self, model):
+        model._insert_rows_by_id(self.at_index, self.row_ids, self.rows, self.inserted)
+
+    def inverse(self) -> 'RowsRemove':
+        return RowsRemove(self.at_index, self.row_ids, self.rows, self.inserted)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.rows.memory_usage(index=False).sum()) \
+            + self.row_ids.nbytes + self.inserted.nbytes
+
+
+class RowsRemove(RowsInsert):
+    '''Rows removed at `at_index`, with their column values'''
+
+    def apply(self, model):
+        model._remove_rows_by_id(self.at_index, self.row_ids)
+
+    def inverse(self) -> RowsInsert:
+        return RowsInsert(self.at_index, self.row_ids, self.rows, self.inserted)
+
+
+class EditGroup(EditEntry):
+    '''Entries undone and redone together, e.g. removing non-consecutive rows'''
+
+    def __init__(self, entries: List[EditEntry]) -> None:
+        self.entries = entries
+
+    def apply(self, model):
+        for entry in self.entries:
+            entry.apply(model)
+
+    def inverse(self) -> 'EditGroup':
+        return EditGroup([entry.inverse() for entry in reversed(self.entries)])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.nbytes for entry in self.entries)
+
+
+class _Spilled():
+    '''Entry written to a `_SpillFile`'''
+
+    def __init__(self, offset: int, size: int, nbytes: int) -> None:
+        self.offset = offset
+        self.size = size
+        self.nbytes = nbytes
+
+
+class _SpillFile():
+    '''Temporary file of the oldest entries of a stack. Entries are read
+        back newest first, so the file is truncated on each read.
+    '''
+
+    def __init__(self) -> None:
+        self._file = None
+        self._size = 0
+        # number of entries in the file, which are the bottom of the stack
+        self.count = 0
+
+    def write(self, entry: EditEntry) -> _Spilled:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='qspreadsheet-undo-')
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.seek(self._size)
+        self._file.write(data)
+        spilled = _Spilled(self._size, len(data), entry.nbytes)
+        self._size += len(data)
+        self.count += 1
+        return spilled
+
+    def read(self, spilled: _Spilled) -> EditEntry:
+        self._file.seek(spilled.offset)
+        entry = pickle.loads(self._file.read(spilled.size))
+        self.count -= 1
+        if self.count == 0:
+            # nothing left in the file
+            self.close()
+        else:
+            self._size = spilled.offset
+            self._file.truncate(self._size)
+        return entry
+
+    def drop_oldest(self):
+        '''Forgets the oldest entry, which stays in the file until it's closed'''
+        self.count -= 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._size = 0
+        self.count = 0
+
+
+class UndoJournal(QObject):
+    '''Undo and redo stacks of `EditEntry`s.
+
+        When the undo and redo entries in memory take more than `max_bytes`,
+        the oldest ones of each stack are written to a temporary file, and
+        read back when undone or redone.
+
+        Parameters
+        ----------
+
+        max_bytes : int.  Default is 64 MB. Memory budget of the entries
+
+        limit : [ int ].  Default is 'None'. Maximum number of undo steps, unlimited if 'None'
+    '''
+
+    changed = Signal()
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, limit: Optional[int] = None,
+                 parent: Optional[QObject] = None) -> None:
+        super(UndoJournal, self).__init__(parent)
+        self.max_bytes = max_bytes
+        self.limit = limit
+        self._undo: Deque[Union[EditEntry, _Spilled]] = deque()
+        self._redo: List[Union[EditEntry, _Spilled]] = []
+        self._memory_bytes = 0
+        # the oldest entries of each stack, which are not in memory
+        self._undo_spill = _SpillFile()
+        self._redo_spill = _SpillFile()
+        self._groups: List[List[EditEntry]] = []
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    @property
+    def memory_bytes(self) -> int:
+        '''Size of the undo and redo entries in memory'''
+        return self._memory_bytes
+
+    @property
+    def spilled_count(self) -> int:
+        '''Number of undo and redo entries in the spill files'''
+        return self._undo_spill.count + self._redo_spill.count
+
+    def record(self, entry: EditEntry):
+        '''Adds new entry to the undo stack, and clears the redo stack'''
+        if self._groups:
+            self._groups[-1].append(entry)
+            return
+        self._clear_redo()
+        self._push_undo(entry)
+        self.changed.emit()
+
+    def begin_group(self):
+        '''Records the following entries as one, until `end_group`'''
+        self._groups.append([])
+
+    def end_group(self):
+        entries = self._groups.pop()
+        if not entries:
+            return
+        self.record(entries[0] if len(entries) == 1 else EditGroup(entries))
+
+    def take_undo(self) -> Optional[EditEntry]:
+        '''Pops the entry to undo, and moves it to the redo stack'''
+        if not self._undo:
+            return None
+        entry = self._pop(self._undo, self._undo_spill)
+        self._redo.append(entry)
+        self._memory_bytes += entry.nbytes
+        self._spill()
+        self.changed.emit()
+        return entry
+
+    def take_redo(self) -> Optional[EditEntry]:
+        '''Pops the entry to redo, and moves it to the undo stack'''
+        if not self._redo:
+            return None
+        entry = self._pop(self._redo, self._redo_spill)
+        self._push_undo(entry)
+        self.changed.emit()
+        return entry
+
+    def clear(self):
+        self._undo.clear()
+        self._undo_spill.close()
+        self._clear_redo()
+        self._memory_bytes = 0
+        self.changed.emit()
+
+    def _clear_redo(self):
+        self._memory_bytes -= sum(entry.nbytes for entry in self._redo[self._redo_spill.count:])
+        self._redo.clear()
+        self._redo_spill.close()
+
+    def _push_undo(self, entry: EditEntry):
+        self._undo.append(entry)
+        self._memory_bytes += entry.nbytes
+        if self.limit is not None and len(self._undo) > self.limit:
+            dropped = self._undo.popleft()
+            if isinstance(dropped, _Spilled):
+                self._undo_spill.drop_oldest()
+            else:
+                self._memory_bytes -= dropped.nbytes
+        self._spill()
+
+    def _pop(self, stack: Union[Deque, List], spill_file: _SpillFile) -> EditEntry:
+        entry = stack.pop()
+        if isinstance(entry, _Spilled):
+            return spill_file.read(entry)
+        self._memory_bytes -= entry.nbytes
+        return entry
+
+    def _spill(self):
+        '''Writes the oldest entries to the spill files, while over budget.
+            The top entry of each stack is kept in memory.
+        '''
+        for stack, spill_file in ((self._undo, self._undo_spill),
+                                  (self._redo, self._redo_spill)):
+            while self._memory_bytes > self.max_bytes and spill_file.count < len(stack) - 1:
+                ndx = spill_file.count
+                entry = stack[ndx]
+                stack[ndx] = spill_file.write(entry)
+                self._memory_bytes -= entry.nbytes
+
+
+def _nbytes(array: Any) -> int:
+    array = np.asarray(array)
+    if array.dtype.hasobject:
+        # rough size of the referenced python objects
+        return array.nbytes * 4
+    return array.nbytes
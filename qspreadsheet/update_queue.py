@@ -0,0 +1,132 @@
+import logging
+from collections import deque
+from typing import Any, Deque, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from PySide2.QtCore import *
+
+from qspreadsheet.common import DF, object_array
+
+logger = logging.getLogger(__name__)
+
+CELLS, FRAME, ROWS, UPSERT = range(4)
+
+
+class UpdateQueue(QObject):
+    '''Bounded queue of model updates, which any thread can push to.
+
+        Pushing only appends to a `collections.deque`, which is thread-safe
+        without locking, so producers never block. When the queue holds
+        `maxsize` pending pushes, new pushes are rejected and counted in
+        `rejected`. A timer on the GUI thread drains the queue and applies
+        the updates in vectorized batches, through the model's
+        `update_cells`, `update_frame`, `append_rows` and `upsert_rows`.
+
+        NOTE: Create the queue on the GUI thread, with
+        `DataFrameModel.enable_update_queue`.
+    '''
+
+    def __init__(self, model, maxsize: int = 100_000, interval: int = 16) -> None:
+        super(UpdateQueue, self).__init__(model)
+        self._model = model
+        self.maxsize = maxsize
+        self.rejected = 0
+        self._queue: Deque[Tuple[int, Any]] = deque()
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.drain)
+        self._timer.start()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def push_cells(self, rows: Iterable[int], columns: Iterable[int], values: Iterable[Any]) -> bool:
+        '''Queues cell updates, see `DataFrameModel.update_cells`'''
+        if not isinstance(values, np.ndarray):
+            # values of mixed types are not coerced to a common type
+            values = object_array(values)
+        return self._push(CELLS, (np.asarray(rows, dtype=np.int64),
+                                  np.asarray(columns, dtype=np.int64), values))
+
+    def push_frame(self, frame: DF) -> bool:
+        '''Queues frame update, see `DataFrameModel.update_frame`'''
+        return self._push(FRAME, frame)
+
+    def push_rows(self, rows: Any) -> bool:
+        '''Queues rows to append, see `DataFrameModel.append_rows`'''
+        return self._push(ROWS, rows)
+
+    def push_upsert(self, rows: DF, key: Any) -> bool:
+        '''Queues rows to upsert, see `DataFrameModel.upsert_rows`'''
+        return self._push(UPSERT, (rows, key))
+
+    def stop(self):
+        self._timer.stop()
+
+    def _push(self, kind: int, update: Any) -> bool:
+        if len(self._queue) >= self.maxsize:
+            self.rejected += 1
+            return False
+        self._queue.append((kind, update))
+        return True
+
+    def drain(self):
+        '''Applies all pending updates. Called by the timer on the GUI thread.'''
+        count = len(self._queue)
+        if not count:
+            return
+        cells: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        upserts: List[DF] = []
+        upsert_key = None
+        for _ in range(count):
+            kind, update = self._queue.popleft()
+            if kind == CELLS:
+                self._apply_upserts(upserts, upsert_key)
+                upserts = []
+                cells.append(update)
+                continue
+            if kind == UPSERT:
+                rows, key = update
+                if upserts and key != upsert_key:
+                    self._apply_upserts(upserts, upsert_key)
+                    upserts = []
+                self._apply_cells(cells)
+                cells = []
+                upserts.append(rows)
+                upsert_key = key
+                continue
+            # keep the order of the updates
+            self._apply_cells(cells)
+            cells = []
+            self._apply_upserts(upserts, upsert_key)
+            upserts = []
+            if kind == FRAME:
+                self._model.update_frame(update)
+            else:
+                self._model.append_rows(update)
+        self._apply_cells(cells)
+        self._apply_upserts(upserts, upsert_key)
+
+    def _apply_upserts(self, upserts: List[DF], key: Any):
+        if not upserts:
+            return
+        rows = upserts[0] if len(upserts) == 1 else pd.concat(upserts, ignore_index=True)
+        self._model.upsert_rows(rows, key)
+
+    def _apply_cells(self, cells: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        if not cells:
+            return
+        rows = np.concatenate([np.broadcast_to(r, r.shape) for r, _, _ in cells])
+        columns = np.concatenate([np.broadcast_to(c, r.shape) for r, c, _ in cells])
+        values = [np.broadcast_to(v, r.shape) for r, _, v in cells]
+        if len({value.dtype for value in values}) > 1:
+            # pushes of different dtypes are not coerced to a common
+            # dtype, the model casts each column's values to its dtype
+            values = [value.astype(object) for value in values]
+        values = np.concatenate(values)
+
+        # the latest update of a cell wins
+        keys = pd.Series(rows * self._model.col_ndx.count + columns)
+        latest = ~keys.duplicated(keep='last').values
+        self._model.update_cells(rows[latest], columns[latest], values[latest])
@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    from PySide2.QtWidgets import QApplication
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([])
+    return app
+
+
+@pytest.fixture
+def make_view(qapp):
+    '''Creates `DataFrameView`s of frames, closed after the test'''
+    from qspreadsheet.dataframe_view import DataFrameView
+    views = []
+
+    def make(df, **kwargs):
+        view = DataFrameView(df, **kwargs)
+        views.append(view)
+        return view
+
+    yield make
+    for view in views:
+        view.close()
+        view.deleteLater()
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+
+def test_appends_are_coalesced_in_one_insert(make_view):
+    model = make_view(pd.DataFrame({'x': [0], 'name': ['a']})).dataframe_model
+    inserted = []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+    model.append_rows(pd.DataFrame({'x': [1, 2], 'name': ['b', 'c']}))
+    model.append_rows([{'x': 3, 'name': 'd'}])
+    model.append_rows({'x': [4]})
+    assert model.pending_append_count == 4
+    assert inserted == []
+
+    model.flush_appends()
+    assert inserted == [(1, 4)]
+    assert model.pending_append_count == 0
+    assert model._df['x'].tolist() == [0, 1, 2, 3, 4]
+    assert model._df['name'].tolist()[:4] == ['a', 'b', 'c', 'd']
+    assert pd.isna(model._df['name'].iloc[4])
+
+
+def test_ring_cap_drops_the_oldest_rows(make_view):
+    model = make_view(pd.DataFrame({'x': np.arange(3, dtype=float)})).dataframe_model
+    model.max_rows = 5
+    removed = []
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+    for start in range(3, 2003, 4):
+        model.append_rows(pd.DataFrame({'x': np.arange(start, start + 4, dtype=float)}))
+        model.flush_appends()
+        assert model.rowCount(None) == 5 + model.row_ndx.count_virtual
+    assert model._df['x'].tolist() == [1998.0, 1999.0, 2000.0, 2001.0, 2002.0]
+    assert removed[0] == (0, 1)
+    assert all(first == 0 for first, _ in removed)
@@ -0,0 +1,70 @@
+import socket
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+pa = pytest.importorskip('pyarrow')
+
+from qspreadsheet.arrow_stream import UPSERT, ArrowStreamReader
+
+
+class _Queue():
+    '''Collects the pushed frames, like the model's update queue'''
+
+    def __init__(self):
+        self.pushed = []
+
+    def push_rows(self, rows):
+        self.pushed.append(('rows', rows))
+        return True
+
+    def push_upsert(self, rows, key):
+        self.pushed.append(('upsert', rows))
+        return True
+
+
+def _serve(path, frames):
+    '''Local stand-in producer: writes `frames` as an Arrow IPC stream'''
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def produce():
+        conn, _ = server.accept()
+        batches = [pa.RecordBatch.from_pandas(frame, preserve_index=False) for frame in frames]
+        with conn.makefile('wb') as sink:
+            with pa.ipc.new_stream(sink, batches[0].schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        conn.close()
+        server.close()
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    return thread
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Unix sockets only')
+def test_ingest_from_local_producer(qapp, tmp_path):
+    frames = [pd.DataFrame({'id': np.arange(start, start + 3), 'value': np.arange(3) * 1.5})
+              for start in (0, 3)]
+    path = str(tmp_path / 'feed.sock')
+    producer = _serve(path, frames)
+
+    reader = ArrowStreamReader(path, mode=UPSERT, key='id')
+    schema = reader.open()
+    assert schema.names == ['id', 'value']
+    assert reader.empty_frame().dtypes.to_dict() == frames[0].dtypes.to_dict()
+
+    queue = _Queue()
+    reader._ingest(queue)
+    producer.join()
+    reader.stop()
+
+    assert [kind for kind, _ in queue.pushed] == ['upsert', 'upsert']
+    for (_, pushed), frame in zip(queue.pushed, frames):
+        pd.testing.assert_frame_equal(pushed, frame)
@@ -0,0 +1,63 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet.async_source import AsyncFrameSource, QtAsyncioBridge
+
+
+class _Batches():
+    '''Endless async generator of one-row batches, recording its closing'''
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.closed = False
+
+    async def generate(self):
+        try:
+            while True:
+                self.count += 1
+                yield pd.DataFrame({'x': [float(self.count)]})
+                await asyncio.sleep(0)
+        finally:
+            self.closed = True
+
+
+@pytest.fixture
+def bridge(qapp):
+    bridge = QtAsyncioBridge(loop=asyncio.new_event_loop())
+    # stepped by the tests
+    bridge.stop()
+    yield bridge
+    bridge.loop.close()
+
+
+def _step(bridge, times=5):
+    for _ in range(times):
+        bridge._step()
+
+
+@pytest.mark.parametrize('stop', ['cancel', 'close'])
+def test_stopping_closes_the_generator(make_view, bridge, stop):
+    view = make_view(pd.DataFrame({'x': [0.0]}))
+    batches = _Batches()
+    source = AsyncFrameSource(view.dataframe_model, batches.generate(), bridge=bridge)
+    finished = []
+    source.finished.connect(lambda: finished.append(True))
+    source.start()
+    _step(bridge)
+    assert source.is_running and batches.count > 0
+
+    if stop == 'cancel':
+        source.cancel()
+    else:
+        view.close()
+    _step(bridge)
+    assert not source.is_running
+    assert batches.closed and finished
+    count = batches.count
+    _step(bridge)
+    assert batches.count == count
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+pytest.importorskip('pyarrow')
+
+from qspreadsheet.autosave import COLUMN_FILE, AutoSaver, _write_save
+
+
+def _save(directory, df, version, token='ab12'):
+    snapshot, columns = {}, []
+    for ndx, name in enumerate(df.columns):
+        file_name = COLUMN_FILE.format(ndx, version, token)
+        snapshot[file_name] = df[name]
+        columns.append({'name': name, 'version': version, 'file': file_name})
+    _write_save(str(directory), snapshot,
+                {'version': version, 'num_rows': len(df), 'columns': columns})
+
+
+def test_save_deletes_only_its_old_column_files(tmp_path):
+    foreign = ['data.parquet', 'c1_v2.parquet.bak', 'notes.txt']
+    for file_name in foreign:
+        (tmp_path / file_name).write_bytes(b'x')
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    _save(tmp_path, df, version=1)
+    _save(tmp_path, df, version=2)
+
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        foreign + ['c0_v2_ab12.parquet', 'c1_v2_ab12.parquet', 'manifest.json'])
+    pd.testing.assert_frame_equal(AutoSaver.load(str(tmp_path)), df)
+
+
+def test_new_session_keeps_files_of_previous_manifest(tmp_path, qapp, make_view):
+    def save(df):
+        saver = AutoSaver(make_view(df).dataframe_model, str(tmp_path))
+        saver.save()
+        saver.wait()
+        qapp.processEvents()
+        saver.stop()
+        return saver
+
+    old = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    save(old)
+    old_files = set(os.listdir(tmp_path))
+    # versions restart at 0 in the new session
+    new = pd.DataFrame({'a': [3, 4], 'b': ['z', 'w']})
+    saver = save(new)
+
+    assert all(file_name not in old_files for file_name, _ in saver._saved_columns.values())
+    pd.testing.assert_frame_equal(AutoSaver.load(str(tmp_path)), new)
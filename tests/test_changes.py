@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+
+@pytest.fixture
+def model(make_view):
+    view = make_view(pd.DataFrame({'x': [1.0, 2.0, 3.0, 4.0], 's': ['a', 'b', 'c', 'd']}))
+    view.enable_mutable_rows(True)
+    return view.dataframe_model
+
+
+def test_edit_back_to_original_is_not_a_change(model):
+    assert model.setData(model.index(1, 0), 20.0, Qt.EditRole)
+    assert model.setData(model.index(2, 1), 'z', Qt.EditRole)
+    assert model.setData(model.index(1, 0), 2.0, Qt.EditRole)
+
+    changes = model.get_changes()
+    row_id = model.row_ids[2]
+    assert changes.updated.index.tolist() == [row_id]
+    assert changes.updated.loc[row_id, 's'] == 'z'
+    assert changes.original.loc[row_id, 's'] == 'c'
+    assert {name: ids.tolist() for name, ids in changes.cells.items()} == {'s': [row_id]}
+    assert not model.is_cell_dirty(1, 0) and model.is_cell_dirty(2, 1)
+
+
+def test_inserted_deleted_rows_and_mark_clean(model):
+    deleted_id = model.row_ids[0]
+    assert model.removeRows(0, 1, None)
+    assert model.insertRows(3, 1, None)
+    assert model.setData(model.index(3, 0), 5.0, Qt.EditRole)
+
+    changes = model.get_changes()
+    assert changes.deleted.index.tolist() == [deleted_id]
+    assert changes.deleted.loc[deleted_id, 'x'] == 1.0
+    assert changes.inserted.index.tolist() == [model.row_ids[3]]
+    assert changes.inserted['x'].tolist() == [5.0]
+    assert changes.updated.empty
+
+    model.mark_clean(changes.inserted.index)
+    changes = model.get_changes()
+    assert changes.inserted.empty and changes.deleted.index.tolist() == [deleted_id]
+    model.mark_clean()
+    assert model.get_changes().is_empty and not model.is_dirty
@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+
+@pytest.mark.parametrize('columns', [['a', 'b', 'c', 'd'], ['b']])
+def test_set_dataframe_headers_match_new_columns(make_view, columns):
+    view = make_view(pd.DataFrame({'a': [1, 2], 'b': [3.0, 4.0]}))
+    model = view.dataframe_model
+    headers = []
+
+    def on_reset():
+        headers.extend(model.headerData(section, Qt.Horizontal, Qt.DisplayRole).text()
+                       for section in range(model.columnCount(None)))
+
+    model.modelReset.connect(on_reset)
+    view.set_dataframe(pd.DataFrame({name: [1, 2, 3] for name in columns}))
+    assert headers == columns
+
+
+def test_cell_value_reads_rows_in_progress(make_view):
+    view = make_view(pd.DataFrame({'a': [1, 2, 3], 'b': [1.5, 2.5, 3.5]}))
+    model = view.dataframe_model
+    model.col_ndx.set_non_nullable(1, True)
+    # editing the virtual row adds a row in progress, until `b` is set
+    assert model.setData(model.index(3, 0), 4, Qt.EditRole)
+    assert model.row_ndx.in_progress_mask.iloc[3]
+    assert [view._cell_value(row, 0) for row in range(4)] == [1, 2, 3, 4]
+    assert pd.isnull(view._cell_value(3, 1))
+    assert view._cell_value(10, 0) is None
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+pytest.importorskip('pyarrow')
+
+from PySide2.QtCore import Qt
+
+from qspreadsheet.common import nullable_dtype
+
+NUM_ROWS = 1000
+# value written to each column by the edits
+EDITS = {'n': 7, 'b': False, 's': 'z', 'f': 2, 'i': 9}
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'n': pd.array(rng.integers(0, 100, NUM_ROWS), dtype='Int64'),
+        'b': pd.array(rng.random(NUM_ROWS) < 0.5, dtype='boolean'),
+        's': pd.array(rng.choice(['ab', 'cd', 'ef'], NUM_ROWS), dtype='string[pyarrow]'),
+        'f': rng.random(NUM_ROWS),
+        'i': rng.integers(0, 100, NUM_ROWS),
+    })
+
+
+def _nullable(df: pd.DataFrame) -> pd.DataFrame:
+    '''`df`, with the dtypes the model uses after inserting rows'''
+    return df.astype({name: nullable_dtype(dtype) for name, dtype in df.dtypes.items()})
+
+
+def _edit_session(view):
+    '''Edits, inserts and sorts, as the user, then undoes all edits'''
+    model = view.dataframe_model
+    view.enable_mutable_rows(True)
+    for col_ndx, value in enumerate(EDITS.values()):
+        assert model.setData(model.index(0, col_ndx), value, Qt.EditRole)
+    model.edit_cells(range(1, 6), range(5), [None] * 5)
+    assert model.insertRows(1, 2, None)
+    model.sort(4, Qt.DescendingOrder)
+    model.edit_cells([10, 11], [3, 4], [0.5, 4])
+    while model.undo():
+        pass
+
+
+def test_edits_keep_column_dtypes(make_view, df):
+    model = make_view(df).dataframe_model
+    for col_ndx, value in enumerate(EDITS.values()):
+        assert model.setData(model.index(0, col_ndx), value, Qt.EditRole)
+    model.edit_cells([1, 2], [3, 4], [1, 2])
+    assert model._df.dtypes.to_dict() == df.dtypes.to_dict()
+    assert model._df['s'].dtype.storage == 'pyarrow'
+
+    while model.undo():
+        pass
+    pd.testing.assert_frame_equal(model._df, df)
+
+
+def test_inserted_rows_use_nullable_dtypes(make_view, df):
+    view = make_view(df)
+    view.enable_mutable_rows(True)
+    model = view.dataframe_model
+    assert model.insertRows(1, 2, None)
+    assert model._df.dtypes.to_dict() == _nullable(df).dtypes.to_dict()
+    assert model._df.iloc[1:3].isna().all(axis=None)
+
+
+def test_mixed_updates_keep_column_dtypes(make_view, df):
+    model = make_view(df).dataframe_model
+    model.update_cells([0, 1, 2, 3, 4], [0, 1, 2, 3, 4], [7, True, 'z', 1, 2])
+    model.flush_updates()
+    assert model._df.dtypes.to_dict() == df.dtypes.to_dict()
+    assert model._df.iloc[[0, 1, 2, 3, 4], [0, 1, 2, 3, 4]].to_numpy().diagonal().tolist() \
+        == [7, True, 'z', 1.0, 2]
+
+
+def test_edit_session_keeps_dtypes_and_memory_footprint(make_view, df):
+    view = make_view(df)
+    _edit_session(view)
+    data = view.dataframe_model._df
+    expected = _nullable(df)
+    assert data.dtypes.to_dict() == expected.dtypes.to_dict()
+    assert not (data.dtypes == object).any()
+    assert (data.memory_usage(deep=True) <= expected.memory_usage(deep=True)).all()
+    # sorting isn't undone
+    columns = list(df.columns)
+    pd.testing.assert_frame_equal(data.sort_values(columns, ignore_index=True),
+                                  expected.sort_values(columns, ignore_index=True))
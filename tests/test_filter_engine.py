@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet._filter_engine import FilterEngine
+
+NUM_ROWS = 1003
+
+
+def _engine(masks):
+    engine = FilterEngine(NUM_ROWS)
+    for column, mask in masks.items():
+        engine.set_mask(column, mask)
+    return engine
+
+
+def _check(engine, masks):
+    '''Compares `engine` with the unpacked `masks`'''
+    expected = np.logical_and.reduce(list(masks.values()))
+    assert np.array_equal(engine.accepted, expected)
+    assert engine.count() == expected.sum()
+    for column in masks:
+        assert np.array_equal(engine.column_mask(column), masks[column])
+        others = [mask for key, mask in masks.items() if key != column]
+        excluding = np.logical_and.reduce(others) if others else np.ones(engine.size, dtype=bool)
+        assert np.array_equal(engine.accepted_excluding(column), excluding)
+        assert engine.count_excluding(column) == excluding.sum()
+
+
+@pytest.fixture
+def masks():
+    rng = np.random.default_rng(0)
+    return {column: rng.random(NUM_ROWS) < 0.7 for column in (3, 0, 5)}
+
+
+def test_masks_are_anded(masks):
+    engine = _engine(masks)
+    assert engine.columns == [3, 0, 5]
+    _check(engine, masks)
+
+    engine.remove(0)
+    masks.pop(0)
+    _check(engine, masks)
+
+
+def test_patch_sets_rows_of_one_mask(masks):
+    engine = _engine(masks)
+    rows = np.array([0, 7, 8, 63, 64, 500, NUM_ROWS - 1])
+    values = np.array([True, False, True, False, True, False, True])
+    engine.patch(0, rows, values)
+    masks[0][rows] = values
+    assert np.array_equal(engine.rows_accepted(rows),
+                          np.logical_and.reduce([mask[rows] for mask in masks.values()]))
+    engine.update()
+    _check(engine, masks)
+
+
+@pytest.mark.parametrize('at_index', [0, 100, NUM_ROWS])
+def test_inserted_rows_are_accepted(masks, at_index):
+    engine = _engine(masks)
+    engine.insert_rows(at_index, 70)
+    for column, mask in masks.items():
+        masks[column] = np.insert(mask, at_index, np.ones(70, dtype=bool))
+    assert engine.size == NUM_ROWS + 70
+    engine.update()
+    _check(engine, masks)
+
+
+def test_removed_rows_drop_their_bits(masks):
+    engine = _engine(masks)
+    engine.remove_rows(60, 100)
+    for column, mask in masks.items():
+        masks[column] = np.delete(mask, np.s_[60:160])
+    engine.update()
+    _check(engine, masks)
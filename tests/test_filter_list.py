@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet.predicates import Between
+
+
+@pytest.fixture
+def view(make_view):
+    return make_view(pd.DataFrame({
+        'city': ['Paris', 'paris', 'Rome', None, 'Oslo', 'Rome', None, 'PARIS'],
+        'n': np.arange(8, dtype=float),
+    }))
+
+
+def test_counts_merge_values_with_the_same_text(view):
+    proxy = view._proxy
+    proxy.set_filter_key_column(0)
+    values, checked = proxy.get_model_values()
+    assert values.size == 8 and checked.all()
+
+    display = proxy._display_function(0)
+    counts = proxy.display_counts(values)
+    assert counts == {'paris': 3, 'rome': 2, 'oslo': 1, display(None).lower(): 2}
+    assert sum(counts.values()) == values.size
+
+
+def test_counts_are_of_rows_accepted_by_other_filters(view):
+    proxy = view._proxy
+    proxy.set_filter_key_column(1)
+    proxy.predicate_filter(Between(1, 5))
+
+    proxy.set_filter_key_column(0)
+    values, checked = proxy.get_model_values()
+    assert sorted(values.index) == [1, 2, 3, 4, 5]
+    # the column itself isn't filtered
+    assert checked.all()
+    display = proxy._display_function(0)
+    assert proxy.display_counts(values) == {'paris': 1, 'rome': 2, 'oslo': 1,
+                                            display(None).lower(): 1}
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+from qspreadsheet.journal import EditJournal, read_records
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'x': np.arange(20, dtype=float), 's': list('abcdefghijklmnopqrst')})
+
+
+def _edit(model, row, column, value):
+    assert model.setData(model.index(row, column), value, Qt.EditRole)
+
+
+def test_recover_replays_the_edits(tmp_path, make_view, df):
+    path = str(tmp_path / 'table.journal')
+    model = make_view(df).dataframe_model
+    journal = EditJournal(path)
+    journal.attach(model)
+    _edit(model, 1, 0, 10.0)
+    _edit(model, 2, 1, 'z')
+    model.undo()
+    _edit(model, 3, 0, 30.0)
+    journal.close()
+    edited = model._df.copy()
+
+    # a record half written during a crash is dropped
+    with open(path, 'ab') as f:
+        f.write(b'\x10\x00\x00\x00partial')
+    recovered = make_view(df).dataframe_model
+    assert EditJournal(path).recover(recovered) == 4
+    pd.testing.assert_frame_equal(recovered._df, edited)
+    assert recovered.get_changes().updated.index.size == 2
+
+
+def test_compaction_keeps_the_records_after_the_checkpoint(tmp_path, qapp, make_view, df):
+    path = str(tmp_path / 'table.journal')
+    model = make_view(df).dataframe_model
+    journal = EditJournal(path, compact_bytes=1)
+    journal.attach(model)
+    for row in range(5):
+        _edit(model, row, 0, -float(row))
+        journal._pool.waitForDone()
+        qapp.processEvents()
+    journal.close()
+
+    assert os.path.exists(journal.checkpoint_path)
+    # the journal keeps the records not in the checkpoint
+    assert len(list(read_records(path))) < 5
+    recovered = make_view(df).dataframe_model
+    EditJournal(path).recover(recovered)
+    pd.testing.assert_frame_equal(recovered._df, model._df)
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet._ndx import _KeyIndex
+
+
+def test_positions_of_keys():
+    index = _KeyIndex('id', pd.Series([10, 20, 30]))
+    positions = index.get_positions(pd.Series([30, 10, 99]))
+    assert positions.tolist() == [2, 0, -1]
+
+
+def test_duplicate_keys_map_to_last_row():
+    index = _KeyIndex('id', pd.Series(['a', 'b', 'a']))
+    index.extend(pd.Series(['b']))
+    assert index.get_positions(pd.Series(['a', 'b'])).tolist() == [2, 3]
+
+
+def test_appended_keys():
+    index = _KeyIndex('id', pd.Series(np.arange(1000)))
+    for start in range(1000, 2000, 10):
+        index.extend(pd.Series(np.arange(start, start + 10)))
+    assert index.size == 2000
+    keys = pd.Series(np.random.default_rng(0).permutation(2000))
+    assert np.array_equal(index.get_positions(keys), keys.to_numpy())
+    # appends are merged, so lookups don't go through every batch
+    assert len(index._segments) < 10
+
+
+def test_null_and_string_keys():
+    index = _KeyIndex('id', pd.Series(['x', None, 'y'], dtype=object))
+    assert index.get_positions(pd.Series(['y', None, 'z'], dtype=object)).tolist() == [2, 1, -1]
+
+
+def test_upsert_rows_updates_and_appends_by_key(make_view):
+    model = make_view(pd.DataFrame({'id': [1, 2, 3], 'value': [1.0, 2.0, 3.0]})).dataframe_model
+    model.upsert_rows(pd.DataFrame({'id': [3, 4], 'value': [30.0, 40.0]}), key='id')
+    model.flush_appends()
+    model.upsert_rows(pd.DataFrame({'id': [4, 1], 'value': [400.0, 100.0]}), key='id')
+    model.flush_appends()
+    assert model._df['id'].tolist() == [1, 2, 3, 4]
+    assert model._df['value'].tolist() == [100.0, 2.0, 30.0, 400.0]
+    assert model._df.dtypes.to_dict() == {'id': np.dtype('int64'), 'value': np.dtype('float64')}
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet.predicates import Between
+
+
+def _notifications(model):
+    events = []
+    model.rowsRemoved.connect(lambda parent, first, last: events.append(('removed', first, last)))
+    model.rowsInserted.connect(lambda parent, first, last: events.append(('inserted', first, last)))
+    model.layoutChanged.connect(lambda *args: events.append(('layout',)))
+    model.modelReset.connect(lambda: events.append(('reset',)))
+    return events
+
+
+def _new_snapshot(df, removed, changed):
+    new_df = df.drop(index=removed)
+    new_df.loc[changed, 'x'] = -1.0
+    added = pd.DataFrame({'id': [10_000, 10_001], 'x': [0.5, 0.25]})
+    return pd.concat([new_df, added], ignore_index=True)
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'id': np.arange(1000), 'x': np.arange(1000, dtype=float)})
+
+
+def test_refresh_notifies_removed_ranges_and_appended_rows(make_view, df):
+    model = make_view(df).dataframe_model
+    events = _notifications(model)
+    new_df = _new_snapshot(df, removed=[3, 4, 500], changed=[10, 600])
+    model.refresh(new_df, key='id')
+
+    assert events == [('removed', 500, 500), ('removed', 3, 4), ('inserted', 997, 998)]
+    pd.testing.assert_frame_equal(model._df, new_df)
+    assert model.row_ids.size == new_df.index.size
+    assert not model.is_dirty
+
+
+def test_refresh_with_scattered_removals_keeps_filters(make_view, df):
+    view = make_view(df)
+    model, proxy = view.dataframe_model, view._proxy
+    proxy.set_filter_key_column(1)
+    proxy.predicate_filter(Between(100, 900))
+    events = _notifications(model)
+
+    removed = list(range(0, 1000, 10))
+    assert len(removed) > model.REFRESH_MAX_RUNS
+    new_df = _new_snapshot(df, removed=removed, changed=[101, 555])
+    model.refresh(new_df, key='id')
+
+    assert ('reset',) not in events and events.count(('layout',)) == 1
+    pd.testing.assert_frame_equal(model._df, new_df)
+    assert model.row_ids.size == new_df.index.size
+    assert 1 in proxy.predicates
+    expected = Between(100, 900).mask(new_df['x'])
+    assert np.array_equal(proxy._engine.accepted, expected)
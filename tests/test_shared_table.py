@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+from qspreadsheet.shared_table import SharedTablePublisher, SharedTableSubscriber
+
+
+@pytest.fixture
+def shared(make_view):
+    df = pd.DataFrame({'x': np.arange(10_000, dtype=float), 'n': np.arange(10_000)})
+    publisher = SharedTablePublisher.from_frame(df, capacity=20_000)
+    subscriber = SharedTableSubscriber(publisher.name)
+    view = make_view(df.iloc[:0])
+    subscriber.attach(view.dataframe_model)
+    yield df, publisher, subscriber, view.dataframe_model
+    subscriber.close()
+    publisher.close()
+
+
+def test_poll_notifies_changed_blocks_only(shared):
+    df, publisher, subscriber, model = shared
+    assert model._df['x'].tolist() == df['x'].tolist()
+    written = []
+    model.cells_written.connect(lambda rows, columns: written.append((rows[0], rows[-1])))
+
+    subscriber.poll()
+    assert written == []
+    publisher.publish(pd.DataFrame({'x': [-1.0], 'n': [5000]}), start=5000, num_rows=10_000)
+    subscriber.poll()
+    assert written == [(4096, 8191)]
+    # the model works on the shared memory
+    assert model._df['x'].iloc[5000] == -1.0
+
+
+def test_poll_picks_up_appended_rows(shared):
+    df, publisher, subscriber, model = shared
+    publisher.publish(pd.DataFrame({'x': [1.5, 2.5], 'n': [1, 2]}), start=10_000)
+    subscriber.poll()
+    assert model._df.index.size == 10_002
+    assert model._df['x'].iloc[-2:].tolist() == [1.5, 2.5]
+
+
+def test_attached_model_is_read_only_and_unsortable(shared):
+    df, publisher, subscriber, model = shared
+    assert not model.setData(model.index(0, 0), 99.0, Qt.EditRole)
+    model.sort(0, Qt.DescendingOrder)
+    assert model._df['x'].iloc[0] == 0.0
+    publisher.publish(pd.DataFrame({'x': [42.0], 'n': [0]}), start=0, num_rows=10_000)
+    subscriber.poll()
+    assert model._df['x'].iloc[0] == 42.0
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet import sketches
+from qspreadsheet.sketches import ColumnSketch, HeavyHitters, HyperLogLog, TDigest, exact_summary
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.mark.parametrize('distinct', [100, 5_000, 300_000])
+def test_distinct_count_within_error_bound(rng, distinct):
+    values = pd.Series(rng.permutation(np.arange(distinct).repeat(2)))
+    hll = HyperLogLog()
+    hll.add(values)
+    # 4 standard errors
+    assert abs(hll.estimate() - distinct) <= 4 * 1.04 / np.sqrt(hll.registers.size) * distinct
+
+    halves = HyperLogLog(), HyperLogLog()
+    halves[0].add(values.iloc[::2])
+    halves[1].add(values.iloc[1::2])
+    halves[0].merge(halves[1])
+    assert np.array_equal(halves[0].registers, hll.registers)
+
+
+def test_quantiles_within_rank_error(rng):
+    values = rng.lognormal(size=200_000)
+    digest = TDigest()
+    for chunk in np.array_split(values, 7):
+        digest.add(chunk)
+    assert digest.count == values.size
+    assert digest.means.size <= digest.compression
+
+    values.sort()
+    q = np.array([0.001, 0.01, 0.1, 0.5, 0.9, 0.99, 0.999])
+    ranks = np.searchsorted(values, digest.quantile(q)) / values.size
+    assert np.all(np.abs(ranks - q) <= 0.001)
+    assert digest.quantile([0, 1]).tolist() == [values[0], values[-1]]
+    assert np.allclose(digest.cdf(digest.quantile(q)), q, atol=0.005)
+
+
+def test_heavy_hitters_count_lower_bounds(rng):
+    values = pd.Series(rng.zipf(1.5, 100_000))
+    hitters = HeavyHitters(capacity=50)
+    for start in range(0, values.size, 10_000):
+        hitters.add(values.iloc[start: start + 10_000])
+    exact = values.value_counts()
+    top = hitters.top(5)
+    assert [value for value, _ in top] == exact.index[:5].tolist()
+    for value, count in hitters.counts.items():
+        assert exact[value] - hitters.error <= count <= exact[value]
+    # values over count / (capacity + 1) are kept
+    threshold = values.size / (hitters.capacity + 1)
+    assert set(exact[exact > threshold].index) <= set(hitters.counts)
+
+
+def test_column_sketch_matches_exact_summary(rng, monkeypatch):
+    monkeypatch.setattr(sketches, 'SKETCH_CHUNK_SIZE', 10_000)
+    column = pd.Series(pd.to_datetime('2020-01-01')
+                       + pd.to_timedelta(rng.integers(0, 1000, 50_000), unit='D'))
+    column[rng.random(column.size) < 0.1] = pd.NaT
+    summary = ColumnSketch(column).summary(num_ticks=11)
+    exact = exact_summary(column, num_ticks=11)
+
+    assert (summary.count, summary.null_count) == (exact.count, exact.null_count)
+    assert abs(summary.distinct - exact.distinct) <= 0.03 * exact.distinct
+    errors = [abs(a - b) for a, b in zip(summary.quantiles, exact.quantiles)]
+    assert max(errors) <= pd.Timedelta(days=15)
+    assert not summary.exact and exact.exact
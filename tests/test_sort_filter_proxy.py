@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet.predicates import Between
+
+
+def _range_filtered_view(make_view, qapp, num_rows=3000):
+    view = make_view(pd.DataFrame({'x': np.arange(num_rows, dtype=float)}))
+    model, proxy = view.dataframe_model, view._proxy
+    model.set_viewport(0, 99)
+    proxy.set_filter_key_column(0)
+    proxy.predicate_filter(Between(1000, 2000))
+    # the sorted index is built in the background
+    proxy._pool.waitForDone()
+    qapp.processEvents()
+    return model, proxy
+
+
+def test_sorted_index_patched_by_updates_outside_viewport(make_view, qapp):
+    model, proxy = _range_filtered_view(make_view, qapp)
+    assert 0 in proxy._sorted_indexes
+
+    model.update_cells([1600, 10], 0, [-1.0, 1500.0])
+    model.flush_updates()
+    column = model._df['x']
+    assert np.array_equal(proxy._sorted_indexes[0].range_mask(1000, 2000),
+                          Between(1000, 2000).mask(column))
+
+
+def test_updates_outside_viewport_are_refiltered(make_view, qapp):
+    model, proxy = _range_filtered_view(make_view, qapp)
+    model.update_cells([1600, 10], 0, [-1.0, 1500.0])
+    model.flush_updates()
+    accepted = proxy._engine.accepted
+    assert not accepted[1600] and accepted[10]
+    assert proxy.accepted_count() == 1001
+    # the proxy maps the rows shown and hidden by the writes
+    assert proxy.rowCount() == 1001 + model.row_ndx.count_virtual
+    assert proxy.mapFromSource(model.index(10, 0)).row() == 0
+    assert not proxy.mapFromSource(model.index(1600, 0)).isValid()
+
+
+def test_scattered_flips_outside_viewport_are_refiltered(make_view, qapp):
+    model, proxy = _range_filtered_view(make_view, qapp)
+    rows = np.arange(0, 1000, 10)
+    model.update_cells(rows, 0, np.full(rows.size, 1500.0))
+    model.flush_updates()
+    assert proxy.rowCount() == 1001 + rows.size + model.row_ndx.count_virtual
+    assert proxy.mapFromSource(model.index(990, 0)).row() == rows.size - 1
+
+
+def test_edited_rows_stay_visible_with_keep_visible_policy(make_view, qapp):
+    model, proxy = _range_filtered_view(make_view, qapp)
+    proxy.setData(proxy.mapFromSource(model.index(1500, 0)), -1.0)
+    assert proxy._engine.accepted[1500]
+    assert proxy.mapFromSource(model.index(1500, 0)).isValid()
+    model.update_cells([1501], 0, [-1.0])
+    assert not proxy._engine.accepted[1501]
+    assert not proxy.mapFromSource(model.index(1501, 0)).isValid()
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+from qspreadsheet.sql_writeback import SQLiteWriteback
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'ts': pd.date_range('2020-01-01', periods=4, freq='D'),
+                         'x': [1.0, 2.0, 3.0, 4.0]})
+
+
+@pytest.fixture
+def path(tmp_path, df):
+    path = str(tmp_path / 'table.db')
+    with sqlite3.connect(path) as connection:
+        df.to_sql('t', connection, index=False)
+    return path
+
+
+def _write(qapp, writeback):
+    assert writeback.write()
+    writeback.wait()
+    qapp.processEvents()
+
+
+def _read(path):
+    with sqlite3.connect(path) as connection:
+        return pd.read_sql('SELECT * FROM t ORDER BY ts', connection)
+
+
+def test_edits_are_written_by_datetime_key(qapp, make_view, df, path):
+    model = make_view(df).dataframe_model
+    writeback = SQLiteWriteback(model, path, 't', key='ts')
+    committed = []
+    writeback.committed.connect(committed.append)
+    assert model.setData(model.index(1, 1), 20.0, Qt.EditRole)
+    _write(qapp, writeback)
+    writeback.close()
+
+    assert committed == [1]
+    assert _read(path)['x'].tolist() == [1.0, 20.0, 3.0, 4.0]
+    assert model.get_changes().is_empty
+
+
+def test_rows_not_found_stay_dirty(qapp, make_view, df, path):
+    model = make_view(df).dataframe_model
+    writeback = SQLiteWriteback(model, path, 't', key='ts')
+    errors = []
+    writeback.error.connect(errors.append)
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM t WHERE ts = '2020-01-03 00:00:00'")
+    model.edit_cells([1, 2], [1, 1], [20.0, 30.0])
+    _write(qapp, writeback)
+    writeback.close()
+
+    assert _read(path)['x'].tolist() == [1.0, 20.0, 4.0]
+    assert len(errors) == 1 and errors[0][0] is LookupError
+    assert model.get_changes().updated['x'].tolist() == [30.0]
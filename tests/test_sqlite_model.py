@@ -0,0 +1,79 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+from qspreadsheet.sqlite_model import SQLiteSource, SQLiteTableModel
+
+NUM_ROWS = 2000
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'table.db')
+    df = pd.DataFrame({'n': np.arange(NUM_ROWS),
+                       's': ['x{}'.format(i % 7) for i in range(NUM_ROWS)]})
+    with sqlite3.connect(path) as connection:
+        df.to_sql('t', connection, index=False)
+    source = SQLiteSource(path, table='t')
+    yield source
+    source.close()
+
+
+def _settle(model, qapp):
+    model._pool.waitForDone()
+    qapp.processEvents()
+
+
+def _value(model, row, column):
+    return model.data(model.index(row, column), Qt.EditRole)
+
+
+def test_pages_are_read_around_the_viewport(qapp, source):
+    model = SQLiteTableModel(source)
+    model.PAGE_SIZE = 100
+    _settle(model, qapp)
+    assert model.rowCount() == NUM_ROWS
+
+    model.set_viewport(550, 600)
+    _settle(model, qapp)
+    assert sorted(model._pages) == [4, 5, 6, 7]
+    assert _value(model, 555, 0) == 555
+
+    model.sort(0, Qt.DescendingOrder)
+    model.set_viewport(0, 10)
+    _settle(model, qapp)
+    assert _value(model, 0, 0) == NUM_ROWS - 1
+
+
+def test_filters_are_pushed_down(qapp, source):
+    model = SQLiteTableModel(source)
+    model.set_value_filter(1, ['x1', 'x2'])
+    _settle(model, qapp)
+    assert model.rowCount() == sum(i % 7 in (1, 2) for i in range(NUM_ROWS))
+
+    model.set_text_filter(0, '99')
+    _settle(model, qapp)
+    expected = [i for i in range(NUM_ROWS) if i % 7 in (1, 2) and '99' in str(i)]
+    assert model.rowCount() == len(expected)
+    model.set_viewport(0, 0)
+    _settle(model, qapp)
+    assert [_value(model, row, 0) for row in range(len(expected))] == expected
+
+    # distinct values are filtered by the other columns only
+    received = []
+    model.distinct_values_ready.connect(lambda column, values: received.append(values))
+    model.fetch_distinct_values(1)
+    _settle(model, qapp)
+    assert received == [sorted({'x{}'.format(i % 7) for i in range(NUM_ROWS)
+                                if '99' in str(i)})]
+
+    model.clear_filters()
+    _settle(model, qapp)
+    assert model.rowCount() == NUM_ROWS
@@ -0,0 +1,57 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from qspreadsheet.predicates import CONTAINS, FUZZY, REGEX, WHOLE_WORD
+
+
+@pytest.fixture
+def view(make_view):
+    return make_view(pd.DataFrame({
+        'city': ['Paris', 'Pariss', 'Rome', 'Roma', 'Oslo', 'New Paris', 'Parish', 'Lima'],
+    }))
+
+
+def _filter(qapp, proxy, text, mode):
+    proxy.set_filter_key_column(0)
+    proxy.string_filter(text, mode)
+    # regex and fuzzy filters are evaluated in the background
+    proxy._pool.waitForDone()
+    qapp.processEvents()
+    return np.flatnonzero(proxy._engine.accepted).tolist()
+
+
+@pytest.mark.parametrize('text, mode, expected', [
+    ('aris', CONTAINS, [0, 1, 5, 6]),
+    ('paris', WHOLE_WORD, [0, 5]),
+    (r'^rom[ae]$', REGEX, [2, 3]),
+    ('PARIS$', REGEX, [0, 5]),
+    ('pari', FUZZY, [0]),
+    ('paris', FUZZY, [0, 1, 6]),
+])
+def test_match_modes(qapp, view, text, mode, expected):
+    assert _filter(qapp, view._proxy, text, mode) == expected
+
+
+def test_invalid_regex_raises(view):
+    view._proxy.set_filter_key_column(0)
+    with pytest.raises(re.error):
+        view._proxy.string_filter('(paris', REGEX)
+
+
+def test_written_columns_drop_trigram_index(qapp, view):
+    model, proxy = view.dataframe_model, view._proxy
+    _filter(qapp, proxy, 'paris', FUZZY)
+    assert 0 in proxy._text_indexes
+
+    model.update_cells([4, 7], 0, ['Parid', 'Pars'])
+    assert 0 not in proxy._text_indexes
+    # the filter is evaluated again for the written rows
+    assert np.flatnonzero(proxy._engine.accepted).tolist() == [0, 1, 4, 6, 7]
+    assert _filter(qapp, proxy, 'paris', FUZZY) == [0, 1, 4, 6, 7]
+    assert 0 in proxy._text_indexes
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+from PySide2.QtCore import Qt
+
+from qspreadsheet.undo import CellsEdit, UndoJournal
+
+
+def _entry(size: int) -> CellsEdit:
+    positions = np.arange(size)
+    return CellsEdit(positions, positions, np.zeros(size, dtype=np.int64),
+                     np.zeros(size), np.ones(size))
+
+
+def test_redo_entries_count_in_memory_budget(qapp):
+    journal = UndoJournal()
+    entries = [_entry(100) for _ in range(3)]
+    for entry in entries:
+        journal.record(entry)
+    total = sum(entry.nbytes for entry in entries)
+    assert journal.memory_bytes == total
+
+    journal.take_undo()
+    journal.take_undo()
+    assert journal.memory_bytes == total
+    journal.take_redo()
+    assert journal.memory_bytes == total
+
+    # a new edit drops the redo entries
+    new_entry = _entry(10)
+    journal.record(new_entry)
+    assert journal.memory_bytes == entries[0].nbytes + entries[1].nbytes + new_entry.nbytes
+
+
+def test_undo_and_redo_stacks_spill_over_budget(qapp):
+    entries = [_entry(100 + i) for i in range(4)]
+    journal = UndoJournal(max_bytes=2 * entries[-1].nbytes)
+    for entry in entries:
+        journal.record(entry)
+    assert journal.spilled_count == 2
+
+    undone = []
+    while journal.can_undo:
+        undone.append(journal.take_undo())
+        assert journal.memory_bytes <= journal.max_bytes
+    assert [entry.positions.size for entry in undone] == [103, 102, 101, 100]
+    assert journal.spilled_count == 2
+
+    redone = []
+    while journal.can_redo:
+        redone.append(journal.take_redo())
+        assert journal.memory_bytes <= journal.max_bytes
+    assert [entry.positions.size for entry in redone] == [100, 101, 102, 103]
+
+
+def test_edit_and_undo_keep_column_dtypes(make_view):
+    df = pd.DataFrame({'i': [1, 2, 3], 'f': [1.5, 2.5, 3.5]})
+    model = make_view(df).dataframe_model
+    assert model.setData(model.index(0, 0), 10, Qt.EditRole)
+    assert model.setData(model.index(1, 1), 7, Qt.EditRole)
+    model.edit_cells([2, 2], [0, 1], [30, 0.25])
+    while model.undo():
+        pass
+    assert model._df.dtypes.to_dict() == df.dtypes.to_dict()
+    pd.testing.assert_frame_equal(model._df, df)
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+
+def _data_changed(model):
+    changes = []
+    model.dataChanged.connect(lambda top_left, bottom_right, *args: changes.append(
+        (top_left.row(), top_left.column(), bottom_right.row(), bottom_right.column())))
+    return changes
+
+
+def test_updates_are_merged_by_region(make_view):
+    model = make_view(pd.DataFrame({'a': np.zeros(1000), 'b': np.zeros(1000)})).dataframe_model
+    changes = _data_changed(model)
+    rows = [3, 7, 5, 2 * model.REGION_ROWS + 1]
+    model.update_cells(rows, 0, [1.0, 2.0, 3.0, 4.0])
+    model.update_cells([4], 1, [5.0])
+    assert changes == []
+
+    model.flush_updates()
+    assert sorted(changes) == [(3, 0, 7, 1),
+                               (2 * model.REGION_ROWS + 1, 0, 2 * model.REGION_ROWS + 1, 0)]
+    assert model._df['a'].iloc[rows].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert model._df['b'].iloc[4] == 5.0
+
+
+def test_updates_outside_viewport_are_written_but_not_repainted(make_view):
+    model = make_view(pd.DataFrame({'a': np.zeros(1000)})).dataframe_model
+    model.set_viewport(0, 99)
+    changes = _data_changed(model)
+    written = []
+    model.cells_written.connect(lambda rows, columns: written.append((list(rows), list(columns))))
+    model.update_cells([10, 900], 0, [1.0, 2.0])
+    model.flush_updates()
+    assert changes == [(10, 0, 10, 0)]
+    assert written == [([10, 900], [0])]
+    assert model._df['a'].iloc[900] == 2.0
+
+
+def test_updates_after_appends_reach_arrow_columns(make_view):
+    pytest.importorskip('pyarrow')
+    df = pd.DataFrame({'s': pd.array(['a', 'b'], dtype='string[pyarrow]'), 'x': [1.0, 2.0]})
+    model = make_view(df).dataframe_model
+    model.append_rows(pd.DataFrame({'s': ['c'], 'x': [3.0]}))
+    model.flush_appends()
+    model.update_cells([0, 0], [0, 1], ['ZZ', 9.0])
+    assert model._df['s'].tolist() == ['ZZ', 'b', 'c']
+    assert model._df['x'].tolist() == [9.0, 2.0, 3.0]
+    assert model._df['s'].dtype == df['s'].dtype
+
+    # the next write drops the buffer, the updates must be kept
+    model.update_cells([1], [0], ['YY'])
+    model.flush_appends()
+    assert model._df['s'].tolist() == ['ZZ', 'YY', 'c']
@@ -0,0 +1,47 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the package imports PySide2 in every module
+pytest.importorskip('PySide2')
+
+
+def test_pushes_from_threads_keep_column_dtypes(make_view):
+    df = pd.DataFrame({'i': np.arange(100), 'f': np.zeros(100), 's': ['a'] * 100})
+    model = make_view(df).dataframe_model
+    queue = model.enable_update_queue()
+
+    def push(start):
+        for row in range(start, start + 10):
+            queue.push_cells([row, row], [0, 2], [row * 10, 'x{}'.format(row)])
+            queue.push_cells([row], [1], [row / 2])
+
+    threads = [threading.Thread(target=push, args=(start,)) for start in range(0, 100, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.drain()
+
+    assert model._df.dtypes.to_dict() == df.dtypes.to_dict()
+    assert model._df['i'].tolist() == list(range(0, 1000, 10))
+    assert model._df['f'].tolist() == [row / 2 for row in range(100)]
+    assert model._df['s'].iloc[42] == 'x42'
+
+
+def test_snapshot_copies_changed_columns_only(make_view):
+    df = pd.DataFrame({'a': np.zeros(1000), 'b': np.ones(1000)})
+    model = make_view(df).dataframe_model
+    version, first = model.snapshot()
+    assert model.snapshot()[1] is first
+    assert not np.shares_memory(first['a'].to_numpy(), model._df['a'].to_numpy())
+
+    model.update_cells([5], 0, [7.0])
+    new_version, second = model.snapshot()
+    assert new_version > version
+    assert first['a'].iloc[5] == 0.0 and second['a'].iloc[5] == 7.0
+    assert np.shares_memory(first['b'].to_numpy(), second['b'].to_numpy())
+    assert not np.shares_memory(first['a'].to_numpy(), second['a'].to_numpy())
+    pd.testing.assert_frame_equal(second, model._df.loc[~model.row_ndx.in_progress_mask])